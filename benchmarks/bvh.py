@@ -0,0 +1,94 @@
+# Scene scaling with and without the BVH: build/refit cost on the CPU and frame time on the GPU.
+# First checks that overlapping shapes get the same contact IDs either way.
+# Run from the repo root (set RAYCEKAR_HEADLESS=1 to run without a display): python -m benchmarks.bvh
+
+import logging, time
+import numpy as np
+
+import raycekar as rk
+from raycekar.coord import *
+from OpenGL import GL as gl
+
+
+viewportSize = vec2(200, 200)
+threadGroupSize = vec2(8, 4)
+sphereCounts = [10, 100, 1000, 10000]
+linearLimit = 1000      # The linear walk gets very slow past this on software drivers
+movingFraction = 0.1
+frameCount = 5
+overlapCount = 24       # Above scene.bvhMinShapes, so the BVH is used by default
+
+
+def buildScene(sphereCount):
+    # Spheres spread through a cube in front of the camera, sized so the cube stays about as full
+    scene = rk.env.scene()
+    scene.bvhMinShapes = 0
+    scene.addCamera(rk.env.camera(vec3(0, -6, 0), quat.fromAxisAngle(vec4(1, 0, 0, deg(0))), deg(70)))
+    rng = np.random.default_rng(0)
+    radius = 1.5 / sphereCount ** (1 / 3)
+    spheres = []
+    for pos in rng.uniform(-2, 2, (sphereCount, 3)).tolist():
+        spheres.append(rk.env.sphere(vec3(*pos), radius))
+        scene.addShape(spheres[-1])
+    return scene, spheres
+
+def contactsWith(scene, useBVH):
+    scene.useBVH = useBVH
+    rk.gl.compileScene(scene)
+    rk.gl.paintScene()
+    rk.gl.getContactsScene()
+    return rk.gl.contacts.scene.copy()
+
+def checkOverlapping():
+    # A row of spheres, each overlapping its neighbours, so many pixels have more than one shape
+    # within thres. The BVH has to pick the same one as the linear walk.
+    scene = rk.env.scene()
+    scene.addCamera(rk.env.camera(vec3(0, -4, 0), quat.fromAxisAngle(vec4(1, 0, 0, deg(0))), deg(70)))
+    for i in range(overlapCount):
+        scene.addShape(rk.env.sphere(vec3((i - overlapCount / 2) * 0.25, 0, 0), 0.3))
+    bvhContacts, linearContacts = contactsWith(scene, True), contactsWith(scene, False)
+    differing = np.count_nonzero(bvhContacts != linearContacts)
+    print('Overlapping spheres: {} of {} contacts differ between the BVH and the linear walk'.format(differing, len(bvhContacts)))
+    assert differing == 0
+
+def frameTime(scene, useBVH):
+    scene.useBVH = useBVH
+    rk.gl.compileScene(scene)
+    gl.glFinish()
+    startTime = time.perf_counter()
+    for frame in range(frameCount):
+        rk.gl.paintScene()
+    gl.glFinish()
+    return (time.perf_counter() - startTime) / frameCount
+
+def run(sphereCount):
+    scene, spheres = buildScene(sphereCount)
+
+    startTime = time.perf_counter()
+    scene.update()
+    buildTime = time.perf_counter() - startTime
+
+    moving = scene.select(spheres[:max(1, int(sphereCount * movingFraction))])
+    moving['pos'] = moving['pos'] + 0.01
+    startTime = time.perf_counter()
+    scene.update()
+    refitTime = time.perf_counter() - startTime
+
+    bvhTime = frameTime(scene, True)
+    linearTime = frameTime(scene, False) if sphereCount <= linearLimit else None
+    print('{:>6} {:>10.6f} {:>10.6f} {:>10.6f} {:>10}'.format(
+        sphereCount, buildTime, refitTime, bvhTime,
+        'skipped' if linearTime is None else '{:.6f}'.format(linearTime)
+    ))
+
+
+### Main section ###
+if __name__ == '__main__':
+    rk.util.setLogLevel(logging.INFO)
+    rk.ui.initialize()
+
+    with rk.ui.createWindow('BVH benchmark', viewportSize, visible=False):
+        rk.gl.initialize(viewportSize, threadGroupSize)
+        checkOverlapping()
+        print('{:>6} {:>10} {:>10} {:>10} {:>10}'.format('Shapes', 'Build', 'Refit', 'BVH frame', 'Linear'))
+        for sphereCount in sphereCounts: run(sphereCount)
@@ -0,0 +1,58 @@
+# March steps and frame time with and without the cone pre-pass, for a few tile sizes.
+# Run from the repo root (set RAYCEKAR_HEADLESS=1 to run without a display): python -m benchmarks.coneMarch
+
+import logging, time
+import numpy as np
+
+import raycekar as rk
+from raycekar.coord import *
+from OpenGL import GL as gl
+
+
+viewportSize = vec2(320, 240)
+threadGroupSize = vec2(8, 4)
+tileSizes = [None, 4, 8, 16]
+sphereCount = 200
+frameCount = 5
+
+
+def buildScene():
+    # Spheres spread through a box in front of the camera, with plenty of empty space between them
+    scene = rk.env.scene()
+    scene.addCamera(rk.env.camera(vec3(0, -6, 0), quat.fromAxisAngle(vec4(1, 0, 0, deg(0))), deg(70)))
+    rng = np.random.default_rng(0)
+    for pos in rng.uniform((-3, -2, -2), (3, 4, 2), (sphereCount, 3)).tolist():
+        scene.addShape(rk.env.sphere(vec3(*pos), 0.15))
+    return scene
+
+def run(scene, tileSize):
+    rk.gl.setConeMarching(not tileSize is None, tileSize or 8)
+    rk.gl.compileScene(scene)
+
+    rk.gl.setStepCounting(True)
+    rk.gl.paintScene()
+    stats = rk.gl.marchStats()
+    rk.gl.setStepCounting(False)
+
+    gl.glFinish()
+    startTime = time.perf_counter()
+    for frame in range(frameCount):
+        rk.gl.paintScene()
+    gl.glFinish()
+    seconds = (time.perf_counter() - startTime) / frameCount
+
+    print('{:>6} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.1f}'.format(
+        'off' if tileSize is None else tileSize, stats['stepsPerRay'], stats['stepsPerCone'], stats['stepsPerPixel'], seconds * 1000
+    ))
+
+
+### Main section ###
+if __name__ == '__main__':
+    rk.util.setLogLevel(logging.WARNING)
+    rk.ui.initialize()
+
+    with rk.ui.createWindow('Cone marching benchmark', viewportSize, visible=False):
+        rk.gl.initialize(viewportSize, threadGroupSize)
+        scene = buildScene()
+        print('{:>6} {:>10} {:>10} {:>10} {:>10}'.format('Tile', 'Steps/ray', 'Steps/cone', 'Steps/px', 'Frame ms'))
+        for tileSize in tileSizes: run(scene, tileSize)
@@ -0,0 +1,146 @@
+# Operations per second of raycekar.coord against the previous list-based vectors and quaternions,
+# which are kept below as the baseline. Run from the repo root: python -m benchmarks.coord [seconds]
+
+import sys, timeit
+from math import sqrt
+
+from raycekar.coord import *
+
+
+secondsPerCase = 0.5
+
+
+### Previous implementation ###
+class _oldVec():
+    def __init__(self, *values):
+        if len(values) != self._size: raise ValueError('need {} values, {} given'.format(self._size, len(values)))
+        else: self.values = values
+
+        self.x = self.values[0]
+        self.y = self.values[1]
+        if self._size >= 3: self.z = self.values[2]
+        if self._size >= 4: self.w = self.values[3]
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def _ensureSameSize(self, other):
+        if self._size != other._size: raise ValueError('cannot add vec{} and vec{}'.format(self._size, other._size))
+
+    def __add__(self, other):
+        self._ensureSameSize(other)
+        return oldVecN(*[self[i] + other[i] for i in range(self._size)])
+
+    def __sub__(self, other):
+        self._ensureSameSize(other)
+        return oldVecN(*[self[i] - other[i] for i in range(self._size)])
+
+    def __mul__(self, other):
+        return oldVecN(*[self[i] * other for i in range(self._size)])
+
+    def __truediv__(self, other):
+        return oldVecN(*[self[i] / other for i in range(self._size)])
+
+    def length(self):
+        return sqrt(sum([value * value for value in self.values]))
+
+    def normalize(self):
+        return self / self.length()
+
+class oldVec3(_oldVec): _size = 3
+class oldVec4(_oldVec): _size = 4
+
+def oldVecN(*values):
+    if len(values) == 3: return oldVec3(*values)
+    return oldVec4(*values)
+
+class oldQuat():
+    def __init__(self, n, ni, nj, nk):
+        self.n = n
+        self.ni = ni
+        self.nj = nj
+        self.nk = nk
+        self.components = [n, ni, nj, nk]
+
+    def _mulQuat(self, other):
+        q0 = self; q1 = other
+        return oldQuat(
+            q0.n  * q1.n  - q0.ni * q1.ni - q0.nj * q1.nj - q0.nk * q1.nk,
+            q0.n  * q1.ni + q0.ni * q1.n  + q0.nj * q1.nk - q0.nk * q1.nj,
+            q0.n  * q1.nj + q0.nj * q1.n  + q0.nk * q1.ni - q0.ni * q1.nk,
+            q0.n  * q1.nk + q0.nk * q1.n  + q0.ni * q1.nj - q0.nj * q1.ni
+        )
+
+    def _mulVec(self, other):
+        vecQuat = oldQuat(0, *other)
+        resultQuat = (self * vecQuat) * self.conjugate()
+        return oldVec3(resultQuat.ni, resultQuat.nj, resultQuat.nk)
+
+    def __mul__(self, other):
+        if isinstance(other, oldQuat): return self._mulQuat(other)
+        elif isinstance(other, oldVec3): return self._mulVec(other)
+
+    def conjugate(self):
+        return oldQuat(self.n, -self.ni, -self.nj, -self.nk)
+
+
+### Cases ###
+# name: (setup namespace, old statement, new statement)
+def buildCases():
+    rot = quat.fromAxisAngle(vec4(0.6, 0, 0.8, deg(30)))
+    spin = quat.fromAxisAngle(vec4(0, 0, 1, deg(1)))
+    names = {
+        'a': vec3(1.0, 2.0, 3.0), 'b': vec3(0.5, -1.0, 2.0), 'out': vec3(0, 0, 0),
+        'q': rot, 'r': spin, 'qi': quat(rot.n, rot.ni, rot.nj, rot.nk),
+        'oa': oldVec3(1.0, 2.0, 3.0), 'ob': oldVec3(0.5, -1.0, 2.0),
+        'oq': oldQuat(rot.n, rot.ni, rot.nj, rot.nk), 'or_': oldQuat(spin.n, spin.ni, spin.nj, spin.nk),
+        'vec3': vec3, 'oldVec3': oldVec3,
+    }
+    cases = [
+        ('construct vec3',      'oldVec3(1.0, 2.0, 3.0)',   'vec3(1.0, 2.0, 3.0)'),
+        ('vec3 + vec3',         'oa + ob',                  'a + b'),
+        ('vec3 * scalar',       'oa * 0.5',                 'a * 0.5'),
+        ('vec3 normalize',      'oa.normalize()',           'a.normalize()'),
+        ('vec3 iadd',           'oa + ob',                  'out.iadd(b)'),
+        ('vec3 imul',           'oa * 1.0',                 'out.imul(1.0)'),
+        ('quat * quat',         'oq * or_',                 'q * r'),
+        ('quat imul',           'oq * or_',                 'qi.imul(r)'),
+        ('quat * vec3',         'oq * oa',                  'q * a'),
+        ('quat rotateInto',     'oq * oa',                  'q.rotateInto(a, out)'),
+    ]
+    return names, cases
+
+def checkInPlace():
+    # In-place operations must match the operators, also when an operand is the receiver
+    def close(a, b): return all(abs(x - y) < 1e-6 for x, y in zip(a, b))
+    q = quat.fromAxisAngle(vec4(0, 0, 1, deg(90)))
+    r = quat.fromAxisAngle(vec4(0.6, 0, 0.8, deg(30)))
+    a = vec3(1.0, 2.0, 3.0)
+    assert close(quat(*q).imul(r), q * r)
+    assert close(quat(*q).imul(q), q * q) and close(q * q, quat.fromAxisAngle(vec4(0, 0, 1, deg(180))))
+    selfProduct = quat(*q)
+    assert close(selfProduct.imul(selfProduct), q * q)
+    assert close(vec3(*a).iadd(a), a + a) and close(vec3(*a).isub(a), a - a)
+    selfSum = vec3(*a)
+    assert close(selfSum.iadd(selfSum), a + a)
+    selfRotated = vec3(*a)
+    assert close(r.rotateInto(selfRotated, selfRotated), r * a)
+
+def opsPerSecond(statement, names, seconds):
+    timer = timeit.Timer(statement, globals=names)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * seconds / elapsed))
+    return number / min(timer.repeat(3, number))
+
+
+### Main section ###
+if __name__ == '__main__':
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else secondsPerCase
+    checkInPlace()
+    names, cases = buildCases()
+
+    print('{:<18} {:>14} {:>14} {:>8}'.format('Operation', 'Previous op/s', 'Current op/s', 'Speedup'))
+    for name, oldStatement, newStatement in cases:
+        oldRate = opsPerSecond(oldStatement, names, seconds)
+        newRate = opsPerSecond(newStatement, names, seconds)
+        print('{:<18} {:>14,.0f} {:>14,.0f} {:>8.2f}'.format(name, oldRate, newRate, newRate / oldRate))
@@ -0,0 +1,64 @@
+# Scaling of the tiled CPU renderer from 1 to N processes, against a single in-process cpu.render,
+# then a mesh registered after the pool started, which the workers have to be sent. Needs no OpenGL. Run from the repo root: python -m benchmarks.cpu [max processes]
+
+import os, sys, time
+import numpy as np
+
+import raycekar as rk
+from raycekar.coord import *
+
+
+viewportSize = vec2(800, 800)
+sphereCount = 40
+frameCount = 3
+
+
+def buildScene():
+    scene = rk.env.scene()
+    scene.addCamera(rk.env.camera(vec3(0, -6, 0), quat.fromAxisAngle(vec4(1, 0, 0, deg(0))), deg(70)))
+    rng = np.random.default_rng(0)
+    for pos in rng.uniform(-2, 2, (sphereCount, 3)).tolist():
+        scene.addShape(rk.env.sphere(vec3(*pos), 0.4))
+    return scene
+
+def buildMeshScene():
+    # A tetrahedron baked small, so the check stays quick
+    corners = np.array([[1, 1, 1], [1, -1, -1], [-1, 1, -1], [-1, -1, 1]], np.float64)
+    triangles = corners[[[0, 1, 2], [0, 3, 1], [0, 2, 3], [1, 3, 2]]]
+    scene = buildScene()
+    scene.addShape(rk.env.mesh(vec3(0, 0, 0), quat.fromAxisAngle(vec4(0, 0, 1, deg(30))), 1.5, rk.mesh.bake(triangles, 24, processes=1)))
+    return scene
+
+def frameTime(render, shapeBuffers):
+    render(shapeBuffers)    # Warm up: pool start, first scene copy
+    startTime = time.perf_counter()
+    for frame in range(frameCount):
+        render(shapeBuffers)
+    return (time.perf_counter() - startTime) / frameCount
+
+
+### Main section ###
+if __name__ == '__main__':
+    maxProcesses = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    shapeBuffers, lightBuffers = buildScene().compileBufferData()
+
+    reference, referenceContacts = rk.cpu.render(shapeBuffers, viewportSize)
+    singleTime = frameTime(lambda buffers: rk.cpu.render(buffers, viewportSize), shapeBuffers)
+    print('In-process render: {:.4f} s/frame'.format(singleTime))
+
+    print('{:>9} {:>10} {:>8} {:>10}'.format('Processes', 'Frame', 'Speedup', 'Efficiency'))
+    baseTime = None
+    processCounts = sorted(set([1, 2, 4, 8, 16, 32, 64, maxProcesses]) & set(range(1, maxProcesses + 1)))
+    for processes in processCounts:
+        with rk.cpu.tiledRenderer(viewportSize, processes) as renderer:
+            tiledTime = frameTime(renderer.render, shapeBuffers)
+            assert np.array_equal(renderer.image, reference) and np.array_equal(renderer.contacts, referenceContacts)
+        baseTime = baseTime or tiledTime
+        print('{:>9} {:>10.4f} {:>8.2f} {:>10.2f}'.format(processes, tiledTime, baseTime / tiledTime, baseTime / tiledTime / processes))
+
+    with rk.cpu.tiledRenderer(viewportSize, min(2, maxProcesses)) as renderer:
+        shapeBuffers, lightBuffers = buildMeshScene().compileBufferData()
+        reference, referenceContacts = rk.cpu.render(shapeBuffers, viewportSize)
+        renderer.render(shapeBuffers)
+        assert np.array_equal(renderer.image, reference) and np.array_equal(renderer.contacts, referenceContacts)
+    print('Mesh registered after the pool started: matches cpu.render')
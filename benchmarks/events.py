@@ -0,0 +1,52 @@
+# Event dispatch throughput with logging off, on, and on through the background queue. Output goes
+# to os.devnull so only the cost on the dispatching thread is measured. First checks that an event
+# bound by name alone, the way the baseline did, fires from the GLFW key callback.
+# Needs no window. Run from the repo root: python -m benchmarks.events [dispatches]
+
+import logging, os, sys, time
+
+from raycekar import events, ui, util
+
+
+bindingCount = 300
+dispatchCount = 100000
+
+
+def dispatchRate(count):
+    codes = [32 + i % bindingCount for i in range(count)]
+    startTime = time.perf_counter()
+    for code in codes:
+        events.dispatch('key', code, (1,))
+    return count / (time.perf_counter() - startTime)
+
+
+def checkNamedEvent():
+    fired = []
+    named = events.event('key_ESCAPE', fired.append)
+    named.activate()
+    ui.keys._callback(None, ui.keys.ESCAPE, 0, 1, 0)
+    named.deactivate()
+    assert fired == [1], 'name-only event did not fire'
+
+
+### Main section ###
+if __name__ == '__main__':
+    checkNamedEvent()
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else dispatchCount
+    util.loggingHandler.setStream(open(os.devnull, 'w'))
+    util.setLogLevel(logging.WARNING)
+    for code in range(32, 32 + bindingCount):
+        events.event('key_{}'.format(code), lambda action: None, 'key', code).activate()
+
+    modes = [
+        ('logging off (WARNING)', logging.WARNING, False),
+        ('logging on (DEBUG)', logging.DEBUG, False),
+        ('logging on, queued', logging.DEBUG, True)
+    ]
+    print('{:<24} {:>14}'.format('Mode', 'Dispatches/s'))
+    for name, level, queued in modes:
+        util.setLogLevel(level)
+        util.setLogQueued(queued)
+        rate = dispatchRate(count)
+        util.setLogQueued(False)
+        print('{:<24} {:>14,.0f}'.format(name, rate), file=sys.__stdout__)
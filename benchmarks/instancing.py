@@ -0,0 +1,125 @@
+# A field of rocks, each a box with a sphere on it, added as separate shapes and as one instance
+# group: bytes of shape records and BVH nodes per rock, time to build the scene, bytes uploaded
+# when a few rocks move, and frame time. First checks that overlapping instances get the same
+# contact IDs on the GPU as from the CPU renderer.
+# Run from the repo root (set RAYCEKAR_HEADLESS=1 to run without a display): python -m benchmarks.instancing
+
+import logging, time
+import numpy as np
+
+import raycekar as rk
+from raycekar.coord import *
+from OpenGL import GL as gl
+
+
+viewportSize = vec2(200, 200)
+threadGroupSize = vec2(8, 4)
+rockCounts = [1000, 10000, 100000]
+movingFraction = 0.01
+frameCount = 5
+overlapCount = 20       # Instances in the overlap check, each a BVH leaf
+
+
+def prototype():
+    return [rk.env.box(vec3(0, 0, 0), quat(1, 0, 0, 0), vec3(1, 0.6, 0.4)), rk.env.sphere(vec3(0.3, 0, 0.2), 0.3)]
+
+def placements(rockCount):
+    # Rocks scattered over a patch of ground in front of the camera, wider as there are more of them
+    rng = np.random.default_rng(0)
+    side = 2 * rockCount ** 0.5 * 0.15
+    pos = rng.uniform((-side / 2, 0, -1), (side / 2, side, -0.8), (rockCount, 3))
+    rot = quatArray.fromAxisAngle(np.tile([0, 0, 1], (rockCount, 1)), rad(rng.uniform(0, 2 * np.pi, rockCount)))
+    scale = rng.uniform(0.1, 0.2, rockCount)
+    return pos, rot, scale
+
+def buildSeparate(rockCount):
+    pos, rot, scale = placements(rockCount)
+    scene = rk.env.scene()
+    scene.addCamera(rk.env.camera(vec3(0, -3, 0), quat.fromAxisAngle(vec4(1, 0, 0, deg(-15))), deg(70)))
+    box, sphere = prototype()
+    offsets = (rot * sphere.pos).data * scale[:, None]
+    rocks = []
+    for rockPos, rockRot, rockScale, offset in zip(pos.tolist(), rot.data.tolist(), scale.tolist(), offsets.tolist()):
+        rocks.append(rk.env.box(vec3(*rockPos), quat(*rockRot), box.dim * rockScale))
+        scene.addShape(rocks[-1])
+        scene.addShape(rk.env.sphere(vec3(*rockPos) + vec3(*offset), sphere.radius * rockScale))
+    def move(indices):
+        moving = scene.select([rocks[index] for index in indices.tolist()])
+        moving['pos'] = moving['pos'] + 0.01
+    return scene, move
+
+def buildInstanced(rockCount):
+    pos, rot, scale = placements(rockCount)
+    scene = rk.env.scene()
+    scene.addCamera(rk.env.camera(vec3(0, -3, 0), quat.fromAxisAngle(vec4(1, 0, 0, deg(-15))), deg(70)))
+    rocks = rk.env.instances(prototype(), pos, rot, scale)
+    scene.addShape(rocks)
+    def move(indices): rocks.place(indices, pos=pos[indices] + 0.01)
+    return scene, move
+
+def checkOverlapping():
+    # A row of instances close enough that neighbours overlap, before and after moving some, so
+    # picking has to break ties on (slot, instance) the same way everywhere
+    scene = rk.env.scene()
+    scene.addCamera(rk.env.camera(vec3(0, -3, 0), quat(1, 0, 0, 0), deg(70)))
+    pos = np.stack([np.linspace(-1.5, 1.5, overlapCount), np.zeros(overlapCount), np.linspace(-0.3, 0.3, overlapCount)], 1)
+    parts = [rk.env.sphere(vec3(0, 0, 0), 0.2), rk.env.box(vec3(0.1, 0, 0), quat(1, 0, 0, 0), vec3(0.3, 0.3, 0.3))]
+    rocks = rk.env.instances(parts, pos)
+    scene.addShape(rocks)
+    for moved in (False, True):
+        if moved: rocks.place(np.arange(0, overlapCount, 3), pos=pos[::3] + [0, 0, 0.05])
+        rk.gl.renderToArray(scene)
+        rk.gl.getContactsScene()
+        image, cpuContacts = rk.cpu.renderScene(scene, viewportSize)
+        differing = np.count_nonzero(rk.gl.contacts.scene != cpuContacts.ravel())
+        print('Overlapping instances{}: {} contacts differ from the CPU renderer'.format(', some moved' if moved else '', differing))
+        assert differing == 0
+
+def recordBytes(scene):
+    return sum(arena.view().nbytes for arena in (scene.shapeHeaderData, scene.shapeIntData, scene.shapeFloatData))
+
+def dirtyBytes(scene):
+    # Bytes _uploadBuffer would send for what changed since the last upload
+    total = 0
+    for arena in (scene.shapeHeaderData, scene.shapeIntData, scene.shapeFloatData, scene.bvh.nodes):
+        starts, stops = arena.takeDirtyRanges()
+        total += int((stops - starts).sum()) * arena.data.itemsize
+    return total
+
+def frameTime(scene):
+    rk.gl.compileScene(scene)
+    rk.gl.paintScene()
+    gl.glFinish()
+    startTime = time.perf_counter()
+    for frame in range(frameCount):
+        rk.gl.paintScene()
+    gl.glFinish()
+    return (time.perf_counter() - startTime) / frameCount
+
+def run(rockCount, build, name):
+    startTime = time.perf_counter()
+    scene, move = build(rockCount)
+    scene.update()
+    buildTime = time.perf_counter() - startTime
+    records, nodes = recordBytes(scene), scene.bvh.nodes.view().nbytes
+    seconds = frameTime(scene)
+
+    move(np.arange(0, rockCount, int(1 / movingFraction)))
+    scene.update()
+    print('{:>7} {:>10} {:>12.1f} {:>12.1f} {:>10.2f} {:>12} {:>10.1f}'.format(
+        rockCount, name, records / rockCount, nodes / rockCount, buildTime, dirtyBytes(scene), seconds * 1000
+    ))
+
+
+### Main section ###
+if __name__ == '__main__':
+    rk.util.setLogLevel(logging.WARNING)
+    rk.ui.initialize()
+
+    with rk.ui.createWindow('Instancing benchmark', viewportSize, visible=False):
+        rk.gl.initialize(viewportSize, threadGroupSize)
+        checkOverlapping()
+        print('{:>7} {:>10} {:>12} {:>12} {:>10} {:>12} {:>10}'.format('Rocks', 'As', 'Record B', 'BVH B', 'Build s', 'Move bytes', 'Frame ms'))
+        for rockCount in rockCounts:
+            run(rockCount, buildSeparate, 'shapes')
+            run(rockCount, buildInstanced, 'instances')
@@ -0,0 +1,66 @@
+# Lights per tile, shadow rays and frame time as a level fills with point lights. The level grows
+# with the light count, at the same density, while the camera sees the same part of it, so with the
+# lights listed per tile the cost of shading should barely change.
+# Run from the repo root (set RAYCEKAR_HEADLESS=1 to run without a display): python -m benchmarks.lighting
+
+import logging, time
+import numpy as np
+
+import raycekar as rk
+from raycekar.coord import *
+from OpenGL import GL as gl
+
+
+viewportSize = vec2(320, 240)
+threadGroupSize = vec2(8, 4)
+lightCounts = [0, 10, 100, 500]
+lightDensity = 0.5      # Lights per square unit of floor
+lightRadius = 1.5
+frameCount = 5
+
+
+def buildScene(lightCount):
+    # Spheres on a floor in front of the camera, lights scattered just above the floor around them
+    scene = rk.env.scene()
+    scene.addCamera(rk.env.camera(vec3(0, -5, 1), quat.fromAxisAngle(vec4(1, 0, 0, deg(-15))), deg(70)))
+    side = max(8, (lightCount / lightDensity) ** 0.5)
+    scene.addShape(rk.env.box(vec3(0, 0, -1), quat.fromAxisAngle(vec4(0, 0, 1, 0)), vec3(side, side, 0.2)))
+    for x in range(-2, 3):
+        for y in range(0, 3): scene.addShape(rk.env.sphere(vec3(x * 1.2, y * 1.2, -0.5), 0.4))
+    rng = np.random.default_rng(0)
+    positions = rng.uniform((-side / 2, -side / 2, -0.6), (side / 2, side / 2, 0.4), (lightCount, 3))
+    colors = rng.uniform(0.3, 1, (lightCount, 3))
+    for pos, color in zip(positions.tolist(), colors.tolist()):
+        scene.addLight(rk.env.pointLight(vec3(*pos), lightRadius, 2, 0.5, vec3(*color)))
+    return scene
+
+def run(lightCount):
+    scene = buildScene(lightCount)
+    rk.gl.compileScene(scene)
+
+    rk.gl.setStepCounting(True)
+    rk.gl.paintScene()
+    stats = rk.gl.marchStats()
+    rk.gl.setStepCounting(False)
+
+    gl.glFinish()
+    startTime = time.perf_counter()
+    for frame in range(frameCount):
+        rk.gl.paintScene()
+    gl.glFinish()
+    seconds = (time.perf_counter() - startTime) / frameCount
+
+    print('{:>6} {:>10.2f} {:>12.2f} {:>12.2f} {:>10.1f}'.format(
+        lightCount, stats['lightsPerTile'], stats['shadowRays'] / stats['rays'], stats['stepsPerShadowRay'], seconds * 1000
+    ))
+
+
+### Main section ###
+if __name__ == '__main__':
+    rk.util.setLogLevel(logging.WARNING)
+    rk.ui.initialize()
+
+    with rk.ui.createWindow('Lighting benchmark', viewportSize, visible=False):
+        rk.gl.initialize(viewportSize, threadGroupSize)
+        print('{:>6} {:>10} {:>12} {:>12} {:>10}'.format('Lights', 'Per tile', 'Shadows/px', 'Steps/shadow', 'Frame ms'))
+        for lightCount in lightCounts: run(lightCount)
@@ -0,0 +1,95 @@
+# Mesh shapes: baking a torus into a distance grid cold, on one process and on a pool of one per
+# CPU, against mapping it back from the cache, then frame time as the scene fills with instances of
+# it. Every instance shares one grid, so the atlas shouldn't grow with them.
+# Run from the repo root (set RAYCEKAR_HEADLESS=1 to run without a display): python -m benchmarks.meshes
+
+import logging, math, os, pathlib, tempfile, time
+import numpy as np
+
+import raycekar as rk
+from raycekar.coord import *
+from OpenGL import GL as gl
+
+
+viewportSize = vec2(320, 240)
+threadGroupSize = vec2(8, 4)
+torusSegments = (96, 48)    # Around the ring and around the tube, two triangles each
+resolutions = [32, 64, 128]    # Frames are drawn at 64, the default
+instanceCounts = [1, 10, 100]
+frameCount = 5
+
+
+def writeTorus(path):
+    # Ring radius 1, tube radius 0.35
+    ringCount, tubeCount = torusSegments
+    ring, tube = np.meshgrid(np.linspace(0, 2 * math.pi, ringCount, endpoint=False), np.linspace(0, 2 * math.pi, tubeCount, endpoint=False), indexing='ij')
+    vertices = np.stack([(1 + 0.35 * np.cos(tube)) * np.cos(ring), (1 + 0.35 * np.cos(tube)) * np.sin(ring), 0.35 * np.sin(tube)], -1).reshape(-1, 3)
+    lines = ['v {:.6f} {:.6f} {:.6f}'.format(*vertex) for vertex in vertices.tolist()]
+    for i in range(ringCount):
+        for j in range(tubeCount):
+            a, b = i * tubeCount + j + 1, (i + 1) % ringCount * tubeCount + j + 1
+            c, d = (i + 1) % ringCount * tubeCount + (j + 1) % tubeCount + 1, i * tubeCount + (j + 1) % tubeCount + 1
+            lines += ['f {} {} {}'.format(a, b, c), 'f {} {} {}'.format(a, c, d)]
+    pathlib.Path(path).write_text('\n'.join(lines) + '\n')
+
+def loadTime(path, resolution, processes):
+    rk.mesh._loaded.clear()     # Forget grids loaded this run, so load goes to the cache
+    startTime = time.perf_counter()
+    rk.mesh.load(path, resolution, processes=processes)
+    return time.perf_counter() - startTime
+
+def bakeTimes(path, cacheDirectory):
+    print('{:>10} {:>12} {:>12} {:>12}'.format('Resolution', 'Bake 1 s', 'Bake pool s', 'Cached ms'))
+    for resolution in resolutions:
+        # A fresh cache directory for each cold bake
+        rk.mesh.setCacheDirectory(os.path.join(cacheDirectory, '{}-single'.format(resolution)))
+        single = loadTime(path, resolution, 1)
+        rk.mesh.setCacheDirectory(os.path.join(cacheDirectory, str(resolution)))
+        pooled = loadTime(path, resolution, None)
+        cached = loadTime(path, resolution, None)
+        print('{:>10} {:>12.2f} {:>12.2f} {:>12.2f}'.format(resolution, single, pooled, cached * 1000))
+
+def buildScene(meshGrid, instanceCount):
+    # Tori scattered through a cube in front of the camera, smaller as there are more of them
+    scene = rk.env.scene()
+    scene.addCamera(rk.env.camera(vec3(0, -6, 0), quat.fromAxisAngle(vec4(1, 0, 0, deg(0))), deg(70)))
+    rng = np.random.default_rng(0)
+    scale = 1.2 / instanceCount ** (1 / 3)
+    for pos, axis in zip(rng.uniform(-2, 2, (instanceCount, 3)).tolist(), rng.normal(size=(instanceCount, 3)).tolist()):
+        scene.addShape(rk.env.mesh(vec3(*pos), quat.fromAxisAngle(vec4(*axis, deg(40))), scale, meshGrid))
+    return scene
+
+def frameTime(scene):
+    rk.gl.compileScene(scene)
+    rk.gl.paintScene()
+    gl.glFinish()
+    startTime = time.perf_counter()
+    for frame in range(frameCount):
+        rk.gl.paintScene()
+    gl.glFinish()
+    return (time.perf_counter() - startTime) / frameCount
+
+def frameTimes(path):
+    rk.gl.setTileCulling(True)
+    meshGrid = rk.mesh.load(path)
+    print('{:>10} {:>8} {:>14}'.format('Instances', 'Grids', 'Frame ms'))
+    for instanceCount in instanceCounts:
+        scene = buildScene(meshGrid, instanceCount)
+        grids = len({shape.grid.id for shape in scene.shapes})
+        print('{:>10} {:>8} {:>14.1f}'.format(instanceCount, grids, frameTime(scene) * 1000))
+
+
+### Main section ###
+if __name__ == '__main__':
+    rk.util.setLogLevel(logging.WARNING)
+    rk.ui.initialize()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'torus.obj')
+        writeTorus(path)
+        bakeTimes(path, directory)
+        print()
+        rk.mesh.setCacheDirectory(os.path.join(directory, '64'))
+        with rk.ui.createWindow('Mesh benchmark', viewportSize, visible=False):
+            rk.gl.initialize(viewportSize, threadGroupSize)
+            frameTimes(path)
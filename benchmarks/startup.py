@@ -0,0 +1,50 @@
+# Cold and warm startup: gl.initialize in fresh processes with the program cache empty and filled.
+# The driver's own shader cache (Mesa's) is pointed at a fresh directory too, so the cold run is
+# really cold. Run from the repo root (set RAYCEKAR_HEADLESS=1 to run without a display):
+# python -m benchmarks.startup
+
+import json, logging, os, subprocess, sys, tempfile, time
+
+from raycekar.coord import *
+
+
+viewportSize = vec2(200, 200)
+threadGroupSize = vec2(8, 4)
+warmRuns = 3
+
+
+def child():
+    # One startup, printed as JSON for the parent
+    import raycekar as rk
+    rk.util.setLogLevel(logging.WARNING)
+    rk.ui.initialize()
+    with rk.ui.createWindow('Startup benchmark', viewportSize, visible=False):
+        startTime = time.perf_counter()
+        rk.gl.initialize(viewportSize, threadGroupSize)
+        seconds = time.perf_counter() - startTime
+        print(json.dumps({'initialize': seconds, 'programs': rk.gl.programTimes}))
+
+def startup(programCache, driverCache):
+    environment = dict(os.environ, RAYCEKAR_PROGRAM_CACHE=programCache, MESA_SHADER_CACHE_DIR=driverCache)
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.startup', 'child'], env=environment, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+def report(name, result):
+    programs = ', '.join('{} {:.1f} ms ({})'.format(shader, seconds * 1000, origin) for shader, (seconds, origin) in result['programs'].items())
+    print('{:<26} {:>9.1f} ms   {}'.format(name, result['initialize'] * 1000, programs))
+
+
+### Main section ###
+if __name__ == '__main__':
+    if sys.argv[1:] == ['child']:
+        child()
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        programCache = os.path.join(directory, 'programs')
+        driverCache = os.path.join(directory, 'driver')
+        print('{:<26} {:>12}   {}'.format('Startup', 'initialize', 'Programs'))
+        report('cold', startup(programCache, driverCache))
+        for run in range(warmRuns):
+            report('warm', startup(programCache, driverCache))
+        report('warm driver, no cache', startup('', driverCache))
@@ -0,0 +1,66 @@
+# Compares plain glBufferSubData uploads with the persistently mapped streaming ring.
+# Run from the repo root (set RAYCEKAR_HEADLESS=1 to run without a display): python -m benchmarks.streaming
+
+import logging, time
+import numpy as np
+
+import raycekar as rk
+from raycekar.coord import *
+from OpenGL import GL as gl
+
+
+viewportSize = vec2(400, 400)
+threadGroupSize = vec2(8, 4)
+sphereCount = 2000
+movingFraction = 0.1
+frameCount = 300
+
+
+def buildScene():
+    scene = rk.env.scene()
+    scene.addCamera(rk.env.camera(vec3(0, -30, 0), quat.fromAxisAngle(vec4(1, 0, 0, deg(0))), deg(70)))
+    rng = np.random.default_rng(0)
+    spheres = []
+    for pos in rng.uniform(-10, 10, (sphereCount, 3)).tolist():
+        spheres.append(rk.env.sphere(vec3(*pos), 0.2))
+        scene.addShape(spheres[-1])
+    moving = scene.select(spheres[:int(sphereCount * movingFraction)])
+    return scene, moving
+
+def run(streaming):
+    rk.gl.setStreaming(streaming)
+    scene, moving = buildScene()
+    basePos = moving['pos']
+
+    compileTimes = []
+    gl.glFinish()
+    startTime = time.perf_counter()
+    for frame in range(frameCount):
+        pos = basePos.copy()
+        pos[:, 2] += np.sin(frame * 0.05 + np.arange(len(moving)))
+        moving['pos'] = pos
+
+        compileStart = time.perf_counter()
+        rk.gl.compileScene(scene)
+        compileTimes.append(time.perf_counter() - compileStart)
+        rk.gl.paintScene()
+        rk.gl.blitBuffers()
+        gl.glFlush()
+    gl.glFinish()
+    totalTime = time.perf_counter() - startTime
+
+    print('{}:'.format('Streaming' if streaming else 'glBufferSubData'))
+    print('  Frame time: {}'.format(round(totalTime / frameCount, 6)))
+    print('  Compile time: {} (p95 {})'.format(round(float(np.mean(compileTimes)), 6), round(float(np.percentile(compileTimes, 95)), 6)))
+
+
+### Main section ###
+if __name__ == '__main__':
+    rk.util.setLogLevel(logging.INFO)
+    rk.ui.initialize()
+
+    with rk.ui.createWindow('Streaming benchmark', viewportSize, visible=False):
+        rk.gl.initialize(viewportSize, threadGroupSize)
+        print('{} spheres, {}% moving, {} frames'.format(sphereCount, int(movingFraction * 100), frameCount))
+        run(False)
+        run(True)
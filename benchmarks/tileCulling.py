@@ -0,0 +1,59 @@
+# Shapes per tile and frame time with and without tile culling, as the scene grows.
+# Run from the repo root (set RAYCEKAR_HEADLESS=1 to run without a display): python -m benchmarks.tileCulling
+
+import logging, time
+import numpy as np
+
+import raycekar as rk
+from raycekar.coord import *
+from OpenGL import GL as gl
+
+
+viewportSize = vec2(200, 200)
+threadGroupSize = vec2(8, 4)
+sphereCounts = [10, 100, 1000]
+maxTileShapes = 64
+frameCount = 5
+
+
+def buildScene(sphereCount):
+    # Spheres spread through a cube in front of the camera, sized so the cube stays about as full
+    scene = rk.env.scene()
+    scene.addCamera(rk.env.camera(vec3(0, -6, 0), quat.fromAxisAngle(vec4(1, 0, 0, deg(0))), deg(70)))
+    rng = np.random.default_rng(0)
+    radius = 1.5 / sphereCount ** (1 / 3)
+    for pos in rng.uniform(-2, 2, (sphereCount, 3)).tolist():
+        scene.addShape(rk.env.sphere(vec3(*pos), radius))
+    return scene
+
+def frameTime(scene, culling):
+    rk.gl.setTileCulling(culling, maxTileShapes)
+    rk.gl.compileScene(scene)
+    rk.gl.paintScene()
+    gl.glFinish()
+    startTime = time.perf_counter()
+    for frame in range(frameCount):
+        rk.gl.paintScene()
+    gl.glFinish()
+    return (time.perf_counter() - startTime) / frameCount
+
+def run(sphereCount):
+    scene = buildScene(sphereCount)
+    offTime = frameTime(scene, False)
+    onTime = frameTime(scene, True)
+    stats = rk.gl.cullStats()
+    tiles = stats['tiles']
+    print('{:>6} {:>10.2f} {:>10.1%} {:>10.1%} {:>10.1f} {:>10.1f}'.format(
+        sphereCount, stats['shapesPerTile'], stats['emptyTiles'] / tiles, stats['overflowTiles'] / tiles, offTime * 1000, onTime * 1000
+    ))
+
+
+### Main section ###
+if __name__ == '__main__':
+    rk.util.setLogLevel(logging.WARNING)
+    rk.ui.initialize()
+
+    with rk.ui.createWindow('Tile culling benchmark', viewportSize, visible=False):
+        rk.gl.initialize(viewportSize, threadGroupSize)
+        print('{:>6} {:>10} {:>10} {:>10} {:>10} {:>10}'.format('Shapes', 'Per tile', 'Empty', 'Overflow', 'Off ms', 'On ms'))
+        for sphereCount in sphereCounts: run(sphereCount)
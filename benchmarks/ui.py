@@ -0,0 +1,68 @@
+# UI pass cost for a HUD of small widgets: composite only, one widget recolored a frame, every
+# widget moved a frame, and a line of text changed a frame, at two viewport sizes. The HUD covers
+# the same area in both, so the times should barely change with the viewport.
+# Run from the repo root (set RAYCEKAR_HEADLESS=1 to run without a display): python -m benchmarks.ui
+
+import logging, subprocess, sys, time
+
+import raycekar as rk
+from raycekar.coord import *
+from OpenGL import GL as gl
+
+
+viewportSizes = [vec2(1280, 720), vec2(2560, 1440)]
+threadGroupSize = vec2(8, 4)
+widgetCount = 200
+frameCount = 20
+
+
+def buildLayer():
+    # Rows of panels along the bottom, each with a few bars in it, like a hotbar. It fits the
+    # smallest viewport, so every size draws the same pixels.
+    layer = rk.ui.layer()
+    panels = []
+    while sum(1 + len(panel.children) for panel in panels) < widgetCount:
+        row, column = divmod(len(panels), 20)
+        panel = layer.add(rk.ui.widget(vec2(10 + 52 * column, 10 + 52 * row), vec2(48, 48), vec4(0.1, 0.1, 0.1, 0.7)))
+        for bar in range(3): panel.add(rk.ui.widget(vec2(4, 4 + 14 * bar), vec2(40, 10), vec4(0.2, 0.8, 0.2, 1)))
+        panels.append(panel)
+    counter = layer.add(rk.ui.text(vec2(10, 200), 'Frame 0', rk.font.load(), 24))
+    return layer, panels, counter
+
+def frameTime(layer, change):
+    rk.gl.compileUI(layer)
+    rk.gl.paintUI()
+    gl.glFinish()
+    startTime = time.perf_counter()
+    for frame in range(frameCount):
+        change(frame)
+        rk.gl.compileUI(layer)
+        rk.gl.paintUI()
+    gl.glFinish()
+    return (time.perf_counter() - startTime) / frameCount
+
+def run(viewportSize):
+    rk.ui.initialize()
+    with rk.ui.createWindow('UI benchmark', viewportSize, visible=False):
+        rk.gl.initialize(viewportSize, threadGroupSize)
+        layer, panels, counter = buildLayer()
+        widgets = [widget for panel in panels for widget in panel._subtree()]
+        def recolor(frame): widgets[frame % len(widgets)].setColor(vec4(frame % 2, 0.5, 0.5, 1))
+        def move(frame):
+            for panel in panels: panel.move(panel.pos + vec2(0, 1 - 2 * (frame % 2)))
+        def count(frame): counter.setString('Frame {}'.format(frame))
+        times = [frameTime(layer, change) for change in (lambda frame: None, recolor, move, count)]
+        print('{:>11} {:>8} {:>12.2f} {:>12.2f} {:>12.2f} {:>12.2f}'.format('{}x{}'.format(*viewportSize), len(widgets), *(seconds * 1000 for seconds in times)))
+
+
+### Main section ###
+if __name__ == '__main__':
+    rk.util.setLogLevel(logging.WARNING)
+    if sys.argv[1:2] == ['child']:
+        run(vec2(int(sys.argv[2]), int(sys.argv[3])))
+        sys.exit(0)
+
+    # One process per viewport size, so each gets a fresh context
+    print('{:>11} {:>8} {:>12} {:>12} {:>12} {:>12}'.format('Viewport', 'Widgets', 'Static ms', 'Recolor ms', 'Move ms', 'Text ms'))
+    for viewportSize in viewportSizes:
+        subprocess.run([sys.executable, '-m', 'benchmarks.ui', 'child', str(viewportSize.x), str(viewportSize.y)], check=True)
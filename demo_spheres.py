@@ -22,6 +22,7 @@ if __name__ == '__main__':
 
     with rk.ui.createWindow('Window title', viewportSize):
         rk.gl.initialize(viewportSize, threadGroupSize)
+        rk.gl.setSpecialization(True)   # The shapes only move, so the scene program can be specialized
 
         # Scene setup
         scene = rk.env.scene()
@@ -45,10 +46,14 @@ if __name__ == '__main__':
 
         rk.ui.keys.setEvent(rk.ui.keys.ESCAPE, closeWindow)
 
+        # FPS overlay
+        overlay = rk.ui.layer()
+        fpsText = overlay.add(rk.ui.text(vec2(10, viewportSize.y - 34), 'FPS: -', rk.font.load(), 24))
+
         # Main loop
+        rk.gl.setProfiling(True, history=fpsCountInterval)
         frame = -1
         frameTimes = []
-        renderTimes = []
         endTime = time.perf_counter()
 
         while not rk.ui.flags.shouldClose:
@@ -61,11 +66,12 @@ if __name__ == '__main__':
             sphere3.move(vec3(3, 0, 2 * sin(rad(deg(frame + 270)))))
 
             rk.gl.compileScene(scene)
-            renderStart = time.perf_counter()
             rk.gl.paintScene()
-            renderStop = time.perf_counter()
+            rk.gl.compileUI(overlay)
+            rk.gl.paintUI()
             rk.gl.blitBuffers()
             rk.ui.updateWindow()
+            rk.gl.profileFrame()
 
             # FPS limiting
             # time.sleep(max(0, (1 / frameLimit) - (time.perf_counter() - startTime)))
@@ -73,12 +79,8 @@ if __name__ == '__main__':
 
             # FPS counting
             frameTimes.append(endTime - startTime)
-            renderTimes.append(renderStop - renderStart)
             if len(frameTimes) == fpsCountInterval:
+                fpsText.setString('FPS: {:.1f}'.format(fpsCountInterval / sum(frameTimes)))
                 print('Stats for {} frames:'.format(fpsCountInterval))
-                print('FPS: {}'.format(round(fpsCountInterval / sum(frameTimes), 6)))
-                print('Frame time: {}'.format(round(sum(frameTimes) / fpsCountInterval, 6)))
-                print('  Render time: {}'.format(round(sum(renderTimes) / fpsCountInterval, 6)))
-                print('  CPU time: {}'.format(round((sum(frameTimes) - sum(renderTimes)) / fpsCountInterval, 6)))
+                print(rk.gl.profileReport())
                 frameTimes = []
-                renderTimes = []
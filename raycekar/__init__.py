@@ -1,6 +1,15 @@
+import os
+
+# Headless contexts come from EGL, and PyOpenGL settles on a platform when it is first imported
+if os.environ.get('RAYCEKAR_HEADLESS'): os.environ.setdefault('PYOPENGL_PLATFORM', 'egl')
+
+# First, so the rk logger is configured before any module logs
+from . import util
 from . import coord
 from . import env
+from . import cpu
 from . import events
+from . import font
 from . import gl
+from . import mesh
 from . import ui
-from . import util
\ No newline at end of file
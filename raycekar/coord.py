@@ -1,4 +1,5 @@
 from math import sqrt, sin, cos, acos, pi
+import numpy as np
 
 
 ### Angles ###
@@ -92,20 +93,20 @@ class rad:
 
 
 ### Vectors ###
+# Each size is written out component by component with __slots__, so there is no per-instance
+# dict and no loops or temporaries in the arithmetic. Operators return new vectors; iadd, isub
+# and imul modify the vector in place and return it, for hot loops that would otherwise
+# allocate a vector per step. `+=` still rebinds, so vectors shared between owners are safe.
 class _vec():
+    __slots__ = ()
+    _size = None
+
     def __init__(self, *values):
-        if getattr(self, '_size', None) is None: raise Exception('should not instantiate _vec, but should use vec2, vec3, or vec4')
-        if len(values) != self._size: raise ValueError('need {} values, {} given'.format(self._size, len(values)))
-        else: self.values = values
-        
-        self.x = self.values[0]
-        self.y = self.values[1]
-        if self._size >= 3: self.z = self.values[2]
-        if self._size >= 4: self.w = self.values[3]
+        raise Exception('should not instantiate _vec, but should use vec2, vec3, or vec4')
 
     # Bits to make Python interactions work
     def __repr__(self):
-        return '<{}>'.format(', '.join([str(value) for value in self.values]))
+        return '<{}>'.format(', '.join([str(value) for value in self]))
 
     __str__ = __repr__  # They do the same thing so...
 
@@ -118,41 +119,162 @@ class _vec():
     def _ensureSameSize(self, other):
         if self._size != other._size: raise ValueError('cannot add vec{} and vec{}'.format(self._size, other._size))
 
+    # Length of a vector is just applying the pythagorean theorem
+    def length(self):
+        return sqrt(sum([value * value for value in self]))
 
-    # Add and subtract other vectors
-    def __add__(self, other):
-        self._ensureSameSize(other)
-        return vecN(*[self[i] + other[i] for i in range(self._size)])
+    def normalize(self):
+        return self / length(self)
 
-    def __sub__(self, other):
-        self._ensureSameSize(other)
-        return vecN(*[self[i] - other[i] for i in range(self._size)])
+class vec2(_vec):
+    __slots__ = ('x', 'y')
+    _size = 2
 
-    # Multiply and subtract by scalar values
-    def __mul__(self, other):
-        return vecN(*[self[i] * other for i in range(self._size)])
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
 
-    def __truediv__(self, other):
-        return vecN(*[self[i] / other for i in range(self._size)])
+    @property
+    def values(self): return (self.x, self.y)
 
-    def __floordiv__(self, other):
-        return vecN(*[self[i] // other for i in range(self._size)])
+    def __iter__(self):
+        yield self.x
+        yield self.y
 
+    # Add and subtract other vectors
+    def __add__(self, other):
+        if isinstance(other, _array): return NotImplemented
+        if other._size != 2: self._ensureSameSize(other)
+        return vec2(self.x + other.x, self.y + other.y)
 
-    # Other functions relating to vector manipulation
-    def __abs__(self):
-        return vecN(*[abs(self[i]) for i in range(self._size)])
+    def __sub__(self, other):
+        if isinstance(other, _array): return NotImplemented
+        if other._size != 2: self._ensureSameSize(other)
+        return vec2(self.x - other.x, self.y - other.y)
+
+    # Multiply and divide by scalar values
+    def __mul__(self, other): return vec2(self.x * other, self.y * other)
+    def __truediv__(self, other): return vec2(self.x / other, self.y / other)
+    def __floordiv__(self, other): return vec2(self.x // other, self.y // other)
+    def __abs__(self): return vec2(abs(self.x), abs(self.y))
+    def length(self): return sqrt(self.x * self.x + self.y * self.y)
+
+    # In place
+    def iadd(self, other):
+        if other._size != 2: self._ensureSameSize(other)
+        self.x += other.x; self.y += other.y
+        return self
+
+    def isub(self, other):
+        if other._size != 2: self._ensureSameSize(other)
+        self.x -= other.x; self.y -= other.y
+        return self
+
+    def imul(self, other):
+        self.x *= other; self.y *= other
+        return self
+
+class vec3(_vec):
+    __slots__ = ('x', 'y', 'z')
+    _size = 3
+
+    def __init__(self, x, y, z):
+        self.x = x
+        self.y = y
+        self.z = z
+
+    @property
+    def values(self): return (self.x, self.y, self.z)
+
+    def __iter__(self):
+        yield self.x
+        yield self.y
+        yield self.z
 
-    # Length of a vector is just applying the pythagorean theorem
-    def length(self):
-        return sqrt(sum([value * value for value in self.values]))
+    # Add and subtract other vectors
+    def __add__(self, other):
+        if isinstance(other, _array): return NotImplemented
+        if other._size != 3: self._ensureSameSize(other)
+        return vec3(self.x + other.x, self.y + other.y, self.z + other.z)
 
-    def normalize(self):
-        return self / length(self)
+    def __sub__(self, other):
+        if isinstance(other, _array): return NotImplemented
+        if other._size != 3: self._ensureSameSize(other)
+        return vec3(self.x - other.x, self.y - other.y, self.z - other.z)
+
+    # Multiply and divide by scalar values
+    def __mul__(self, other): return vec3(self.x * other, self.y * other, self.z * other)
+    def __truediv__(self, other): return vec3(self.x / other, self.y / other, self.z / other)
+    def __floordiv__(self, other): return vec3(self.x // other, self.y // other, self.z // other)
+    def __abs__(self): return vec3(abs(self.x), abs(self.y), abs(self.z))
+    def length(self): return sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
+
+    # In place
+    def iadd(self, other):
+        if other._size != 3: self._ensureSameSize(other)
+        self.x += other.x; self.y += other.y; self.z += other.z
+        return self
+
+    def isub(self, other):
+        if other._size != 3: self._ensureSameSize(other)
+        self.x -= other.x; self.y -= other.y; self.z -= other.z
+        return self
+
+    def imul(self, other):
+        self.x *= other; self.y *= other; self.z *= other
+        return self
+
+class vec4(_vec):
+    __slots__ = ('x', 'y', 'z', 'w')
+    _size = 4
+
+    def __init__(self, x, y, z, w):
+        self.x = x
+        self.y = y
+        self.z = z
+        self.w = w
+
+    @property
+    def values(self): return (self.x, self.y, self.z, self.w)
+
+    def __iter__(self):
+        yield self.x
+        yield self.y
+        yield self.z
+        yield self.w
 
-class vec2(_vec): _size = 2
-class vec3(_vec): _size = 3
-class vec4(_vec): _size = 4
+    # Add and subtract other vectors
+    def __add__(self, other):
+        if isinstance(other, _array): return NotImplemented
+        if other._size != 4: self._ensureSameSize(other)
+        return vec4(self.x + other.x, self.y + other.y, self.z + other.z, self.w + other.w)
+
+    def __sub__(self, other):
+        if isinstance(other, _array): return NotImplemented
+        if other._size != 4: self._ensureSameSize(other)
+        return vec4(self.x - other.x, self.y - other.y, self.z - other.z, self.w - other.w)
+
+    # Multiply and divide by scalar values
+    def __mul__(self, other): return vec4(self.x * other, self.y * other, self.z * other, self.w * other)
+    def __truediv__(self, other): return vec4(self.x / other, self.y / other, self.z / other, self.w / other)
+    def __floordiv__(self, other): return vec4(self.x // other, self.y // other, self.z // other, self.w // other)
+    def __abs__(self): return vec4(abs(self.x), abs(self.y), abs(self.z), abs(self.w))
+    def length(self): return sqrt(self.x * self.x + self.y * self.y + self.z * self.z + self.w * self.w)
+
+    # In place
+    def iadd(self, other):
+        if other._size != 4: self._ensureSameSize(other)
+        self.x += other.x; self.y += other.y; self.z += other.z; self.w += other.w
+        return self
+
+    def isub(self, other):
+        if other._size != 4: self._ensureSameSize(other)
+        self.x -= other.x; self.y -= other.y; self.z -= other.z; self.w -= other.w
+        return self
+
+    def imul(self, other):
+        self.x *= other; self.y *= other; self.z *= other; self.w *= other
+        return self
 
 def vecN(*values):
     size = len(values)
@@ -165,12 +287,13 @@ def vecN(*values):
 ### Quaternions ###
 # All quaternion code adapted from https://stackoverflow.com/a/4870905/12170254
 class quat():
+    __slots__ = ('n', 'ni', 'nj', 'nk')
+
     def __init__(self, n, ni, nj, nk):
         self.n = n
         self.ni = ni
         self.nj = nj
         self.nk = nk
-        self.components = [n, ni, nj, nk]
 
     def __repr__(self):
         return '({} {} {}i {} {}j {} {}k'.format(
@@ -182,16 +305,23 @@ class quat():
 
     __str__ = __repr__
 
+    @property
+    def components(self): return [self.n, self.ni, self.nj, self.nk]
+
     def __getitem__(self, index):
         return self.components[index]
 
+    def __iter__(self):
+        yield self.n
+        yield self.ni
+        yield self.nj
+        yield self.nk
+
+    @staticmethod
     def fromAxisAngle(axisAngle: vec4):
-        return quat(
-            cos(rad(axisAngle.w) / 2),
-            axisAngle.x * sin(rad(axisAngle.w) / 2),
-            axisAngle.y * sin(rad(axisAngle.w) / 2),
-            axisAngle.z * sin(rad(axisAngle.w) / 2)
-        )
+        halfAngle = float(rad(axisAngle.w)) / 2
+        sinHalf = sin(halfAngle)
+        return quat(cos(halfAngle), axisAngle.x * sinHalf, axisAngle.y * sinHalf, axisAngle.z * sinHalf)
 
     def toAxisAngle(self):
         return vec4(self.ni, self.nj, self.nk, acos(self.n) * 2)
@@ -207,19 +337,42 @@ class quat():
             q0.n  * q1.nk + q0.nk * q1.n  + q0.ni * q1.nj - q0.nj * q1.ni
         )
 
+    def rotateInto(self, other: vec3, out: vec3):
+        # q v q* written out as (n^2 - u.u) v + 2 (u.v) u + 2n (u x v), with u = (ni, nj, nk), so
+        # no quaternions are built. Like the product, it scales by |q|^2 when q isn't normalized.
+        # `out` may be `other`.
+        n, i, j, k = self.n, self.ni, self.nj, self.nk
+        x, y, z = other.x, other.y, other.z
+        scale = n * n - i * i - j * j - k * k
+        dot2 = 2 * (i * x + j * y + k * z)
+        n2 = 2 * n
+        out.x = scale * x + dot2 * i + n2 * (j * z - k * y)
+        out.y = scale * y + dot2 * j + n2 * (k * x - i * z)
+        out.z = scale * z + dot2 * k + n2 * (i * y - j * x)
+        return out
+
     def _mulVec(self, other: vec3):
-        vecQuat = quat(0, *other)
-        resultQuat = (self * vecQuat) * self.conjugate()
-        return vec3(resultQuat.ni, resultQuat.nj, resultQuat.nk)
+        return self.rotateInto(other, vec3(0, 0, 0))
 
     def __mul__(self, other):
         if isinstance(other, quat): return self._mulQuat(other)
-        elif isinstance(other, vec3): return self._mulVec(other)
+        elif isinstance(other, vec3): return self.rotateInto(other, vec3(0, 0, 0))
+        return NotImplemented
+
+    def imul(self, other):
+        # self = self * other without a new quaternion. `other` may be `self`.
+        n, i, j, k = self.n, self.ni, self.nj, self.nk
+        on, oi, oj, ok = other.n, other.ni, other.nj, other.nk
+        self.n  = n * on - i * oi - j * oj - k * ok
+        self.ni = n * oi + i * on + j * ok - k * oj
+        self.nj = n * oj + j * on + k * oi - i * ok
+        self.nk = n * ok + k * on + i * oj - j * oi
+        return self
 
 
     # Functions relating to quaternion manipulation
     def length(self):
-        return sum([comp * comp for comp in (self.n, self.ni, self.nj, self.nk)])
+        return sqrt(self.n * self.n + self.ni * self.ni + self.nj * self.nj + self.nk * self.nk)
 
     def normalize(self):
         mag = length(self)
@@ -229,6 +382,194 @@ class quat():
         return quat(self.n, -self.ni, -self.nj, -self.nk)
 
 
+### Arrays ###
+# Many vectors or quaternions in one float32 array, one per row, for transforming whole sets of
+# objects at once. Quaternion rows are (n, ni, nj, nk) like `quat` and renderScene.glsl. Both
+# types work with NumPy (np.asarray gives the rows without copying), so they can be written
+# straight into scene storage with `scene.select(shapes)['rot'] = rotations`. Operands may be
+# arrays of the same length, single vec3/quat values, or anything np.asarray accepts.
+def _rows(thing):
+    if isinstance(thing, (vec3Array, quatArray)): return thing.data
+    if isinstance(thing, (_vec, quat)): return np.array(tuple(thing), np.float32)
+    return np.asarray(thing, np.float32)
+
+def _scalars(thing):
+    # Scalars, or one per row so they broadcast across components
+    thing = np.asarray(thing, np.float32)
+    return thing[..., None] if thing.ndim else thing
+
+class _array():
+    __slots__ = ('data',)
+    _size = None
+
+    def __init__(self, data):
+        # Wraps `data` without copying when it is already float32 with the right shape
+        self.data = np.asarray(_rows(data), np.float32).reshape(-1, self._size)
+
+    @classmethod
+    def zeros(cls, count: int):
+        return cls(np.zeros((count, cls._size), np.float32))
+
+    def __repr__(self):
+        return '<{} of {}>'.format(type(self).__name__, len(self))
+
+    __str__ = __repr__
+
+    def __len__(self):
+        return len(self.data)
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None or np.dtype(dtype) == self.data.dtype: return self.data
+        return self.data.astype(dtype)
+
+    def __getitem__(self, index):
+        # An int gives one vec3/quat, anything else a view (or copy, for index arrays) of the rows
+        rows = self.data[index]
+        if rows.ndim == 1: return self._single(*rows.tolist())
+        return type(self)(rows)
+
+    def __setitem__(self, index, values):
+        self.data[index] = _rows(values)
+
+    def copy(self):
+        return type(self)(self.data.copy())
+
+    def length(self):
+        return np.sqrt(np.einsum('ij,ij->i', self.data, self.data))
+
+class vec3Array(_array):
+    __slots__ = ()
+    _size = 3
+    _single = vec3
+
+    @property
+    def x(self): return self.data[:, 0]
+
+    @property
+    def y(self): return self.data[:, 1]
+
+    @property
+    def z(self): return self.data[:, 2]
+
+    # Add and subtract other vectors
+    def __add__(self, other): return vec3Array(self.data + _rows(other))
+    def __sub__(self, other): return vec3Array(self.data - _rows(other))
+    def __radd__(self, other): return vec3Array(_rows(other) + self.data)
+    def __rsub__(self, other): return vec3Array(_rows(other) - self.data)
+
+    # Multiply and divide by scalars, or one scalar per row
+    def __mul__(self, other): return vec3Array(self.data * _scalars(other))
+    def __truediv__(self, other): return vec3Array(self.data / _scalars(other))
+    def __abs__(self): return vec3Array(np.abs(self.data))
+
+    def __rmul__(self, other):
+        # quat * vec3Array rotates every row
+        if isinstance(other, quat): return vec3Array(_quatRotate(_rows(other), self.data))
+        return NotImplemented
+
+    def normalize(self):
+        return self / self.length()
+
+    # In place
+    def iadd(self, other):
+        self.data += _rows(other)
+        return self
+
+    def isub(self, other):
+        self.data -= _rows(other)
+        return self
+
+    def imul(self, other):
+        self.data *= _scalars(other)
+        return self
+
+def _quatProduct(q0, q1):
+    n0, i0, j0, k0 = q0[..., 0], q0[..., 1], q0[..., 2], q0[..., 3]
+    n1, i1, j1, k1 = q1[..., 0], q1[..., 1], q1[..., 2], q1[..., 3]
+    return np.stack([
+        n0 * n1 - i0 * i1 - j0 * j1 - k0 * k1,
+        n0 * i1 + i0 * n1 + j0 * k1 - k0 * j1,
+        n0 * j1 + j0 * n1 + k0 * i1 - i0 * k1,
+        n0 * k1 + k0 * n1 + i0 * j1 - j0 * i1
+    ], axis=-1)
+
+def _quatRotate(q, v):
+    # Same formula as quat.rotateInto, broadcast over rows
+    n, u = q[..., 0:1], q[..., 1:4]
+    scale = n * n - np.sum(u * u, axis=-1, keepdims=True)
+    dot2 = 2 * np.sum(u * v, axis=-1, keepdims=True)
+    return scale * v + dot2 * u + 2 * n * np.cross(u, v)
+
+class quatArray(_array):
+    __slots__ = ()
+    _size = 4
+    _single = quat
+
+    @staticmethod
+    def fromAxisAngle(axes, angles):
+        # `angles` may be wrapped in deg() or rad() like vec4.w in quat.fromAxisAngle
+        halfAngles = np.asarray(rad(angles).value, np.float32) / 2
+        axes = _rows(axes) * np.sin(halfAngles)[..., None]
+        ns = np.broadcast_to(np.cos(halfAngles)[..., None], axes.shape[:-1] + (1,))
+        return quatArray(np.concatenate([ns, axes], axis=-1))
+
+    @property
+    def n(self): return self.data[:, 0]
+
+    @property
+    def ni(self): return self.data[:, 1]
+
+    @property
+    def nj(self): return self.data[:, 2]
+
+    @property
+    def nk(self): return self.data[:, 3]
+
+    # Products with quaternions, or rotation of vectors
+    def __mul__(self, other):
+        if isinstance(other, (vec3, vec3Array)): return vec3Array(_quatRotate(self.data, _rows(other)))
+        return quatArray(_quatProduct(self.data, _rows(other)))
+
+    def __rmul__(self, other):
+        # quat * quatArray
+        return quatArray(_quatProduct(_rows(other), self.data))
+
+    def imul(self, other):
+        self.data[:] = _quatProduct(self.data, _rows(other))
+        return self
+
+    def rotateInto(self, vectors, out: vec3Array):
+        # `out` may be `vectors`
+        out.data[:] = _quatRotate(self.data, _rows(vectors))
+        return out
+
+    # Functions relating to quaternion manipulation
+    def normalize(self):
+        return quatArray(self.data / self.length()[:, None])
+
+    def conjugate(self):
+        return quatArray(self.data * np.array([1, -1, -1, -1], np.float32))
+
+    def slerp(self, other, t):
+        # Spherical interpolation from self (t = 0) to other (t = 1) along the shorter arc. Nearly
+        # parallel pairs fall back to a normalized lerp, where the slerp weights lose precision.
+        q0 = self.data
+        q1 = np.broadcast_to(_rows(other), q0.shape)
+        t = np.broadcast_to(np.asarray(t, np.float32), (len(q0),))[:, None]
+        dot = np.sum(q0 * q1, axis=1, keepdims=True)
+        q1 = np.where(dot < 0, -q1, q1)
+        dot = np.minimum(np.abs(dot), 1)
+
+        theta = np.arccos(dot)
+        sinTheta = np.sin(theta)
+        near = sinTheta < 1e-4
+        safeSin = np.where(near, 1, sinTheta)
+        w0 = np.where(near, 1 - t, np.sin((1 - t) * theta) / safeSin)
+        w1 = np.where(near, t, np.sin(t * theta) / safeSin)
+        result = w0 * q0 + w1 * q1
+        return quatArray(result / np.linalg.norm(result, axis=1, keepdims=True))
+
+
 ### Operators ###
 # These have their own section because they may or may not operate on both vectors and quaternions
 def length(thing): return thing.length()
@@ -0,0 +1,416 @@
+# Reference renderer on the CPU. It reads the same packed shape buffers as renderScene.glsl, from
+# scene.compileBufferData(), and marches every pixel at once with NumPy. The output matches what
+# gl.renderToArray and gl.getContactsScene give, whether the shader walks the shapes linearly, by
+# tile or through the BVH, since all of them pick the lowest (slot, instance) within thres. So it
+# doubles as a golden image for the shader and as a fallback for machines without OpenGL 4.4.
+# Lights are not applied; shapes keep the flat colors the shader gives them in scenes without lights.
+
+
+import logging, multiprocessing, os
+from multiprocessing import shared_memory
+import numpy as np
+from raycekar import env, mesh
+from raycekar.coord import *
+
+
+log = logging.getLogger('rk.cpu')
+
+# Same constants as resolvePixel and main in renderScene.glsl
+dstMax = 7
+maxSteps = 200
+thres = 0.01
+focalLength = 0.1
+
+# Neighbouring rays are marched in groups of groupSize x groupSize pixels that share a shortlist of shapes
+groupSize = 8
+_cullMargin = 1e-3  # Slack on the shortlist bounds for float32 rounding
+
+# Outcome of each ray, indexing `_palette`. Contacts with a shape that has a colour function in
+# the shader take that shape's entry instead of _outcomeContact.
+_outcomeNoCamera = 0
+_outcomeSteps = 1
+_outcomeDistance = 2
+_outcomeContact = 3
+_palette = np.array([
+    (0.4, 0, 0, 1),     # Dark red - camera not defined
+    (0.2, 0.2, 0.7, 1), # Kind of a sky blue - steps limit exceeded
+    (0.5, 0, 0.5, 1),   # This purple color - distance limit exceeded
+    (0, 0.8, 0, 1),     # Green - shape contact
+    (1, 0.2, 0.2, 1),   # cfSphere
+    (0.2, 0.2, 1, 1),   # cfBox
+    (0.8, 0.8, 0.8, 1)  # cfMesh
+], np.float32)
+_shapeOutcomes = {env.sphere: 4, env.box: 5, env.mesh: 6}
+
+
+### Scene loading ###
+class _prototype():
+    # Stands in for a shape type in _shapeSet.tables for the instances of one group, whose records
+    # are the instance records: the parts' SDFs, like sdfInstance
+    def __init__(self, header, ints, floats):
+        intPtr, floatPtr = int(header['intPtr']), int(header['floatPtr'])
+        partCount, count, instanceOffset = ints[intPtr:intPtr + 3].tolist()
+        self.parts = []     # (shapeType, record)
+        for part in range(partCount):
+            typeID, offset = ints[intPtr + 4 + 2 * part:intPtr + 6 + 2 * part].tolist()
+            partType = env.objectTypes[typeID]
+            self.parts.append((partType, floats[floatPtr + offset:floatPtr + offset + partType._floatCount][None]))
+        start = floatPtr + instanceOffset
+        self.records = floats[start:start + count * env.instanceRecordSize].reshape(count, env.instanceRecordSize)
+
+    def _distances(self, rayPos, records, rows):
+        rotation = env._rotationMatrices(records[rows, 4:8])
+        scale = records[rows, 3]
+        rayRel = np.einsum('nij,nj->ni', rotation, rayPos - records[rows, 0:3]) / scale[:, None]
+        first = np.zeros(len(rows), np.intp)
+        return np.min([partType._distances(rayRel, record, first) for partType, record in self.parts], axis=0) * scale
+
+class _shapeSet():
+    # The scene's shapes numbered 0..n-1 in ID order, with the packed records of each type kept
+    # together. Each instance of an instance group is a shape of its own, in the group's place.
+    def __init__(self, shapeBuffers):
+        headerData, intData, floatData = shapeBuffers
+        headers = np.frombuffer(headerData, env.shapeHeaderType)
+        ints = np.frombuffer(intData, np.int32)
+        floats = np.frombuffer(floatData, np.float32)
+        self.camera = None
+        if len(headers) == 0 or headers['type'][0] != 0: return
+        self.camera = floats[headers['floatPtr'][0]:headers['floatPtr'][0] + 8].copy()
+
+        types = headers['type']
+        instancesID = env.objectTypes.index(env.instances)
+        shapeTypes = {}
+        for typeID in np.unique(types[1:]).tolist():
+            shapeType = env.objectTypes[typeID] if 0 <= typeID < len(env.objectTypes) else None
+            if hasattr(shapeType, '_distances') or typeID == instancesID: shapeTypes[typeID] = shapeType
+            else: log.warning('No CPU SDF for shape type %s, skipping it', typeID)
+        slots = np.flatnonzero(np.isin(types[1:], list(shapeTypes))) + 1
+        groupSlots = slots[types[slots] == instancesID]
+        counts = np.ones(len(slots), np.intp)
+        counts[types[slots] == instancesID] = ints[headers['intPtr'][groupSlots] + 1]
+        starts = np.cumsum(counts) - counts
+        shapeSlots = np.repeat(slots, counts)
+        self.ids = shapeSlots.astype(np.int32)
+
+        # `kinds` and `rows` locate each shape's records in `tables`
+        self.tables = []    # (shapeType, records) per type, or (_prototype, records) per group
+        self.kinds = np.empty(len(self.ids), np.int32)
+        self.rows = np.empty(len(self.ids), np.int32)
+        self.outcomes = np.full(len(self.ids), _outcomeContact, np.int32)
+        for typeID, shapeType in shapeTypes.items():
+            if typeID == instancesID: continue
+            ofType = types[shapeSlots] == typeID
+            records = floats[headers['floatPtr'][shapeSlots[ofType]][:, None] + np.arange(shapeType._floatCount)]
+            self.kinds[ofType] = len(self.tables)
+            self.rows[ofType] = np.arange(len(records))
+            self.tables.append((shapeType, records))
+            self.outcomes[ofType] = _shapeOutcomes.get(shapeType, _outcomeContact)
+
+        # Instances take the color of their prototype's first part, and contact IDs from -2 down
+        for slot, start, count in zip(groupSlots.tolist(), starts[types[slots] == instancesID].tolist(), counts[types[slots] == instancesID].tolist()):
+            table = _prototype(headers[slot], ints, floats)
+            self.kinds[start:start + count] = len(self.tables)
+            self.rows[start:start + count] = np.arange(count)
+            self.ids[start:start + count] = -2 - (ints[headers['intPtr'][slot] + 3] + np.arange(count))
+            self.outcomes[start:start + count] = _shapeOutcomes.get(table.parts[0][0], _outcomeContact)
+            self.tables.append((table, table.records))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def distances(self, rayPos, pairRay, pairShape):
+        # SDF of shape pairShape[i] at rayPos[pairRay[i]]
+        if len(self.tables) == 1:
+            shapeType, records = self.tables[0]
+            return shapeType._distances(rayPos[pairRay], records, self.rows[pairShape])
+        dst = np.empty(len(pairShape), np.float32)
+        kinds = self.kinds[pairShape]
+        for kind, (shapeType, records) in enumerate(self.tables):
+            ofKind = np.flatnonzero(kinds == kind)
+            if len(ofKind): dst[ofKind] = shapeType._distances(rayPos[pairRay[ofKind]], records, self.rows[pairShape[ofKind]])
+        return dst
+
+
+### Marching ###
+def _rotate(q, v):
+    # q v q* for a single quaternion q and vectors v (n, 3), expanded so no quaternion products are built
+    n, u = q[0], q[1:]
+    return (n * n - u @ u) * v + 2 * np.outer(v @ u, u) + 2 * n * np.cross(u, v)
+
+def _primaryRays(camera, viewportSize: vec2, pixelsX, pixelsY):
+    # Ray directions through the centres of the given pixels, as in main() in renderScene.glsl
+    fov = camera[3]
+    pixelSize = (2 * np.tan(fov * 0.5) * focalLength) / viewportSize.x
+    rayDir = np.empty((len(pixelsX), 3), np.float32)
+    rayDir[:, 0] = ((0.5 + pixelsX) * pixelSize) - (0.5 * pixelSize * viewportSize.x)
+    rayDir[:, 1] = focalLength
+    rayDir[:, 2] = ((0.5 + pixelsY) * pixelSize) - (0.5 * pixelSize * viewportSize.y)
+    rayDir /= np.linalg.norm(rayDir, axis=1, keepdims=True)
+    return _rotate(camera[4:8], rayDir).astype(np.float32)
+
+def _shortlists(shapes, rayPos, rayGroups):
+    # (ray, shape) pairs worth evaluating, ordered by ray then shape. Every ray in a group is within
+    # `spread` of the group's centre and an SDF changes no faster than the point it is taken at moves,
+    # so a shape more than 2 * spread further from the centre than the nearest one (or than thres)
+    # can't be nearest, or within thres, for any ray in the group.
+    starts = np.flatnonzero(np.r_[True, rayGroups[1:] != rayGroups[:-1]])
+    counts = np.diff(np.r_[starts, len(rayGroups)])
+    groupOf = np.repeat(np.arange(len(starts)), counts)
+    centers = (np.add.reduceat(rayPos, starts) / counts[:, None]).astype(np.float32)
+    x, y, z = (rayPos - centers[groupOf]).T
+    spread = np.maximum.reduceat(np.sqrt(x * x + y * y + z * z), starts)
+
+    shapeCount = len(shapes)
+    centerDst = shapes.distances(centers, np.repeat(np.arange(len(starts)), shapeCount), np.tile(np.arange(shapeCount), len(starts)))
+    centerDst = centerDst.reshape(len(starts), shapeCount)
+    reach = np.maximum(centerDst.min(axis=1) + spread, thres) + spread + _cullMargin
+    keep = centerDst <= reach[:, None]
+
+    # Expand each group's shortlist to every ray in it
+    keptCount = keep.sum(axis=1)
+    keptStart = np.cumsum(keptCount) - keptCount
+    keptShapes = np.nonzero(keep)[1]
+    pairCount = keptCount[groupOf]
+    pairStart = np.cumsum(pairCount) - pairCount
+    pairRay = np.repeat(np.arange(len(rayPos)), pairCount)
+    pairShape = keptShapes[np.arange(len(pairRay)) - np.repeat(pairStart - keptStart[groupOf], pairCount)]
+    return pairRay, pairShape, pairStart
+
+def _dstScene(shapes, rayPos, rayGroups):
+    # Like the dstScene walks in renderScene.glsl: the first shape (by slot, then instance) within
+    # thres if there is one, otherwise the nearest. Shapes are given by their number in `shapes`,
+    # which are in that order.
+    if len(shapes) == 0: return np.full(len(rayPos), dstMax, np.float32), np.full(len(rayPos), -1, np.intp)
+    pairRay, pairShape, pairStart = _shortlists(shapes, rayPos, rayGroups)
+    dst = shapes.distances(rayPos, pairRay, pairShape)
+
+    # First pair of each ray at its minimum, or within thres when anything is
+    target = np.maximum(np.minimum.reduceat(dst, pairStart), thres)
+    chosen = np.flatnonzero(dst <= target[pairRay])
+    chosen = chosen[np.r_[True, pairRay[chosen][1:] != pairRay[chosen][:-1]]]
+
+    dstScene = dst[chosen].astype(np.float32)
+    nearest = pairShape[chosen]
+    missed = dstScene >= dstMax
+    dstScene[missed] = dstMax
+    nearest[missed] = -1
+    return dstScene, nearest
+
+def _march(shapes, origin, rayDir, rayGroups):
+    # Sphere trace rays sorted by group from a shared origin, dropping each one as soon as it
+    # resolves. Contacts are given by the shape's number in `shapes`.
+    count = len(rayDir)
+    outcome = np.full(count, _outcomeSteps, np.int32)
+    contacts = np.full(count, -1, np.intp)
+
+    rays = np.arange(count)
+    rayPos = np.repeat(origin[None], count, axis=0)
+    dstTotal = np.zeros(count, np.float32)
+    for step in range(maxSteps):
+        if step == 0:
+            # Every ray is still at the origin, so they all take the same first step
+            dstScene, nearest = _dstScene(shapes, rayPos[:1], rayGroups[:1])
+            dstScene, nearest = np.repeat(dstScene, count), np.repeat(nearest, count)
+        else:
+            dstScene, nearest = _dstScene(shapes, rayPos, rayGroups)
+        dstTotal += dstScene
+        rayPos += rayDir * dstScene[:, None]
+
+        hit = dstScene <= thres
+        far = ~hit & (dstTotal >= dstMax)
+        contacts[rays[hit]] = nearest[hit]
+        outcome[rays[hit]] = _outcomeContact
+        outcome[rays[far]] = _outcomeDistance
+
+        going = ~(hit | far)
+        if not going.all():
+            rays, rayPos, rayDir, rayGroups, dstTotal = rays[going], rayPos[going], rayDir[going], rayGroups[going], dstTotal[going]
+            if len(rays) == 0: break
+
+    return outcome, contacts
+
+
+### Rendering ###
+def _renderShapes(shapes, viewportSize: vec2, pixelsX, pixelsY):
+    count = len(pixelsX)
+    if shapes.camera is None:
+        return np.repeat(_palette[_outcomeNoCamera:_outcomeNoCamera + 1], count, axis=0), np.full(count, -1, np.int32)
+
+    groups = (pixelsY // groupSize) * ((viewportSize.x + groupSize - 1) // groupSize) + (pixelsX // groupSize)
+    order = np.argsort(groups, kind='stable')
+    rayDir = _primaryRays(shapes.camera, viewportSize, pixelsX[order], pixelsY[order])
+
+    outcome = np.empty(count, np.int32)
+    contacts = np.empty(count, np.intp)
+    outcome[order], contacts[order] = _march(shapes, shapes.camera[0:3], rayDir, groups[order])
+
+    # Shapes with a colour function override the plain contact green
+    hit = contacts >= 0
+    outcome[hit] = shapes.outcomes[contacts[hit]]
+    contactIDs = np.full(count, -1, np.int32)
+    contactIDs[hit] = shapes.ids[contacts[hit]]
+    return _palette[outcome], contactIDs
+
+def renderPixels(shapeBuffers, viewportSize: vec2, pixelsX, pixelsY):
+    # Colours (n, 4) and contact IDs (n,) of the given pixels
+    return _renderShapes(_shapeSet(shapeBuffers), viewportSize, pixelsX, pixelsY)
+
+def render(shapeBuffers, viewportSize: vec2):
+    # The whole viewport, laid out like gl.renderToArray and gl.contacts: image is (height, width, 4)
+    # with row 0 at the bottom, contacts is flat and indexed by `x + width * y`
+    pixelsY, pixelsX = np.divmod(np.arange(viewportSize.x * viewportSize.y), viewportSize.x)
+    colors, contactIDs = renderPixels(shapeBuffers, viewportSize, pixelsX, pixelsY)
+    return colors.reshape(viewportSize.y, viewportSize.x, 4), contactIDs
+
+def renderScene(scene, viewportSize: vec2):
+    shapeBuffers, lightBuffers = scene.compileBufferData()
+    return render(shapeBuffers, viewportSize)
+
+
+### Tiled rendering ###
+# tiledRenderer splits the viewport into tiles and renders them on a pool of processes. Workers
+# attach to the framebuffer once, when the pool starts, and write their tiles straight into it.
+# The packed scene is copied into one more block of shared memory per frame, so a task is only
+# the scene block's name, the frame number and a rectangle. Mesh grids registered after the pool
+# started (any at all, where workers are spawned rather than forked) are not in the workers' copy
+# of raycekar.mesh, so each is copied into its own block once and named in every task after that.
+_worker = None
+
+class _workerState():
+    def __init__(self, imageName: str, contactName: str, viewportSize: vec2):
+        self.viewportSize = viewportSize
+        self.imageMemory = shared_memory.SharedMemory(imageName)
+        self.contactMemory = shared_memory.SharedMemory(contactName)
+        self.image = np.ndarray((viewportSize.y, viewportSize.x, 4), np.float32, buffer=self.imageMemory.buf)
+        self.contacts = np.ndarray((viewportSize.y, viewportSize.x), np.int32, buffer=self.contactMemory.buf)
+        self.sceneMemory = None
+        self.gridMemory = []
+        self.frame = None
+        self.shapes = None
+
+    def loadGrids(self, gridBlocks):
+        # Register the grids this worker hasn't seen yet under the ids they have in the main process
+        for gridID, gridName, shape, dtype, lo, cellSize in gridBlocks:
+            if gridID < len(mesh.grids): continue
+            memory = shared_memory.SharedMemory(gridName)
+            self.gridMemory.append(memory)
+            meshGrid = mesh.grid(np.ndarray(shape, dtype, buffer=memory.buf), vec3(*lo), cellSize)
+            meshGrid.id = len(mesh.grids)
+            mesh.grids.append(meshGrid)
+
+    def loadScene(self, sceneName: str, frame: int, sizes, gridBlocks):
+        # Parse each frame's scene once, however many of its tiles this worker ends up with
+        if self.frame == frame: return
+        self.loadGrids(gridBlocks)
+        if self.sceneMemory is None or self.sceneMemory.name != sceneName:
+            if not self.sceneMemory is None: self.sceneMemory.close()
+            self.sceneMemory = shared_memory.SharedMemory(sceneName)
+        offsets = np.cumsum([0] + list(sizes))
+        shapeBuffers = [np.ndarray((size,), np.uint8, buffer=self.sceneMemory.buf, offset=offset) for size, offset in zip(sizes, offsets)]
+        self.shapes = _shapeSet(shapeBuffers)
+        self.frame = frame
+
+def _initWorker(imageName: str, contactName: str, viewportSize: vec2):
+    global _worker
+    _worker = _workerState(imageName, contactName, viewportSize)
+
+def _renderTile(task):
+    sceneName, frame, sizes, gridBlocks, (x0, y0, x1, y1) = task
+    _worker.loadScene(sceneName, frame, sizes, gridBlocks)
+    pixelsY, pixelsX = np.divmod(np.arange((x1 - x0) * (y1 - y0)), x1 - x0)
+    colors, contactIDs = _renderShapes(_worker.shapes, _worker.viewportSize, pixelsX + x0, pixelsY + y0)
+    _worker.image[y0:y1, x0:x1] = colors.reshape(y1 - y0, x1 - x0, 4)
+    _worker.contacts[y0:y1, x0:x1] = contactIDs.reshape(y1 - y0, x1 - x0)
+
+class tiledRenderer():
+    # `image` and `contacts` live in shared memory and are laid out like render()'s results. They
+    # are overwritten by each render, so copy them to keep a frame. Use as a context manager or
+    # call close() to stop the workers and free the shared memory.
+    def __init__(self, viewportSize: vec2, processes: int = None, tileSize: vec2 = None):
+        self.viewportSize = viewportSize
+        self.processes = processes or os.cpu_count()
+        if tileSize is None:
+            # Every march step has a fixed cost, so tiles are as big as they can be while still
+            # leaving each process a few to balance the load with
+            side = 128
+            while side > groupSize and -(-viewportSize.x // side) * -(-viewportSize.y // side) < 4 * self.processes: side //= 2
+            tileSize = vec2(side, side)
+        self.tiles = [
+            (x, y, min(x + tileSize.x, viewportSize.x), min(y + tileSize.y, viewportSize.y))
+            for y in range(0, viewportSize.y, tileSize.y)
+            for x in range(0, viewportSize.x, tileSize.x)
+        ]
+
+        pixelCount = viewportSize.x * viewportSize.y
+        self._imageMemory = shared_memory.SharedMemory(create=True, size=pixelCount * 16)
+        self._contactMemory = shared_memory.SharedMemory(create=True, size=pixelCount * 4)
+        self.image = np.ndarray((viewportSize.y, viewportSize.x, 4), np.float32, buffer=self._imageMemory.buf)
+        self.contacts = np.ndarray((pixelCount,), np.int32, buffer=self._contactMemory.buf)
+        self._sceneMemory = None
+        self._frame = 0
+        # Forked workers start with the grids registered so far
+        self._gridBase = len(mesh.grids) if multiprocessing.get_start_method() == 'fork' else 0
+        self._gridMemory = []
+        self._gridBlocks = []
+
+        self._pool = multiprocessing.Pool(
+            self.processes, _initWorker,
+            (self._imageMemory.name, self._contactMemory.name, viewportSize)
+        )
+        log.debug('Started %s render processes for %s tiles', self.processes, len(self.tiles))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        self.close()
+
+    def _shareScene(self, shapeBuffers):
+        # Copy the packed scene into shared memory, replacing the block when it outgrows it
+        shapeBuffers = [np.frombuffer(data, np.uint8) for data in shapeBuffers]
+        sizes = [len(data) for data in shapeBuffers]
+        if self._sceneMemory is None or sum(sizes) > self._sceneMemory.size:
+            size = max(sum(sizes), 2 * self._sceneMemory.size if self._sceneMemory else 4096)
+            if not self._sceneMemory is None:
+                self._sceneMemory.close()
+                self._sceneMemory.unlink()
+            self._sceneMemory = shared_memory.SharedMemory(create=True, size=size)
+
+        offset = 0
+        for data in shapeBuffers:
+            np.ndarray((len(data),), np.uint8, buffer=self._sceneMemory.buf, offset=offset)[:] = data
+            offset += len(data)
+        return sizes
+
+    def _shareGrids(self):
+        # Copy each grid the workers can't see into shared memory, once
+        for meshGrid in mesh.grids[self._gridBase + len(self._gridBlocks):]:
+            values = np.ascontiguousarray(meshGrid.values)
+            memory = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            np.ndarray(values.shape, values.dtype, buffer=memory.buf)[:] = values
+            self._gridMemory.append(memory)
+            self._gridBlocks.append((meshGrid.id, memory.name, values.shape, values.dtype.str, tuple(meshGrid.lo), meshGrid.cellSize))
+        return tuple(self._gridBlocks)
+
+    def render(self, shapeBuffers):
+        sizes = self._shareScene(shapeBuffers)
+        gridBlocks = self._shareGrids()
+        self._frame += 1
+        tasks = [(self._sceneMemory.name, self._frame, sizes, gridBlocks, tile) for tile in self.tiles]
+        for done in self._pool.imap_unordered(_renderTile, tasks): pass
+        return self.image, self.contacts
+
+    def renderScene(self, scene):
+        shapeBuffers, lightBuffers = scene.compileBufferData()
+        return self.render(shapeBuffers)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        self.image = self.contacts = None
+        for memory in [self._imageMemory, self._contactMemory, self._sceneMemory] + self._gridMemory:
+            if memory is None: continue
+            memory.close()
+            memory.unlink()
+        self._sceneMemory = None
+        self._gridMemory = []
@@ -1,11 +1,98 @@
-import struct
+import bisect
+import numpy as np
 
 from raycekar.coord import *
+from raycekar.coord import _rows
 from raycekar.gl import contacts
 
 
+### Packed storage ###
+class _arena():
+    # Growable array backing one storage buffer, tracking the item ranges changed since the last upload
+    def __init__(self, dtype, capacity=64):
+        self.data = np.zeros(capacity, dtype)
+        self.size = 0
+        self._dirtyStarts = []
+        self._dirtyStops = []
+        self._dirtyBulk = []    # (starts, stops) arrays from vectorized writes
+
+    def __len__(self):
+        return self.size
+
+    def view(self):
+        return self.data[:self.size]
+
+    def allocate(self, count: int):
+        # Returns the offset of `count` new items, growing geometrically. Growing replaces
+        # `data`, so anything holding views into it has to be rebound.
+        offset = self.size
+        if offset + count > len(self.data):
+            data = np.zeros(max(offset + count, len(self.data) * 2), self.data.dtype)
+            data[:offset] = self.data[:offset]
+            self.data = data
+        self.size += count
+        self.markDirty(offset, self.size)
+        return offset
+
+    def markDirty(self, start: int, stop: int):
+        self._dirtyStarts.append(start)
+        self._dirtyStops.append(stop)
+
+    def markDirtyMany(self, starts, stops):
+        self._dirtyBulk.append((starts, stops))
+
+    def takeDirtyRanges(self):
+        # Sort and merge overlapping/adjacent ranges so each run can be one glBufferSubData
+        starts = np.concatenate([np.array(self._dirtyStarts, np.intp)] + [np.asarray(bulk[0], np.intp) for bulk in self._dirtyBulk])
+        stops = np.concatenate([np.array(self._dirtyStops, np.intp)] + [np.asarray(bulk[1], np.intp) for bulk in self._dirtyBulk])
+        self._dirtyStarts = []
+        self._dirtyStops = []
+        self._dirtyBulk = []
+
+        keep = stops > starts
+        starts = starts[keep]; stops = stops[keep]
+        if len(starts) == 0: return starts, stops
+
+        order = np.argsort(starts, kind='stable')
+        starts = starts[order]; stops = stops[order]
+        reach = np.maximum.accumulate(stops)
+        runBegins = np.flatnonzero(np.r_[True, starts[1:] > reach[:-1]])
+        runEnds = np.r_[runBegins[1:] - 1, len(starts) - 1]
+        return starts[runBegins], reach[runEnds]
+
+# Matches `_shapeHeader` in renderScene.glsl
+shapeHeaderType = np.dtype([('type', np.int32), ('intPtr', np.int32), ('floatPtr', np.int32), ('floatCount', np.int32)])
+
+class _field():
+    # Exposes part of an object's packed float record as an attribute. Writing it marks the
+    # object dirty, so `move`, `resize`, etc. only need to assign.
+    _sizes = {float: 1, vec2: 2, vec3: 3, vec4: 4, quat: 4}
+
+    def __init__(self, start: int, kind=float):
+        self.kind = kind
+        self.start = start
+        self.stop = start + self._sizes[kind]
+
+    def __get__(self, instance, owner):
+        if instance is None: return self
+        if self.kind is float: return float(instance._floats[self.start])
+        return self.kind(*instance._floats[self.start:self.stop].tolist())
+
+    def __set__(self, instance, value):
+        if self.kind is float: instance._floats[self.start] = float(value)
+        else: instance._floats[self.start:self.stop] = tuple(value)
+        instance._markDirty()
+
+
 ### Base object classes ###
 class object():
+    # Set by `scene` when the object is added. Once added, `_floats` is a view into the
+    # scene's float arena rather than the object's own array.
+    _scene = None
+    _slot = None
+    _floatOffset = None
+    _floatCount = 0
+
     def __init__(self, pos: vec3, rot: quat):
         self.pos = pos
         self.rot = rot
@@ -17,32 +104,78 @@ class object():
     def rotate(self, rot: quat, relative=False):
         self.rot = rot
 
+    def _markDirty(self):
+        if not self._scene is None: self._scene._markDirty(self)
+
     def compileBufferData(self):
         intData = b''
-        floatData = b''
+        floatData = self._floats.tobytes() if self._floatCount else b''
         return intData, floatData
 
 class camera(object):
+    _floatCount = 8
+    pos = _field(0, vec3)
+    rot = _field(4, quat)
+
     def __init__(self, pos: vec3, rot: quat, fov: float):
+        self._floats = np.zeros(self._floatCount, np.float32)
         self.pos = pos
         self.rot = rot
         self.fov = fov
 
+    @property
+    def fov(self):
+        return rad(float(self._floats[3]))
+
+    @fov.setter
+    def fov(self, value):
+        self._floats[3] = float(rad(value))
+        self._markDirty()
+
     def setFov(self, newFov: float):
         self.fov = newFov
-
-    def compileBufferData(self):
-        intData = b''
-        floatData = struct.pack(
-            'ffffffff',
-            *self.pos, rad(self.fov),
-            *self.rot
-        )
-        return intData, floatData
  
 class shape(object): pass
 
-class light(object): pass
+class light(object):
+    # Lights are packed like shapes but into the scene's light arenas: their type into
+    # lightTypeData and a record of up to lightRecordSize floats per light into lightFloatData
+    def _markDirty(self):
+        if not self._scene is None: self._scene._markLightDirty(self)
+
+
+class _selection():
+    # Vectorized access to the fields of many objects of one type, see `scene.select`
+    def __init__(self, scene, objects):
+        objectTypes = {type(selected) for selected in objects}
+        assert len(objectTypes) == 1, 'selections must contain objects of one type'
+        assert all(selected._scene is scene for selected in objects), 'selected objects must be in the scene'
+        self._scene = scene
+        self._type = objectTypes.pop()
+        self._offsets = np.array([selected._floatOffset for selected in objects], np.intp)
+        self._slots = np.array([selected._slot for selected in objects], np.intp)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def _indices(self, name: str):
+        field = getattr(self._type, name)
+        assert isinstance(field, _field), '{} has no packed field "{}"'.format(self._type.__name__, name)
+        return field, self._offsets[:, None] + np.arange(field.start, field.stop)
+
+    def __getitem__(self, name: str):
+        field, indices = self._indices(name)
+        values = self._scene.shapeFloatData.data[indices]
+        return values[:, 0] if field.kind is float else values
+
+    def __setitem__(self, name: str, values):
+        field, indices = self._indices(name)
+        floats = self._scene.shapeFloatData
+        values = np.asarray(values, np.float32)
+        if field.kind is float: values = values[..., None]
+        floats.data[indices] = np.broadcast_to(values, indices.shape)
+        floats.markDirtyMany(indices[:, 0], indices[:, -1] + 1)
+        self._scene._movedSlots.append(self._slots)
 
 
 class scene():
@@ -51,73 +184,409 @@ class scene():
         self.shapes = []
         self.lights = []
 
+        # Shape data lives in persistent arenas that objects write straight into. Slot 0 belongs
+        # to the camera (temporary until camera support takes off) and every shape after it gets
+        # the next slot. Each slot has a header locating its records, so the shader and CPU side
+        # can find any shape without decoding the ones before it. Only ranges written since the
+        # last upload are sent to the GPU.
+        self.shapeHeaderData = _arena(shapeHeaderType)
+        self.shapeIntData = _arena(np.int32)
+        self.shapeFloatData = _arena(np.float32)
+        self._boundFloats = self.shapeFloatData.data
+        self._addSlot(-1, np.zeros(camera._floatCount, np.float32))     # Placeholder until a camera is added
+
+        # Light N's record starts at N * lightRecordSize, whatever its type
+        self.lightTypeData = _arena(np.int32)
+        self.lightFloatData = _arena(np.float32, 64 * lightRecordSize)
+        self._boundLightFloats = self.lightFloatData.data
+
+        # Instance groups take one slot each, and their instances are numbered through the scene
+        # in the order the groups were added, for their contact IDs
+        self.groups = []
+        self.instanceCount = 0
+
+        # The BVH is rebuilt when shapes are added and refit around the slots and instances that
+        # moved. Below `bvhMinShapes` leaves walking every shape is cheaper than the traversal.
+        self.useBVH = True
+        self.bvhMinShapes = 16
+        self.bvh = _bvh()
+        self._bvhStale = True
+        self._movedSlots = []
+        self._movedInstances = []   # (group, indices)
+
+    def _addSlot(self, typeID: int, floats, ints=()):
+        slot = self.shapeHeaderData.allocate(1)
+        intOffset = self.shapeIntData.allocate(len(ints))
+        self.shapeIntData.data[intOffset:intOffset + len(ints)] = ints
+        floatOffset = self.shapeFloatData.allocate(len(floats))
+        self.shapeFloatData.data[floatOffset:floatOffset + len(floats)] = floats
+        self.shapeHeaderData.data[slot] = (typeID, intOffset, floatOffset, len(floats))
+        if not self.shapeFloatData.data is self._boundFloats: self._rebind()
+        return slot, floatOffset
+
+    def _objects(self):
+        # Objects holding views into the arenas
+        return self.cameras[:1] + self.shapes
+
+    def _bind(self, boundObject: object):
+        floats = self.lightFloatData if isinstance(boundObject, light) else self.shapeFloatData
+        boundObject._floats = floats.data[boundObject._floatOffset:boundObject._floatOffset + boundObject._floatCount]
+
+    def _rebind(self):
+        self._boundFloats = self.shapeFloatData.data
+        for boundObject in self._objects(): self._bind(boundObject)
+
+    def _rebindLights(self):
+        self._boundLightFloats = self.lightFloatData.data
+        for boundLight in self.lights: self._bind(boundLight)
+
+    def _attach(self, newObject: object, slot: int, floatOffset: int):
+        newObject._scene = self
+        newObject._slot = slot
+        newObject._floatOffset = floatOffset
+        self._bind(newObject)
+
+    def _markDirty(self, dirtyObject: object):
+        self.shapeFloatData.markDirty(dirtyObject._floatOffset, dirtyObject._floatOffset + dirtyObject._floatCount)
+        self._movedSlots.append(dirtyObject._slot)
+
+    def _markLightDirty(self, dirtyLight: light):
+        self.lightFloatData.markDirty(dirtyLight._floatOffset, dirtyLight._floatOffset + dirtyLight._floatCount)
+
+    def _markInstancesDirty(self, group, indices):
+        starts = group._floatOffset + group._instanceOffset + indices * instanceRecordSize
+        self.shapeFloatData.markDirtyMany(starts, starts + instanceRecordSize)
+        self._movedInstances.append((group, indices))
+
+    def _shapeBounds(self, slots):
+        # World-space AABBs of the shapes in `slots`, computed per shape type
+        lo = np.empty((len(slots), 3), np.float32)
+        hi = np.empty((len(slots), 3), np.float32)
+        headers = self.shapeHeaderData.data[slots]
+        types = headers['type']
+        offsets = headers['floatPtr']
+        for typeID in np.unique(types).tolist():
+            shapeType = objectTypes[typeID]
+            ofType = types == typeID
+            records = self.shapeFloatData.data[offsets[ofType][:, None] + np.arange(shapeType._floatCount)]
+            lo[ofType], hi[ofType] = shapeType._bounds(records)
+        return lo, hi
+
+    def _leafEntries(self):
+        # Slot and instance of each BVH leaf, in slot order: one per shape, with instance -1, and
+        # one per instance of each instance group
+        counts = np.ones(self.shapeCount - 1, np.intp)
+        for group in self.groups: counts[group._slot - 1] = group.count
+        slots = np.repeat(np.arange(1, self.shapeCount), counts)
+        instances = np.full(len(slots), -1, np.intp)
+        starts = np.cumsum(counts) - counts
+        for group in self.groups:
+            start = starts[group._slot - 1]
+            instances[start:start + group.count] = np.arange(group.count)
+        return slots, instances
+
+    def _leafBounds(self, slots, instances):
+        # World-space AABBs of BVH leaves, see _leafEntries
+        lo = np.empty((len(slots), 3), np.float32)
+        hi = np.empty((len(slots), 3), np.float32)
+        ofShapes = instances < 0
+        if ofShapes.any(): lo[ofShapes], hi[ofShapes] = self._shapeBounds(slots[ofShapes])
+        for group in self.groups:
+            ofGroup = slots == group._slot
+            if ofGroup.any(): lo[ofGroup], hi[ofGroup] = group._instanceBounds(instances[ofGroup])
+        return lo, hi
+
+    @property
+    def shapeCount(self):
+        # Entries in the shape header buffer, camera slot included
+        return len(self.shapeHeaderData)
+
+    @property
+    def leafCount(self):
+        # Shapes, counting each instance rather than the groups
+        return self.shapeCount - 1 - len(self.groups) + self.instanceCount
+
+    @property
+    def bvhActive(self):
+        return self.useBVH and self.leafCount >= self.bvhMinShapes
+
     def addCamera(self, newCamera: camera):
         assert isinstance(newCamera, camera)
+        assert newCamera._scene is None
         id = len(self.cameras)
         self.cameras.append(newCamera)
+        if id == 0:
+            self.shapeHeaderData.data['type'][0] = objectTypes.index(camera)
+            self.shapeHeaderData.markDirty(0, 1)
+            self.shapeFloatData.data[0:camera._floatCount] = newCamera._floats
+            self._attach(newCamera, 0, 0)
+            self._markDirty(newCamera)
         return id
 
     def addShape(self, newShape: shape):
         assert isinstance(newShape, shape)
+        assert newShape._scene is None
         id = len(self.shapes)
+        ints = ()
+        if isinstance(newShape, instances):
+            newShape.firstContact = self.instanceCount
+            newShape._ints[3] = self.instanceCount
+            newShape._updateBound()
+            ints = newShape._ints
+            self.groups.append(newShape)
+            self.instanceCount += newShape.count
+        self._attach(newShape, *self._addSlot(objectTypes.index(type(newShape)), newShape._floats, ints))
         self.shapes.append(newShape)
+        self._bvhStale = True
         return id
 
     def addLight(self, newLight: light):
-        pass
+        assert isinstance(newLight, light)
+        assert newLight._scene is None
+        id = self.lightTypeData.allocate(1)
+        self.lightTypeData.data[id] = objectTypes.index(type(newLight))
+        floatOffset = self.lightFloatData.allocate(lightRecordSize)
+        self.lightFloatData.data[floatOffset:floatOffset + newLight._floatCount] = newLight._floats
+        self.lights.append(newLight)
+        self._attach(newLight, id, floatOffset)
+        if not self.lightFloatData.data is self._boundLightFloats: self._rebindLights()
+        return id
 
     def removeObject(self, id: int):
         del self.objects[id]
 
+    def select(self, objects):
+        # Returns a selection for bulk reads/writes, e.g. `scene.select(spheres)['pos'] = positions`
+        # with `positions` an (n, 3) array. Cheap to keep around between frames.
+        return _selection(self, objects)
+
+    def instanceAt(self, contactID: int):
+        # The (group, index) of the instance a contact ID (see getContact) belongs to, or None if
+        # it isn't an instance's. Instances have IDs from -2 down.
+        number = -2 - contactID
+        if number < 0 or number >= self.instanceCount: return None
+        group = self.groups[bisect.bisect_right([group.firstContact for group in self.groups], number) - 1]
+        return group, number - group.firstContact
+
+    def update(self):
+        # Bring the BVH, and the bounds of instance groups, up to date with what was added or moved
+        # since the last call
+        movedSlots = np.concatenate([np.atleast_1d(np.asarray(slots, np.intp)) for slots in self._movedSlots]) if self._movedSlots else np.empty(0, np.intp)
+        movedInstances = self._movedInstances
+        self._movedSlots = []
+        self._movedInstances = []
+        for group in {id(group): group for group, indices in movedInstances}.values():
+            group._updateBound()
+            self.shapeFloatData.markDirty(group._floatOffset, group._floatOffset + 4)
+        if not self.bvhActive:
+            self._bvhStale = True
+            return
+        if self._bvhStale:
+            self.bvh.build(self)
+            self._bvhStale = False
+        elif len(movedSlots) or movedInstances:
+            self.bvh.refit(self, movedSlots, movedInstances)
+
     def compileBufferData(self):
-        shapeTypeData = b''
-        shapeIntData = b''
-        shapeFloatData = b''
+        # Zero-copy views of the packed shape data
+        shapeHeaderData = memoryview(self.shapeHeaderData.view())
+        shapeIntData = memoryview(self.shapeIntData.view())
+        shapeFloatData = memoryview(self.shapeFloatData.view())
+        return (shapeHeaderData, shapeIntData, shapeFloatData), self.compileLightBufferData()
+
+    def compileLightBufferData(self):
+        # Zero-copy views of the packed light data
+        return memoryview(self.lightTypeData.view()), memoryview(self.lightFloatData.view())
+
+
+### Acceleration ###
+def _mortonCodes(points):
+    # 30 bit Morton codes of points normalized to their own bounds
+    lo = points.min(axis=0)
+    extent = np.maximum(points.max(axis=0) - lo, 1e-9)
+    cells = np.clip(((points - lo) / extent * 1023).astype(np.uint32), 0, 1023)
+    codes = np.zeros(len(points), np.uint32)
+    for axis in range(3):
+        bits = cells[:, axis]
+        bits = (bits | (bits << 16)) & 0x030000FF
+        bits = (bits | (bits << 8)) & 0x0300F00F
+        bits = (bits | (bits << 4)) & 0x030C30C3
+        bits = (bits | (bits << 2)) & 0x09249249
+        codes |= bits << (2 - axis)
+    return codes
+
+class _bvh():
+    # Bounding volume hierarchy over shape AABBs, packed as `_bvhNode` in renderScene.glsl. It is
+    # built bottom-up by pairing neighbours in Morton order, level by level, which keeps building
+    # and refitting vectorized. Leaves store `left = -slot` and `right = -1`, or for instances
+    # `right = instance`; internal nodes store their children's indices. The root is node 0.
+    nodeType = np.dtype([('lo', np.float32, 3), ('left', np.int32), ('hi', np.float32, 3), ('right', np.int32)])
 
-        # Put the camera at the beginning of the shape buffers
-        # This is temporary until camera support takes off
-        shapeTypeData += struct.pack('i', objectTypes.index(camera))
-        objectIntData, objectFloatData = self.cameras[0].compileBufferData()
-        shapeIntData += objectIntData
-        shapeFloatData += objectFloatData
+    def __init__(self):
+        self.nodes = _arena(self.nodeType)
+        self._leaves = np.empty(0, np.intp)     # Slot -> leaf node, -1 for instance groups
+        self._instanceLeaves = {}               # Instance group slot -> leaf node of each instance
+        self._parents = np.empty(0, np.intp)    # Node -> parent node, -1 for the root
+        self._heights = np.empty(0, np.intp)    # Node -> build level, 0 for leaves
+        self._levels = []                       # Internal nodes of each build level
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def build(self, scene):
+        slots, instances = scene._leafEntries()
+        leafCount = len(slots)
+        self.nodes.size = 0
+        if leafCount == 0: return
+
+        lo, hi = scene._leafBounds(slots, instances)
+        order = np.argsort(_mortonCodes((lo + hi) * 0.5), kind='stable')
+        slots, instances, lo, hi = slots[order], instances[order], lo[order], hi[order]
+
+        # Pair up neighbours until one node is left, numbering nodes in creation order. An odd
+        # node out is carried up to the next level as is.
+        nodeCount = 2 * leafCount - 1
+        children = np.zeros((nodeCount, 2), np.intp)
+        parents = np.full(nodeCount, -1, np.intp)
+        heights = np.zeros(nodeCount, np.intp)
+        levels = []
+        level = np.arange(leafCount)
+        nextNode = leafCount
+        while len(level) > 1:
+            pairs = len(level) // 2
+            created = np.arange(nextNode, nextNode + pairs)
+            nextNode += pairs
+            children[created] = level[:2 * pairs].reshape(pairs, 2)
+            parents[level[:2 * pairs]] = np.repeat(created, 2)
+            heights[created] = len(levels) + 1
+            levels.append(created)
+            level = np.concatenate([created, level[2 * pairs:]])
+
+        # Flip the numbering so the root comes first
+        flip = lambda nodes: nodeCount - 1 - nodes
+        self._parents = np.where(parents[::-1] >= 0, flip(parents[::-1]), -1)
+        self._heights = heights[::-1].copy()
+        self._levels = [flip(created) for created in levels]
+        leaves = flip(np.arange(leafCount))
+        ofShapes = instances < 0
+        self._leaves = np.full(scene.shapeCount, -1, np.intp)
+        self._leaves[slots[ofShapes]] = leaves[ofShapes]
+        self._instanceLeaves = {}
+        for group in scene.groups:
+            ofGroup = slots == group._slot
+            self._instanceLeaves[group._slot] = np.empty(group.count, np.intp)
+            self._instanceLeaves[group._slot][instances[ofGroup]] = leaves[ofGroup]
+
+        self.nodes.allocate(nodeCount)
+        data = self.nodes.data
+        internal = flip(np.arange(leafCount, nodeCount))
+        data['left'][internal] = flip(children[leafCount:, 0])
+        data['right'][internal] = flip(children[leafCount:, 1])
+        data['left'][leaves] = -slots
+        data['right'][leaves] = instances
+        data['lo'][leaves] = lo
+        data['hi'][leaves] = hi
+        for created in self._levels: self._refitNodes(created)
+
+    def refit(self, scene, slots, movedInstances=()):
+        # Update the moved leaves, then their ancestors from the bottom up. `movedInstances` is
+        # (group, indices) pairs.
+        slots = np.unique(slots)
+        slots = slots[slots > 0]
+        slots = slots[self._leaves[slots] >= 0]
+        instances = [np.full(len(slots), -1, np.intp)] + [indices for group, indices in movedInstances]
+        leaves = [self._leaves[slots]] + [self._instanceLeaves[group._slot][indices] for group, indices in movedInstances]
+        slots = [slots] + [np.full(len(indices), group._slot, np.intp) for group, indices in movedInstances]
+        slots, instances, leaves = np.concatenate(slots), np.concatenate(instances), np.concatenate(leaves)
+        if len(slots) == 0 or len(self.nodes) == 0: return
+        data = self.nodes.data
+        data['lo'][leaves], data['hi'][leaves] = scene._leafBounds(slots, instances)
+        self.nodes.markDirtyMany(leaves, leaves + 1)
+
+        ancestors = []
+        nodes = self._parents[leaves]
+        while len(nodes):
+            nodes = np.unique(nodes[nodes >= 0])
+            ancestors.append(nodes)
+            nodes = self._parents[nodes]
+        ancestors = np.unique(np.concatenate(ancestors))
+        heights = self._heights[ancestors]
+        for height in np.unique(heights).tolist():
+            self._refitNodes(ancestors[heights == height])
+
+    def _refitNodes(self, nodes):
+        data = self.nodes.data
+        left = data['left'][nodes]
+        right = data['right'][nodes]
+        data['lo'][nodes] = np.minimum(data['lo'][left], data['lo'][right])
+        data['hi'][nodes] = np.maximum(data['hi'][left], data['hi'][right])
+        self.nodes.markDirtyMany(nodes, nodes + 1)
 
-        for shape in self.shapes:
-            shapeTypeData += struct.pack('i', objectTypes.index(type(shape)))
-            objectIntData, objectFloatData = shape.compileBufferData()
-            shapeIntData += objectIntData
-            shapeFloatData += objectFloatData
 
-        lightTypeData = b''
-        lightFloatData = b''
+### Shapes ###
+# Shape classes describe their packed records to the CPU side: `_bounds(records)` gives AABBs for
+# the BVH and `_distances(rayPos, records, rows)` evaluates the same SDF as renderScene.glsl for
+# raycekar.cpu, taking shape records[rows[i]] at rayPos[i]. `_glslName` ties the type to its code
+# in renderScene.glsl (HAS_<NAME> and sdf<Name>Record) for gl's specialized programs.
+def _rotationMatrices(rot):
+    # (n, 3, 3) rotation matrices of (n, 4) quaternions, normalized first like the shader does
+    n, i, j, k = (rot / np.linalg.norm(rot, axis=1, keepdims=True)).T
+    return np.stack([
+        np.stack([1 - 2 * (j * j + k * k), 2 * (i * j - k * n), 2 * (i * k + j * n)], axis=1),
+        np.stack([2 * (i * j + k * n), 1 - 2 * (i * i + k * k), 2 * (j * k - i * n)], axis=1),
+        np.stack([2 * (i * k - j * n), 2 * (j * k + i * n), 1 - 2 * (i * i + j * j)], axis=1)
+    ], axis=1)
 
-        for light in self.lights:
-            typeData += struct.pack('i', objectTypes.index(type(light)))
-            objectFloatData = light.compileBufferData()
-            lightFloatData += objectFloatData
+class sphere(shape):
+    _floatCount = 4
+    _glslName = 'Sphere'
+    pos = _field(0, vec3)
+    radius = _field(3)
 
-        return (shapeTypeData, shapeIntData, shapeFloatData), (lightTypeData, lightFloatData)
+    @staticmethod
+    def _bounds(records):
+        radius = np.abs(records[:, 3:4])
+        return records[:, 0:3] - radius, records[:, 0:3] + radius
 
+    @staticmethod
+    def _distances(rayPos, records, rows):
+        x, y, z = (rayPos - records[rows, 0:3]).T
+        return np.sqrt(x * x + y * y + z * z) - records[rows, 3]
 
-### Shapes ###
-class sphere(shape):
     def __init__(self, pos: vec3, radius: float):
+        self._floats = np.zeros(self._floatCount, np.float32)
         self.pos = pos
         self.radius = radius
 
-    def resize(self, rad: float):
-        self.rad = rad
-
-    def compileBufferData(self):
-        intData = b''
-        floatData = struct.pack(
-            'ffff',
-            *self.pos,
-            self.radius
-        )
-        return intData, floatData
+    def resize(self, radius: float):
+        self.radius = radius
 
 class box(shape):
+    _floatCount = 12
+    _glslName = 'Box'
+    pos = _field(0, vec3)
+    rot = _field(4, quat)
+    dim = _field(8, vec3)
+
+    @staticmethod
+    def _bounds(records):
+        # Half extents projected through the absolute rotation matrix
+        rotation = _rotationMatrices(records[:, 4:8])
+        extent = np.einsum('nij,nj->ni', np.abs(rotation), np.abs(records[:, 8:11]) * 0.5)
+        return records[:, 0:3] - extent, records[:, 0:3] + extent
+
+    @staticmethod
+    def _distances(rayPos, records, rows):
+        # rayRel = rotation^T (rayPos - pos), then the distance to the nearest face, edge or corner
+        rotation = _rotationMatrices(records[:, 4:8])[rows]
+        rayRel = np.einsum('nkj,nk->nj', rotation, rayPos - records[rows, 0:3])
+        x, y, z = (np.abs(rayRel) - records[rows, 8:11] * 0.5).T
+        inside = np.maximum(np.maximum(x, y), z)
+        outside = np.sqrt(np.square(np.maximum(x, 0)) + np.square(np.maximum(y, 0)) + np.square(np.maximum(z, 0)))
+        return np.where(inside < 0, inside, outside)
+
     def __init__(self, pos: vec3, rot: quat, dim: vec3):
+        self._floats = np.zeros(self._floatCount, np.float32)
         self.pos = pos
         self.rot = rot
         self.dim = dim
@@ -125,37 +594,161 @@ class box(shape):
     def resize(self, newDim: vec3):
         self.dim = newDim
 
-    def compileBufferData(self):
-        intData = b''
-        floatData = struct.pack(
-            'ffffffffffff',
-            *self.pos, 0.0,
-            *self.rot,
-            *self.dim, 0.0
-        )
-        return intData, floatData
+class mesh(shape):
+    # A triangle mesh, drawn from the signed distance grid baked from it (see raycekar.mesh) and
+    # scaled by `scale`. Meshes loaded from the same file share one grid.
+    _floatCount = 19
+    _glslName = 'Mesh'
+    pos = _field(0, vec3)
+    scale = _field(3)
+    rot = _field(4, quat)
+    # 8-10: grid lo, 11: cell size, 12-14: grid size in points, 15-17: atlas origin, 18: grid id
+
+    @staticmethod
+    def _bounds(records):
+        # The grid's box, scaled, placed and rotated like a box
+        rotation = _rotationMatrices(records[:, 4:8])
+        scale = np.abs(records[:, 3:4])
+        halfSize = (records[:, 12:15] - 1) * records[:, 11:12] * 0.5
+        center = records[:, 0:3] + np.einsum('nij,nj->ni', rotation, (records[:, 8:11] + halfSize) * records[:, 3:4])
+        extent = np.einsum('nij,nj->ni', np.abs(rotation), halfSize * scale)
+        return center - extent, center + extent
+
+    @staticmethod
+    def _distances(rayPos, records, rows):
+        from raycekar import mesh as meshGrids     # mesh is imported by raycekar after env
+        rotation = _rotationMatrices(records[:, 4:8])[rows]
+        scale = records[rows, 3]
+        rayRel = np.einsum('nkj,nk->nj', rotation, rayPos - records[rows, 0:3]) / scale[:, None]
+        cells = (rayRel - records[rows, 8:11]) / records[rows, 11:12]
+        dst = np.empty(len(rows), np.float32)
+        gridIDs = records[rows, 18].astype(np.int64)
+        for gridID in np.unique(gridIDs).tolist():
+            ofGrid = gridIDs == gridID
+            dst[ofGrid] = meshGrids.grids[gridID].sample(cells[ofGrid])
+        return dst * records[rows, 11] * scale
+
+    def __init__(self, pos: vec3, rot: quat, scale: float, meshGrid):
+        # `meshGrid` is a raycekar.mesh.grid, or the path of a mesh file to load one from
+        from raycekar import mesh as meshGrids
+        if not isinstance(meshGrid, meshGrids.grid): meshGrid = meshGrids.load(meshGrid)
+        meshGrids.register(meshGrid)
+        self.grid = meshGrid
+        self._floats = np.zeros(self._floatCount, np.float32)
+        self._floats[8:19] = (*meshGrid.lo, meshGrid.cellSize, *meshGrid.size, *meshGrid.atlasOrigin, meshGrid.id)
+        self.pos = pos
+        self.rot = rot
+        self.scale = scale
+
+    def resize(self, scale: float):
+        self.scale = scale
+
+
+### Instancing ###
+instanceRecordSize = 8      # Floats per instance: pos, scale and inverse rotation
+
+class instances(shape):
+    # Copies of a prototype, a shape or a list of shapes taken as their union, each with its own
+    # position, rotation and uniform scale. The prototype's records are stored once, as they were
+    # when the group was made, and each instance only takes instanceRecordSize floats: its position,
+    # scale and inverse rotation, normalized here so the shader can use it as is. The group is one
+    # contiguous range of the scene's float data and each of its instances is a leaf of the BVH.
+    # Contacts with instances have IDs from -2 down, see `scene.instanceAt`.
+    _glslName = 'Instances'
+    # Ints: part count, instance count, offset of the instance records, first contact number, then
+    # each part's type and offset; offsets are from the group's first float. Floats: bounding sphere
+    # (for tile culling), the parts' records, then the instance records.
+
+    def __init__(self, prototype, pos, rot=None, scale=None):
+        # `pos` places one instance per row; `rot` (quaternions) and `scale` default to none and 1.
+        # All three take arrays, vec3Array/quatArray or single values.
+        parts = list(prototype) if isinstance(prototype, (list, tuple)) else [prototype]
+        assert len(parts) and all(isinstance(part, shape) and not isinstance(part, instances) for part in parts), 'prototypes are made of shapes'
+        pos = _rows(pos).reshape(-1, 3)
+        self.parts = parts
+        self.count = len(pos)
+        self.firstContact = None    # Set by the scene
+
+        partOffsets = (4 + np.cumsum([0] + [part._floatCount for part in parts])).tolist()
+        self._instanceOffset = partOffsets[-1]
+        self._floatCount = self._instanceOffset + self.count * instanceRecordSize
+        self._floats = np.zeros(self._floatCount, np.float32)
+        partInts = []
+        for part, offset in zip(parts, partOffsets):
+            self._floats[offset:offset + part._floatCount] = part._floats
+            partInts += [objectTypes.index(type(part)), offset]
+        self._ints = np.array([len(parts), self.count, self._instanceOffset, 0] + partInts, np.int32)
+
+        # Box around the prototype in its own frame
+        bounds = [type(part)._bounds(part._floats[None].astype(np.float64)) for part in parts]
+        self._prototypeLo = np.min([lo[0] for lo, hi in bounds], axis=0)
+        self._prototypeHi = np.max([hi[0] for lo, hi in bounds], axis=0)
+
+        self.place(np.arange(self.count), pos, quat(1, 0, 0, 0) if rot is None else rot, 1 if scale is None else scale)
+
+    def _records(self):
+        # (count, instanceRecordSize) view of the instance records
+        return self._floats[self._instanceOffset:].reshape(self.count, instanceRecordSize)
+
+    def _instanceBounds(self, indices):
+        # World-space AABBs of the instances at `indices`, around the prototype's box like box._bounds
+        records = self._records()[indices]
+        rotation = _rotationMatrices(records[:, 4:8]).transpose(0, 2, 1)     # Forward, from the inverse
+        scale = np.abs(records[:, 3:4])
+        center = records[:, 0:3] + np.einsum('nij,j->ni', rotation, (self._prototypeLo + self._prototypeHi) * 0.5) * records[:, 3:4]
+        extent = np.einsum('nij,j->ni', np.abs(rotation), (self._prototypeHi - self._prototypeLo) * 0.5) * scale
+        return center - extent, center + extent
+
+    def _updateBound(self):
+        # Bounding sphere of every instance
+        if self.count == 0: return
+        lo, hi = self._instanceBounds(np.arange(self.count))
+        lo, hi = lo.min(axis=0), hi.max(axis=0)
+        self._floats[0:3] = (lo + hi) * 0.5
+        self._floats[3] = np.linalg.norm(hi - lo) * 0.5
+
+    def place(self, indices, pos=None, rot=None, scale=None):
+        # Set the positions, rotations and/or scales of the instances at `indices`, one per index
+        # or one for all of them
+        indices = np.atleast_1d(np.asarray(indices, np.intp))
+        records = self._records()
+        if not pos is None: records[indices, 0:3] = _rows(pos)
+        if not scale is None: records[indices, 3] = np.asarray(scale, np.float32)
+        if not rot is None:
+            rot = _rows(rot).reshape(-1, 4).astype(np.float64)
+            rot /= np.linalg.norm(rot, axis=1, keepdims=True)
+            records[indices, 4] = rot[:, 0]
+            records[indices, 5:8] = -rot[:, 1:4]
+        if not self._scene is None: self._scene._markInstancesDirty(self, indices)
+
+    def transforms(self, indices=None):
+        # Positions (n, 3), rotations (n, 4) and scales (n,) of the instances at `indices`, or all of them
+        records = self._records() if indices is None else self._records()[indices]
+        return records[:, 0:3].copy(), records[:, 4:8] * np.array([1, -1, -1, -1], np.float32), records[:, 3].copy()
 
 
 ### Lights ###
+# Light records are read by shadeContact in renderScene.glsl; see docs/lighting.md
+lightRecordSize = 12
+
 class pointLight(light):
-    def __init__(self, pos: vec3, radius: float, intensity: float, falloff: float, color):
+    _floatCount = 9
+    pos = _field(0, vec3)
+    radius = _field(3)
+    color = _field(4, vec3)
+    intensity = _field(7)
+    falloff = _field(8)
+
+    def __init__(self, pos: vec3, radius: float, intensity: float, falloff: float, color: vec3):
+        self._floats = np.zeros(self._floatCount, np.float32)
         self.pos = pos
         self.radius = radius
         self.intensity = intensity
         self.falloff = falloff
         self.color = color
 
-    def compileBufferData(self):
-        intData = b''
-        floatData = struct.pack(
-            'f' * 9,
-            *self.pos,
-            self.radius,
-            self.intensity,
-            self.falloff,
-            self.color
-        )
-        return intData, floatData
+    def resize(self, radius: float):
+        self.radius = radius
 
 
 # `objectTypes` is used to calculate the shape ID to match to renderScene.glsl
@@ -163,10 +756,13 @@ objectTypes = [
     camera,
     sphere,
     box,
-    pointLight
+    pointLight,
+    mesh,
+    instances
 ]
 
 
 def getContact(pos: vec2):
-    from raycekar.gl import viewportSize
-    return contacts.scene[pos.x + (viewportSize.x * pos.y)]
+    # From the last gl.getContactsScene; use gl.queryContacts to avoid the full-frame stall
+    from raycekar.gl import _viewportSize
+    return int(contacts.scene[pos.x + (_viewportSize.x * pos.y)])
@@ -1,37 +1,138 @@
 import logging
 
-from raycekar.util import loggingHandler
-
 
 logger = logging.getLogger('rk.events')
-logger.addHandler(loggingHandler)
-logger.setLevel(logging.DEBUG)
 
 
-events = []
+# Active events by (device, code), e.g. ('key', 65), each an insertion-ordered dict used as a set
+# so activating, deactivating and dispatching don't depend on how many events exist. Events with
+# no device named like an input, e.g. 'key_ESCAPE', are keyed by that input's (device, code);
+# other names by (None, name).
+events = {}
+_names = {}     # name -> active events with that name, same layout
+deviceCodes = {}    # device -> {input name: code}, filled in by raycekar.ui
 
 class event:
-    def __init__(self, name, callback):
+    def __init__(self, name, callback, device=None, code=None):
         self.name = name
         self.callback = callback
-        logger.debug('Created event "{}"'.format(self.name))
+        if device is None:
+            prefix, _, inputName = name.partition('_')
+            code = deviceCodes.get(prefix, {}).get(inputName)
+            if not code is None: device = prefix
+        self.key = (device, name if device is None else code)
+        logger.debug('Created event "%s"', self.name)
 
     def activate(self):
-        if not self in events:
-            logger.debug('Activating event "{}"'.format(self.name))
-            events.append(self)
+        subscribers = events.setdefault(self.key, {})
+        if not self in subscribers:
+            logger.debug('Activating event "%s"', self.name)
+            subscribers[self] = None
+            _names.setdefault(self.name, {})[self] = None
 
     def deactivate(self):
-        if self in events:
-            logger.debug('Deactivating event "{}"'.format(self.name))
-            del(events[self])
+        subscribers = events.get(self.key)
+        if subscribers and self in subscribers:
+            logger.debug('Deactivating event "%s"', self.name)
+            del subscribers[self]
+            if not subscribers: del events[self.key]
+            named = _names[self.name]
+            del named[self]
+            if not named: del _names[self.name]
+
+    @property
+    def active(self):
+        return self in events.get(self.key, ())
 
     def fire(self, args=(), kwargs={}):
-        logger.debug('Firing event "{}" (args={}, kwargs={})'.format(self.name, args, kwargs))
+        if logger.isEnabledFor(logging.DEBUG): logger.debug('Firing event "%s" (args=%s, kwargs=%s)', self.name, args, kwargs)
         self.callback(*args, **kwargs)
 
+def dispatch(device, code, args=(), kwargs={}, coalesce=False):
+    # Fire every event subscribed to (device, code), in activation order, or queue them for
+    # `drain` in queued mode (see `setQueued`). Returns whether anything was fired or queued.
+    if not _queue is None: return _queue.push(device, code, args, kwargs, coalesce)
+    return _fire((device, code), args, kwargs)
+
+def _fire(key, args, kwargs):
+    subscribers = events.get(key)
+    if not subscribers: return False
+    for subscriber in tuple(subscribers):   # Callbacks may (de)activate events
+        subscriber.fire(args, kwargs)
+    return True
+
 def getEventByName(name):
-    for event in events:
-        if event.name == name:
-            return event
-    return None
+    # The first active event called `name`
+    named = _names.get(name)
+    return next(iter(named)) if named else None
+
+
+### Queued mode ###
+class _eventQueue():
+    # Fixed size ring of [key, args, kwargs] records. A record pushed with `coalesce` (a key
+    # repeat, a cursor move) replaces the args of the last record for the same input instead of
+    # taking a slot, as long as no other non-coalescing record was pushed since, so presses and
+    # releases keep their order. When the ring is full new records are dropped and counted.
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.records = [None] * capacity
+        self.head = 0       # Oldest record
+        self.count = 0
+        self.pushed = 0     # Records ever queued, used as sequence numbers
+        self.barrier = -1   # Sequence number of the last non-coalescing record
+        self.latest = {}    # key -> sequence number of its last queued record
+        self.dropped = 0
+
+    def push(self, device, code, args, kwargs, coalesce):
+        key = (device, code)
+        if not key in events: return False
+        if coalesce:
+            sequence = self.latest.get(key, -1)
+            if sequence > self.barrier and sequence >= self.pushed - self.count:
+                record = self.records[sequence % self.capacity]
+                record[1] = args; record[2] = kwargs
+                return True
+        if self.count == self.capacity:
+            self.dropped += 1
+            return False
+        self.records[self.pushed % self.capacity] = [key, args, kwargs]
+        self.latest[key] = self.pushed
+        if not coalesce: self.barrier = self.pushed
+        self.pushed += 1
+        self.count += 1
+        return True
+
+    def drain(self):
+        # Only what was queued before the call; events queued by callbacks wait for the next drain
+        fired = 0
+        self.latest.clear()
+        for _ in range(self.count):
+            slot = self.head
+            key, args, kwargs = self.records[slot]
+            self.records[slot] = None
+            self.head = (slot + 1) % self.capacity
+            self.count -= 1
+            fired += _fire(key, args, kwargs)
+        return fired
+
+_queue = None
+
+def setQueued(enabled: bool, capacity=1024):
+    # In queued mode input callbacks only record events, and the game fires them all at once
+    # with `drain()` at a point of its choosing in the frame. Disabling drains what is left.
+    global _queue
+    if enabled:
+        if _queue is None:
+            logger.info('Queueing events (capacity %s)', capacity)
+            _queue = _eventQueue(capacity)
+    elif not _queue is None:
+        queue, _queue = _queue, None
+        queue.drain()
+
+def drain():
+    # Fire everything queued since the last drain, in order. Returns how many records were fired.
+    return 0 if _queue is None else _queue.drain()
+
+def droppedCount():
+    # Events lost to a full queue since queued mode was enabled
+    return 0 if _queue is None else _queue.dropped
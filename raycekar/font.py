@@ -0,0 +1,349 @@
+# Signed distance field glyph atlases for text in the UI (see ui.text). Glyph outlines are read
+# straight from a TrueType file, flattened to line segments, and turned into distance fields with
+# NumPy, which is slow enough that atlases are cached on disk, keyed on the font file's contents,
+# the size and the characters. A distance field scales, so one atlas serves text of any size.
+
+import hashlib, logging, os, pathlib, struct, sys
+import numpy as np
+
+from raycekar import util
+
+
+log = logging.getLogger('rk.font')
+
+defaultChars = ''.join(chr(code) for code in range(32, 127))
+_fontPaths = [
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/TTF/DejaVuSans.ttf',
+    '/usr/share/fonts/dejavu/DejaVuSans.ttf',
+    '/Library/Fonts/Arial.ttf',
+    'C:/Windows/Fonts/arial.ttf'
+]
+_atlasVersion = 1   # Bump when the atlas layout or generation changes, so old cache entries are ignored
+
+
+### TrueType ###
+class _trueType():
+    # Just enough of TrueType to get glyph outlines and advances: cmap formats 4 and 12, glyf
+    # simple and composite glyphs, hmtx. No hinting or kerning.
+    def __init__(self, data: bytes):
+        self.data = data
+        tableCount = struct.unpack_from('>H', data, 4)[0]
+        self.tables = {}
+        for index in range(tableCount):
+            tag, checksum, offset, length = struct.unpack_from('>4sIII', data, 12 + index * 16)
+            self.tables[tag.decode('latin-1')] = offset
+
+        self.unitsPerEm = struct.unpack_from('>H', data, self.tables['head'] + 18)[0]
+        longOffsets = struct.unpack_from('>h', data, self.tables['head'] + 50)[0]
+        glyphCount = struct.unpack_from('>H', data, self.tables['maxp'] + 4)[0]
+        self.ascender, self.descender, self.lineGap = struct.unpack_from('>hhh', data, self.tables['hhea'] + 4)
+        metricCount = struct.unpack_from('>H', data, self.tables['hhea'] + 34)[0]
+
+        self.advances = np.frombuffer(data, '>u2', metricCount * 2, self.tables['hmtx'])[0::2].astype(np.int32)
+        if longOffsets: self.offsets = np.frombuffer(data, '>u4', glyphCount + 1, self.tables['loca']).astype(np.int64)
+        else: self.offsets = np.frombuffer(data, '>u2', glyphCount + 1, self.tables['loca']).astype(np.int64) * 2
+        self.charMap = self._readCharMap()
+
+    def _readCharMap(self):
+        data = self.data
+        base = self.tables['cmap']
+        subtables = {}
+        for index in range(struct.unpack_from('>H', data, base + 2)[0]):
+            platform, encoding, offset = struct.unpack_from('>HHI', data, base + 4 + index * 8)
+            subtables[(platform, encoding)] = base + offset
+
+        charMap = {}
+        for key in ((3, 10), (0, 4), (0, 3), (3, 1)):
+            if not key in subtables: continue
+            offset = subtables[key]
+            charFormat = struct.unpack_from('>H', data, offset)[0]
+            if charFormat == 12:
+                for group in range(struct.unpack_from('>I', data, offset + 12)[0]):
+                    start, end, glyph = struct.unpack_from('>III', data, offset + 16 + group * 12)
+                    for code in range(start, min(end, 0x10FFFF) + 1): charMap[code] = glyph + code - start
+                return charMap
+            if charFormat == 4:
+                segments = struct.unpack_from('>H', data, offset + 6)[0] // 2
+                ends = struct.unpack_from('>{}H'.format(segments), data, offset + 14)
+                starts = struct.unpack_from('>{}H'.format(segments), data, offset + 16 + segments * 2)
+                deltas = struct.unpack_from('>{}h'.format(segments), data, offset + 16 + segments * 4)
+                rangesAt = offset + 16 + segments * 6
+                ranges = struct.unpack_from('>{}H'.format(segments), data, rangesAt)
+                for segment in range(segments):
+                    for code in range(starts[segment], ends[segment] + 1):
+                        if code == 0xFFFF: break
+                        if ranges[segment] == 0: glyph = (code + deltas[segment]) & 0xFFFF
+                        else:
+                            at = rangesAt + segment * 2 + ranges[segment] + (code - starts[segment]) * 2
+                            glyph = struct.unpack_from('>H', data, at)[0]
+                            if glyph: glyph = (glyph + deltas[segment]) & 0xFFFF
+                        charMap[code] = glyph
+                return charMap
+        log.warning('Font has no supported character map')
+        return charMap
+
+    def glyph(self, char: str):
+        return self.charMap.get(ord(char), 0)
+
+    def advance(self, glyph: int):
+        return int(self.advances[min(glyph, len(self.advances) - 1)])
+
+    def contours(self, glyph: int):
+        # Outline of a glyph as a list of closed (n, 2) point arrays in font units, curves flattened
+        data = self.data
+        start, stop = self.offsets[glyph], self.offsets[glyph + 1]
+        if stop <= start: return []
+        at = self.tables['glyf'] + int(start)
+        contourCount = struct.unpack_from('>h', data, at)[0]
+        if contourCount < 0: return self._compositeContours(at + 10)
+
+        ends = struct.unpack_from('>{}H'.format(contourCount), data, at + 10)
+        pointCount = ends[-1] + 1 if contourCount else 0
+        at += 10 + contourCount * 2
+        at += 2 + struct.unpack_from('>H', data, at)[0]     # Skip the instructions
+
+        flags = []
+        while len(flags) < pointCount:
+            flag = data[at]; at += 1
+            flags.append(flag)
+            if flag & 8:
+                flags.extend([flag] * data[at]); at += 1
+        coordinates = []
+        for short, same in ((2, 16), (4, 32)):
+            values = []
+            for flag in flags:
+                if flag & short:
+                    values.append(data[at] if flag & same else -data[at]); at += 1
+                elif flag & same: values.append(0)
+                else:
+                    values.append(struct.unpack_from('>h', data, at)[0]); at += 2
+            coordinates.append(np.cumsum(values))
+        points = np.stack(coordinates, axis=1).astype(np.float64)
+        onCurve = np.array([flag & 1 for flag in flags], bool)
+
+        contours = []
+        first = 0
+        for end in ends:
+            contours.append(_flatten(points[first:end + 1], onCurve[first:end + 1]))
+            first = end + 1
+        return [contour for contour in contours if len(contour) > 1]
+
+    def _compositeContours(self, at):
+        data = self.data
+        contours = []
+        while True:
+            flags, glyph = struct.unpack_from('>HH', data, at); at += 4
+            if flags & 1: dx, dy = struct.unpack_from('>hh', data, at); at += 4
+            else: dx, dy = struct.unpack_from('>bb', data, at); at += 2
+            matrix = np.eye(2)
+            if flags & 8:
+                matrix *= struct.unpack_from('>h', data, at)[0] / 16384; at += 2
+            elif flags & 0x40:
+                matrix = np.diag(np.array(struct.unpack_from('>hh', data, at)) / 16384); at += 4
+            elif flags & 0x80:
+                matrix = np.array(struct.unpack_from('>hhhh', data, at)).reshape(2, 2) / 16384; at += 8
+            if not flags & 2: dx = dy = 0   # Point matching, rare enough to leave out
+            contours += [contour @ matrix + (dx, dy) for contour in self.contours(glyph)]
+            if not flags & 0x20: return contours
+
+def _flatten(points, onCurve, steps=6):
+    # Quadratic B-spline contour to a closed polyline. Two off-curve points in a row have an
+    # implied on-curve point halfway between them.
+    if not onCurve.any(): start = (points[0] + points[-1]) / 2
+    else:
+        first = int(np.argmax(onCurve))
+        points = np.roll(points, -first, axis=0); onCurve = np.roll(onCurve, -first)
+        start = points[0]
+    output = [start]
+    current = start
+    control = None
+    t = np.linspace(0, 1, steps + 1)[1:, None]
+    for point, on in list(zip(points[1:] if onCurve.any() else points, onCurve[1:] if onCurve.any() else onCurve)) + [(start, True)]:
+        if on:
+            if control is None: output.append(point)
+            else:
+                output.extend((1 - t) ** 2 * current + 2 * (1 - t) * t * control + t ** 2 * point)
+                control = None
+            current = point
+        else:
+            if not control is None:
+                middle = (control + point) / 2
+                output.extend((1 - t) ** 2 * current + 2 * (1 - t) * t * control + t ** 2 * middle)
+                current = middle
+            control = point
+    return np.array(output)
+
+
+### Distance fields ###
+def _signedDistances(segments, origin, shape):
+    # Distance in pixels from each pixel center of a (height, width) grid with its lower left
+    # corner at `origin` to the nearest segment, positive inside the outline (non-zero winding)
+    ys, xs = np.mgrid[0:shape[0], 0:shape[1]]
+    pixels = np.stack([xs.ravel() + 0.5 + origin[0], ys.ravel() + 0.5 + origin[1]], axis=1)
+    if len(segments) == 0: return np.full(shape, -np.inf)
+
+    a = segments[None, :, 0]; b = segments[None, :, 1]
+    distances = np.empty(len(pixels))
+    winding = np.zeros(len(pixels), np.int32)
+    for first in range(0, len(pixels), 4096):
+        p = pixels[first:first + 4096, None]
+        edge = b - a
+        along = np.clip(np.sum((p - a) * edge, axis=2) / np.maximum(np.sum(edge * edge, axis=2), 1e-12), 0, 1)
+        distances[first:first + 4096] = np.sqrt(np.min(np.sum((a + along[..., None] * edge - p) ** 2, axis=2), axis=1))
+
+        # Crossings of the ray from each pixel towards +x
+        up = (a[..., 1] <= p[..., 1]) & (b[..., 1] > p[..., 1])
+        down = (a[..., 1] > p[..., 1]) & (b[..., 1] <= p[..., 1])
+        crossX = a[..., 0] + (p[..., 1] - a[..., 1]) * edge[..., 0] / np.where(edge[..., 1] == 0, 1, edge[..., 1])
+        right = crossX > p[..., 0]
+        winding[first:first + 4096] = np.sum(up & right, axis=1) - np.sum(down & right, axis=1)
+    return np.where(winding != 0, distances, -distances).reshape(shape)
+
+
+### Atlas ###
+class atlas():
+    # Glyphs rendered at `size` pixels to the em, with `spread` pixels of distance field around
+    # them. `pixels` is a (height, width) uint8 array, row 0 at the bottom, 128 on the outline.
+    # `glyphs` maps each character to (x, y, width, height, left, bottom, advance) in atlas pixels,
+    # left and bottom placing its cell relative to the pen on the baseline.
+    def __init__(self, size, spread, pixels, glyphs, ascender, descender, lineHeight):
+        self.size = size
+        self.spread = spread
+        self.pixels = pixels
+        self.glyphs = glyphs
+        self.ascender = ascender
+        self.descender = descender
+        self.lineHeight = lineHeight
+
+    def layout(self, string: str, size: float):
+        # Place `string` at `size` pixels to the em, with the top of the first line at y = 0 and
+        # lines going down. Returns the glyphs' atlas cells (n, 4), their screen quads as (n, 2)
+        # lower left corners and sizes, and the text's (width, height).
+        scale = size / self.size
+        cells, corners, sizes = [], [], []
+        penX = 0
+        baseline = -self.ascender * scale
+        width = 0
+        for char in string:
+            if char == '\n':
+                penX = 0
+                baseline -= self.lineHeight * scale
+                continue
+            glyph = self.glyphs.get(char) or self.glyphs.get('?')
+            if glyph is None: continue
+            x, y, cellWidth, cellHeight, left, bottom, advance = glyph
+            if cellWidth and cellHeight:
+                cells.append((x, y, cellWidth, cellHeight))
+                corners.append((penX + left * scale, baseline + bottom * scale))
+                sizes.append((cellWidth * scale, cellHeight * scale))
+            penX += advance * scale
+            width = max(width, penX)
+        height = -(baseline + self.descender * scale)
+        return (np.array(cells, np.float32).reshape(-1, 4), np.array(corners, np.float32).reshape(-1, 2),
+                np.array(sizes, np.float32).reshape(-1, 2), (width, height))
+
+def _buildAtlas(fontData: bytes, size: int, spread: int, chars: str, width=512):
+    font = _trueType(fontData)
+    scale = size / font.unitsPerEm
+    fields = {}
+    for char in dict.fromkeys(chars):
+        glyph = font.glyph(char)
+        advance = font.advance(glyph) * scale
+        contours = [contour * scale for contour in font.contours(glyph)]
+        if not contours:
+            fields[char] = (None, 0, 0, advance)
+            continue
+        points = np.concatenate(contours)
+        lo = np.floor(points.min(axis=0)) - spread
+        hi = np.ceil(points.max(axis=0)) + spread
+        segments = np.concatenate([np.stack([contour, np.roll(contour, -1, axis=0)], axis=1) for contour in contours])
+        distances = _signedDistances(segments, lo, (int(hi[1] - lo[1]), int(hi[0] - lo[0])))
+        fields[char] = (np.clip(0.5 + distances / (2 * spread), 0, 1), lo[0], lo[1], advance)
+
+    # Shelf packing, tallest first, with a pixel between cells so filtering never reaches a neighbour
+    order = sorted(fields, key=lambda char: -(0 if fields[char][0] is None else fields[char][0].shape[0]))
+    glyphs = {}
+    placed = []
+    x = y = shelfHeight = 0
+    for char in order:
+        field, left, bottom, advance = fields[char]
+        if field is None:
+            glyphs[char] = (0, 0, 0, 0, 0, 0, advance)
+            continue
+        cellHeight, cellWidth = field.shape
+        if x + cellWidth > width:
+            x, y, shelfHeight = 0, y + shelfHeight + 1, 0
+        placed.append((field, x, y))
+        glyphs[char] = (x, y, cellWidth, cellHeight, left, bottom, advance)
+        x += cellWidth + 1
+        shelfHeight = max(shelfHeight, cellHeight)
+    pixels = np.zeros((max(y + shelfHeight, 1), width), np.uint8)
+    for field, x, y in placed:
+        pixels[y:y + field.shape[0], x:x + field.shape[1]] = np.round(field * 255)
+    return atlas(size, spread, pixels, glyphs, font.ascender * scale, font.descender * scale, (font.ascender - font.descender + font.lineGap) * scale)
+
+
+### Cache ###
+cacheDirectory = util.cacheDirectory('RAYCEKAR_FONT_CACHE', 'fonts')
+
+_loaded = {}    # Cache key -> atlas, so each font and size is built or read once per process
+
+def setCacheDirectory(directory):
+    # None builds every atlas from the font file
+    global cacheDirectory
+    cacheDirectory = directory
+
+def _readAtlas(path):
+    with np.load(path) as stored:
+        metrics = stored['metrics']
+        glyphs = {chr(code): tuple(row.tolist()) for code, row in zip(stored['codes'].tolist(), metrics)}
+        size, spread, ascender, descender, lineHeight = stored['header'].tolist()
+        return atlas(int(size), int(spread), stored['pixels'], glyphs, ascender, descender, lineHeight)
+
+def _writeAtlas(path, fontAtlas: atlas):
+    chars = list(fontAtlas.glyphs)
+    header = np.array([fontAtlas.size, fontAtlas.spread, fontAtlas.ascender, fontAtlas.descender, fontAtlas.lineHeight], np.float64)
+    with util.atomicWrite(path) as atlasFile:
+        np.savez(
+            atlasFile, header=header, pixels=fontAtlas.pixels,
+            codes=np.array([ord(char) for char in chars], np.int32),
+            metrics=np.array([fontAtlas.glyphs[char] for char in chars], np.float64).reshape(-1, 7)
+        )
+
+def defaultFontPath():
+    # RAYCEKAR_FONT, or the first of a few common system fonts that exists
+    for path in [os.environ.get('RAYCEKAR_FONT')] + _fontPaths:
+        if path and os.path.isfile(path): return path
+    log.error('No default font found, set RAYCEKAR_FONT to a TrueType file')
+    sys.exit(1)
+
+def load(path=None, size=48, spread=None, chars=defaultChars):
+    # Atlas for the TrueType font at `path` (see defaultFontPath), from the cache if it was made before.
+    # Loading the same font and size again gives the same atlas.
+    path = defaultFontPath() if path is None else path
+    spread = max(2, size // 8) if spread is None else spread
+    fontData = pathlib.Path(path).read_bytes()
+    digest = hashlib.sha256(fontData)
+    digest.update(repr((_atlasVersion, size, spread, chars)).encode())
+    key = digest.hexdigest()
+    if key in _loaded: return _loaded[key]
+    cachePath = None if cacheDirectory is None else pathlib.Path(cacheDirectory).joinpath(key + '.npz')
+
+    fontAtlas = None
+    if not cachePath is None:
+        try:
+            fontAtlas = _readAtlas(cachePath)
+            log.debug('Loaded atlas for %s (%s px) from cache', path, size)
+        except (OSError, ValueError, KeyError):
+            pass    # Not cached, or unreadable
+
+    if fontAtlas is None:
+        log.info('Building atlas for %s (%s px, %s characters)', path, size, len(chars))
+        fontAtlas = _buildAtlas(fontData, size, spread, chars)
+        if not cachePath is None:
+            try: _writeAtlas(cachePath, fontAtlas)
+            except OSError as error: log.warning('Could not write font cache: %s', error)
+
+    _loaded[key] = fontAtlas
+    return fontAtlas
@@ -6,31 +6,120 @@
 # https://stackoverflow.com/a/58043489
 
 
-import logging, sys, pathlib, struct
+import collections, ctypes, functools, hashlib, json, logging, math, os, sys, pathlib, time
+import numpy as np
 from OpenGL import GL as gl
-from raycekar import util
+from raycekar import mesh, util
 from raycekar.coord import *
 
 
 log = logging.getLogger('rk.gl')
-log.addHandler(util.loggingHandler)
-log.setLevel(logging.DEBUG)
 
 _viewportSize = vec2(400, 400)
 _threadGroupSize = vec2(8, 4)
+_offscreen = False
 
+# Full-frame contact IDs, indexed by `x + width * y`. Filled in place by getContactsScene/UI.
 class _contacts:
-    scene = ()
-    ui = ()
+    scene = np.empty(0, np.int32)
+    ui = np.empty(0, np.int32)
 contacts = _contacts()
 
 
+### Program cache ###
+# Linked programs are saved with glGetProgramBinary and loaded back with glProgramBinary on the next
+# launch, skipping the compile. Entries are keyed on everything that can change the binary: the
+# driver's vendor/renderer/version strings, the replacement values and the final source. They are
+# written atomically and the least recently used are evicted past `maxBytes`. A binary the driver
+# rejects (a driver update it can't detect, a damaged file) is recompiled from source and replaced.
+class _programCache():
+    def __init__(self, directory, maxBytes):
+        self.directory = pathlib.Path(directory)
+        self.maxBytes = maxBytes
+
+    def key(self, source: str, replacements):
+        digest = hashlib.sha256()
+        for name in (gl.GL_VENDOR, gl.GL_RENDERER, gl.GL_VERSION):
+            digest.update(gl.glGetString(name) + b'\0')
+        digest.update(repr([(name, str(value)) for name, value in replacements]).encode() + b'\0')
+        digest.update(source.encode())
+        return digest.hexdigest()
+
+    def _path(self, key: str):
+        return self.directory.joinpath(key + '.bin')
+
+    def load(self, key: str):
+        # A linked program, or None if there is no usable entry
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)      # Recently used, for eviction
+        except OSError:
+            return None
+        if len(data) <= 4: return None
+
+        binary = np.frombuffer(data, np.uint8, offset=4)
+        program = gl.glCreateProgram()
+        try:
+            gl.glProgramBinary(program, int.from_bytes(data[:4], 'little'), binary.ctypes.data_as(ctypes.c_void_p), len(binary))
+            linked = gl.glGetProgramiv(program, gl.GL_LINK_STATUS)
+        except gl.GLError:
+            linked = False
+        if not linked:
+            log.info('Cached program %s was rejected, compiling from source', path.name)
+            gl.glDeleteProgram(program)
+            return None
+        return program
+
+    def store(self, key: str, program):
+        length = gl.glGetProgramiv(program, gl.GL_PROGRAM_BINARY_LENGTH)
+        if not length: return     # The driver offers no binary formats
+        binary = np.empty(length, np.uint8)
+        written = gl.GLsizei()
+        binaryFormat = gl.GLenum()
+        gl.glGetProgramBinary(program, length, ctypes.byref(written), ctypes.byref(binaryFormat), binary.ctypes.data_as(ctypes.c_void_p))
+
+        try:
+            with util.atomicWrite(self._path(key)) as binaryFile:
+                binaryFile.write(binaryFormat.value.to_bytes(4, 'little'))
+                binaryFile.write(binary[:written.value].tobytes())
+        except OSError as error:
+            log.warning('Could not write program cache: %s', error)
+            return
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for path in self.directory.glob('*.bin'):
+            try: entries.append((path.stat().st_mtime, path.stat().st_size, path))
+            except OSError: pass    # Removed by another process
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.maxBytes: break
+            try: path.unlink()
+            except OSError: pass
+            total -= size
+
+_programCacheMaxBytes = 32 * 1024 * 1024
+_programCacheDirectory = util.cacheDirectory('RAYCEKAR_PROGRAM_CACHE', 'programs')
+programCache = None if _programCacheDirectory is None else _programCache(_programCacheDirectory, _programCacheMaxBytes)
+programTimes = {}   # Program name -> (seconds, 'cache' or 'source') of its last load
+
+def setProgramCache(directory, maxBytes=_programCacheMaxBytes):
+    # Call before initialize; None turns caching off
+    global programCache
+    programCache = None if directory is None else _programCache(directory, maxBytes)
+
+
 ### Initialization ###
 def _glDebugMessageCallback(source, messageType, messageID, severity, length, message, user):
-    log.error('Source: {}; Message type: {}; Message ID: {}; Severity: {}; Length: {}; Message: {}; User: {};'.format(source, messageType, messageID, severity, length, message, user))
+    log.error('Source: %s; Message type: %s; Message ID: %s; Severity: %s; Length: %s; Message: %s; User: %s;', source, messageType, messageID, severity, length, message, user)
 
-def _createRenderProgram(shaderSource, replacements):
-    log.debug('Creating render program {}'.format(shaderSource))
+def _createRenderProgram(shaderSource, replacements, programName=None):
+    # `programName` labels the program in programTimes and the log, the file name by default
+    programName = programName or pathlib.Path(shaderSource).name
+    log.debug('Creating render program %s', shaderSource)
+    startTime = time.perf_counter()
     # Render shader source
     with open(shaderSource, 'r') as sourceFile:
         renderShaderSource = sourceFile.read()
@@ -38,31 +127,47 @@ def _createRenderProgram(shaderSource, replacements):
     # Replacements
     for name, value in replacements:
         renderShaderSource = renderShaderSource.replace('@{' + name + '}', str(value))
-        log.debug('Made replacement {} ({})'.format(name, value))
+        log.debug('Made replacement %s (%s)', name, value)
+
+    # Cached binary
+    if not programCache is None:
+        cacheKey = programCache.key(renderShaderSource, replacements)
+        renderProgram = programCache.load(cacheKey)
+        if not renderProgram is None:
+            _reportProgramTime(programName, startTime, 'cache')
+            return renderProgram
 
     # Render shader
     renderShader = gl.glCreateShader(gl.GL_COMPUTE_SHADER)
     gl.glShaderSource(renderShader, renderShaderSource)
     gl.glCompileShader(renderShader)
     if not gl.glGetShaderiv(renderShader, gl.GL_COMPILE_STATUS):
-        log.error('renderShader problem\n{}'.format(gl.glGetShaderInfoLog(renderShader).replace(b'\\n', b'\n').decode()))
+        log.error('renderShader problem\n%s', gl.glGetShaderInfoLog(renderShader).replace(b'\\n', b'\n').decode())
         sys.exit(1)
 
     # Render program
     renderProgram = gl.glCreateProgram()
+    if not programCache is None: gl.glProgramParameteri(renderProgram, gl.GL_PROGRAM_BINARY_RETRIEVABLE_HINT, gl.GL_TRUE)
     gl.glAttachShader(renderProgram, renderShader)
     gl.glLinkProgram(renderProgram)
     if not gl.glGetProgramiv(renderProgram, gl.GL_LINK_STATUS):
-        log.error('renderProgram problem\n{}'.format(gl.glGetProgramInfoLog(renderProgram).replace(b'\\n', b'\n').decode()))
+        log.error('renderProgram problem\n%s', gl.glGetProgramInfoLog(renderProgram).replace(b'\\n', b'\n').decode())
         sys.exit(1)
 
     # Shader cleanup
     # glDeleteShader(renderShader)
-    
+
+    if not programCache is None: programCache.store(cacheKey, renderProgram)
+    _reportProgramTime(programName, startTime, 'source')
     return renderProgram
 
+def _reportProgramTime(name, startTime, origin):
+    seconds = time.perf_counter() - startTime
+    programTimes[name] = (seconds, origin)
+    log.info('Loaded %s from %s in %.1f ms', name, origin, seconds * 1000)
+
 def _createStorageBuffer(bindPoint):
-    log.debug('Creating storage buffer {}'.format(bindPoint))
+    log.debug('Creating storage buffer %s', bindPoint)
     storageBuffer = gl.glGenBuffers(1)
     gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, storageBuffer)
     gl.glBindBufferBase(gl.GL_SHADER_STORAGE_BUFFER, bindPoint, storageBuffer)
@@ -70,16 +175,17 @@ def _createStorageBuffer(bindPoint):
 
 def initialize(viewportSize: vec2, threadGroupSize: vec2):
     global sceneRenderProgram, uiRenderProgram
-    global framebuffer
-    global shapeTypeStorageBuffer, shapeIntStorageBuffer, shapeFloatStorageBuffer
+    global framebuffer, screenTexture
+    global shapeHeaderStorageBuffer, shapeIntStorageBuffer, shapeFloatStorageBuffer, bvhStorageBuffer
     global lightTypeStorageBuffer, lightFloatStorageBuffer
     global sceneContactStorageBuffer, uiContactStorageBuffer
-    global _viewportSize, _threadGroupSize
+    global widgetStorageBuffer, uiTileStorageBuffer, uiTileWidgetStorageBuffer, uiLayerTexture
+    global _viewportSize, _threadGroupSize, _offscreen, _sceneProgram
     _viewportSize = viewportSize
     _threadGroupSize = threadGroupSize
 
     log.info('Initializing OpenGL')
-    log.info('Using OpenGL {}'.format(gl.glGetString(gl.GL_VERSION).decode()))
+    log.info('Using OpenGL %s', gl.glGetString(gl.GL_VERSION).decode())
     gl.glDebugMessageCallback(gl.GLDEBUGPROC(_glDebugMessageCallback), None)
 
     gl.glViewport(0, 0, *_viewportSize)
@@ -89,8 +195,9 @@ def initialize(viewportSize: vec2, threadGroupSize: vec2):
         replacements=[
             ('THREAD_GROUP_SIZE_X', _threadGroupSize.x),
             ('THREAD_GROUP_SIZE_Y', _threadGroupSize.y)
-        ]
+        ] + _sceneReplacements()
     )
+    _sceneProgram = sceneRenderProgram
     uiRenderProgram = _createRenderProgram(
         pathlib.Path(__file__).parent.joinpath('renderUI.glsl'),
         replacements=[
@@ -100,7 +207,7 @@ def initialize(viewportSize: vec2, threadGroupSize: vec2):
     )
 
     # Texture to render to
-    screenTex = gl.glGenTextures(1)
+    screenTexture = screenTex = gl.glGenTextures(1)
     gl.glActiveTexture(gl.GL_TEXTURE0)
     gl.glBindTexture(gl.GL_TEXTURE_2D, screenTex)
     gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR)    # Set min filter to linear instead of mipmap
@@ -116,82 +223,1027 @@ def initialize(viewportSize: vec2, threadGroupSize: vec2):
     gl.glBindFramebuffer(gl.GL_READ_FRAMEBUFFER, framebuffer)
     gl.glBindFramebuffer(gl.GL_DRAW_FRAMEBUFFER, 0)
 
+    # Headless contexts have no default framebuffer to clear or blit to
+    _offscreen = gl.glCheckFramebufferStatus(gl.GL_DRAW_FRAMEBUFFER) == gl.GL_FRAMEBUFFER_UNDEFINED
+    if _offscreen: log.info('No default framebuffer, rendering offscreen')
+
     # Shader storage buffers for scene shapes
-    shapeTypeStorageBuffer = _createStorageBuffer(1)
+    shapeHeaderStorageBuffer = _createStorageBuffer(1)
     shapeIntStorageBuffer = _createStorageBuffer(2)
     shapeFloatStorageBuffer = _createStorageBuffer(3)
+    bvhStorageBuffer = _createStorageBuffer(7)
     
     lightTypeStorageBuffer = _createStorageBuffer(4)
     lightFloatStorageBuffer = _createStorageBuffer(5)
 
     # Shader storage buffers to hold contact ID output
-    sceneContactStorageBuffer = _createStorageBuffer(4)
+    sceneContactStorageBuffer = _createStorageBuffer(6)
     gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, sceneContactStorageBuffer)
     dataSize = _viewportSize[0] * _viewportSize[1] * 4
     gl.glBufferData(gl.GL_SHADER_STORAGE_BUFFER, dataSize, b'\x00' * dataSize, gl.GL_DYNAMIC_READ)
+    contacts.scene = np.zeros(_viewportSize[0] * _viewportSize[1], np.int32)
     
-    uiContactStorageBuffer = _createStorageBuffer(5)
+    uiContactStorageBuffer = _createStorageBuffer(8)
     gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, uiContactStorageBuffer)
     dataSize = _viewportSize[0] * _viewportSize[1] * 4
-    gl.glBufferData(gl.GL_SHADER_STORAGE_BUFFER, dataSize, b'\x00' * dataSize, gl.GL_DYNAMIC_READ)
+    gl.glBufferData(gl.GL_SHADER_STORAGE_BUFFER, dataSize, b'\xff' * dataSize, gl.GL_DYNAMIC_READ)     # -1, no widget
+    contacts.ui = np.full(_viewportSize[0] * _viewportSize[1], -1, np.int32)
+
+    # Shader storage buffers and cached layer for the UI, see compileUI
+    widgetStorageBuffer = _createStorageBuffer(12)
+    uiTileStorageBuffer = _createStorageBuffer(13)
+    uiTileWidgetStorageBuffer = _createStorageBuffer(14)
+    uiLayerTexture = _createTexture(_viewportSize)
+    gl.glClearTexImage(uiLayerTexture, 0, gl.GL_RGBA, gl.GL_FLOAT, None)
+    gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+
+
+### Profiling ###
+# setProfiling(True) times each stage wrapped in _profiled on the CPU with perf_counter and on the GPU
+# with a GL_TIMESTAMP query either side of it. Query results are collected only once the GPU has them,
+# usually a frame or two later, so profiling never waits on the GPU. Call profileFrame() once a frame.
+class _profiler():
+    def __init__(self, history: int, trace: bool):
+        self.history = history
+        self.cpuTimes = {}      # stage -> deque of seconds
+        self.gpuTimes = {}
+        self.freeQueries = []
+        self.pending = collections.deque()  # (stage, beginQuery, endQuery) in submission order
+        self.trace = [] if trace else None
+        self.frameStart = None
+
+        # GPU timestamps count nanoseconds from wherever the driver likes, so note where now is on both clocks
+        now = ctypes.c_int64()
+        gl.glGetInteger64v(gl.GL_TIMESTAMP, ctypes.byref(now))
+        self.gpuOrigin = now.value
+        self.cpuOrigin = time.perf_counter()
+
+    def _timestamp(self):
+        if not self.freeQueries: self.freeQueries.extend(int(query) for query in gl.glGenQueries(32))
+        query = self.freeQueries.pop()
+        gl.glQueryCounter(query, gl.GL_TIMESTAMP)
+        return query
+
+    def _record(self, times, stage: str, seconds: float):
+        if not stage in times: times[stage] = collections.deque(maxlen=self.history)
+        times[stage].append(seconds)
+
+    def _traceEvent(self, stage: str, thread: int, start: float, duration: float):
+        if self.trace is None: return
+        self.trace.append({
+            'name': stage, 'ph': 'X', 'pid': 0, 'tid': thread,
+            'ts': (start - self.cpuOrigin) * 1e6, 'dur': duration * 1e6
+        })
+
+    def begin(self, stage: str):
+        return stage, self._timestamp(), time.perf_counter()
+
+    def end(self, token):
+        stage, beginQuery, cpuStart = token
+        cpuTime = time.perf_counter() - cpuStart
+        self.pending.append((stage, beginQuery, self._timestamp()))
+        self._record(self.cpuTimes, stage, cpuTime)
+        self._traceEvent(stage, 0, cpuStart, cpuTime)
+
+    def collect(self):
+        # Take whichever results are ready without waiting; they become available in order
+        value = ctypes.c_int64()
+        while self.pending:
+            stage, beginQuery, endQuery = self.pending[0]
+            if not gl.glGetQueryObjectiv(endQuery, gl.GL_QUERY_RESULT_AVAILABLE): break
+            self.pending.popleft()
+            gl.glGetQueryObjecti64v(beginQuery, gl.GL_QUERY_RESULT, ctypes.byref(value))
+            gpuStart = value.value
+            gl.glGetQueryObjecti64v(endQuery, gl.GL_QUERY_RESULT, ctypes.byref(value))
+            gpuTime = (value.value - gpuStart) / 1e9
+            self.freeQueries += [beginQuery, endQuery]
+            self._record(self.gpuTimes, stage, gpuTime)
+            self._traceEvent(stage, 1, self.cpuOrigin + (gpuStart - self.gpuOrigin) / 1e9, gpuTime)
+
+    def frame(self):
+        now = time.perf_counter()
+        if not self.frameStart is None:
+            self._record(self.cpuTimes, 'frame', now - self.frameStart)
+            self._traceEvent('frame', 2, self.frameStart, now - self.frameStart)
+        self.frameStart = now
+        self.collect()
+
+    def delete(self):
+        queries = self.freeQueries + [query for stage, beginQuery, endQuery in self.pending for query in (beginQuery, endQuery)]
+        if queries: gl.glDeleteQueries(len(queries), queries)
+
+_profile = None
+
+def _profiled(stage: str):
+    # Time the wrapped function as `stage` while profiling is on
+    def decorate(function):
+        @functools.wraps(function)
+        def profiledFunction(*args, **kwargs):
+            if _profile is None: return function(*args, **kwargs)
+            token = _profile.begin(stage)
+            try: return function(*args, **kwargs)
+            finally: _profile.end(token)
+        return profiledFunction
+    return decorate
+
+def setProfiling(enabled: bool, history=300, trace=False):
+    global _profile
+    # Keep the last `history` timings of each stage; with `trace`, also keep every event for dumpTrace
+    if not _profile is None:
+        _profile.delete()
+        _profile = None
+    if enabled:
+        log.info('Profiling the last %s frames%s', history, ' with tracing' if trace else '')
+        _profile = _profiler(history, trace)
+
+def profileFrame():
+    # Mark the end of a frame and pick up any GPU timings that have come in
+    if not _profile is None: _profile.frame()
+
+def profileStats():
+    # {stage: {'cpu': (p50, p95, p99), 'gpu': (p50, p95, p99)}} in seconds. 'frame' is the wall time
+    # between profileFrame calls and has no GPU side.
+    stats = {}
+    if _profile is None: return stats
+    for side, times in (('cpu', _profile.cpuTimes), ('gpu', _profile.gpuTimes)):
+        for stage, samples in times.items():
+            stats.setdefault(stage, {})[side] = tuple(np.percentile(samples, (50, 95, 99)).tolist())
+    return stats
+
+def profileReport():
+    # profileStats as a table in milliseconds, and whether frames are waiting on the CPU or the GPU
+    stats = profileStats()
+    lines = ['{:<18} {:>26} {:>26}'.format('Stage', 'CPU p50/p95/p99 ms', 'GPU p50/p95/p99 ms')]
+    for stage, sides in stats.items():
+        lines.append('{:<18} {:>26} {:>26}'.format(stage, *[
+            '/'.join('{:.3f}'.format(seconds * 1000) for seconds in sides[side]) if side in sides else '-'
+            for side in ('cpu', 'gpu')
+        ]))
+
+    if 'frame' in stats:
+        frameTime = stats['frame']['cpu'][0]
+        gpuTime = sum(sides['gpu'][0] for sides in stats.values() if 'gpu' in sides)
+        lines.append('GPU busy {:.0%} of a {:.3f} ms frame (p50), {}'.format(
+            gpuTime / frameTime, frameTime * 1000, 'GPU-bound' if gpuTime > 0.8 * frameTime else 'CPU-bound'
+        ))
+    return '\n'.join(lines)
+
+def dumpTrace(path):
+    # Write the events recorded since setProfiling(True, trace=True) as Chrome trace-event JSON,
+    # for chrome://tracing or Perfetto
+    if _profile is None or _profile.trace is None:
+        log.error('dumpTrace needs setProfiling(True, trace=True)')
+        return
+    _profile.collect()
+    threadNames = [{'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': thread, 'args': {'name': name}} for thread, name in enumerate(('CPU', 'GPU', 'Frames'))]
+    with open(path, 'w') as traceFile:
+        json.dump({'traceEvents': threadNames + _profile.trace, 'displayTimeUnit': 'ms'}, traceFile)
+    log.info('Wrote %s trace events to %s', len(_profile.trace), path)
 
 
 ### Scene compilation ###
+_bufferSources = {}     # storageBuffer -> arena array last uploaded into it
+_maxUploadRuns = 32     # More dirty runs than this are sent as one span to save on calls
+_shapeCount = 0
+_bvhNodeCount = 0
+_lightCount = 0
+_sceneProgram = None    # sceneRenderProgram or one specialized to the scene
+_camera = None          # Camera record of the last compiled scene
+
+def _uploadBuffer(storageBuffer, arena):
+    # Upload only the changed ranges of `arena`, reallocating when it has grown
+    dirtyStarts, dirtyStops = arena.takeDirtyRanges()
+    if len(arena) == 0: return
+
+    gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, storageBuffer)
+    if not _bufferSources.get(storageBuffer) is arena.data:
+        # The arena grew (or another scene was uploaded last), so hand over its whole capacity
+        log.debug('Reallocating storage buffer %s (%s bytes)', storageBuffer, arena.data.nbytes)
+        gl.glBufferData(gl.GL_SHADER_STORAGE_BUFFER, arena.data.nbytes, arena.data, gl.GL_DYNAMIC_DRAW)
+        _bufferSources[storageBuffer] = arena.data
+        return
+
+    if len(dirtyStarts) > _maxUploadRuns:
+        dirtyStarts, dirtyStops = dirtyStarts[:1], dirtyStops[-1:]
+    itemSize = arena.data.itemsize
+    for start, stop in zip(dirtyStarts.tolist(), dirtyStops.tolist()):
+        gl.glBufferSubData(gl.GL_SHADER_STORAGE_BUFFER, start * itemSize, (stop - start) * itemSize, arena.data[start:stop])
+
+
+### Streaming ###
+# Opt-in alternative to `_uploadBuffer`. Each shape buffer becomes a persistently mapped ring of
+# `frames` slices; the CPU writes the slice for frame N+1 while the GPU may still be reading frame
+# N, and a fence per slice keeps it from overwriting a slice that is still in use.
+_streamMapFlags = gl.GL_MAP_WRITE_BIT | gl.GL_MAP_PERSISTENT_BIT | gl.GL_MAP_COHERENT_BIT
+
+class _streamBuffer():
+    def __init__(self, bindPoint: int, frames: int):
+        self.bindPoint = bindPoint
+        self.frames = frames
+        self.buffer = None
+        self.source = None  # Arena array the ring was allocated for
+        self.pending = []   # Per slice, the dirty runs it hasn't received yet
+
+    def _allocate(self, arena):
+        if not self.buffer is None: gl.glDeleteBuffers(1, [self.buffer])
+        alignment = int(gl.glGetIntegerv(gl.GL_SHADER_STORAGE_BUFFER_OFFSET_ALIGNMENT))
+        self.sliceSize = -(-arena.data.nbytes // alignment) * alignment
+        size = self.sliceSize * self.frames
+        log.debug('Allocating stream buffer %s (%s x %s bytes)', self.bindPoint, self.frames, self.sliceSize)
+
+        self.buffer = gl.glGenBuffers(1)
+        gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, self.buffer)
+        gl.glBufferStorage(gl.GL_SHADER_STORAGE_BUFFER, size, None, _streamMapFlags)
+        address = gl.glMapBufferRange(gl.GL_SHADER_STORAGE_BUFFER, 0, size, _streamMapFlags)
+        mapped = np.ctypeslib.as_array((ctypes.c_ubyte * size).from_address(address))
+        self.slices = [
+            mapped[i * self.sliceSize:i * self.sliceSize + arena.data.nbytes].view(arena.data.dtype)
+            for i in range(self.frames)
+        ]
+        for mappedSlice in self.slices: mappedSlice[:] = arena.data
+        self.source = arena.data
+        self.pending = [[] for i in range(self.frames)]
+
+    def upload(self, arena, frame: int):
+        dirtyRuns = arena.takeDirtyRanges()
+        if not self.source is arena.data: self._allocate(arena)
+        else:
+            for pending in self.pending: pending.append(dirtyRuns)
+
+            # Catch this slice up on everything written since it was last used
+            mappedSlice = self.slices[frame]
+            for dirtyStarts, dirtyStops in self.pending[frame]:
+                if len(dirtyStarts) > _maxUploadRuns:
+                    dirtyStarts, dirtyStops = dirtyStarts[:1], dirtyStops[-1:]
+                for start, stop in zip(dirtyStarts.tolist(), dirtyStops.tolist()):
+                    mappedSlice[start:stop] = arena.data[start:stop]
+            self.pending[frame] = []
+
+        gl.glBindBufferRange(gl.GL_SHADER_STORAGE_BUFFER, self.bindPoint, self.buffer, frame * self.sliceSize, self.sliceSize)
+
+    def delete(self):
+        if not self.buffer is None: gl.glDeleteBuffers(1, [self.buffer])
+        self.buffer = None
+        self.slices = []
+
+class _streamRing():
+    def __init__(self, frames: int):
+        self.frames = frames
+        self.frame = 0
+        self.fences = [None] * frames
+        self.buffers = [_streamBuffer(bindPoint, frames) for bindPoint in (1, 2, 3)]
+
+    def upload(self, scene):
+        # Wait until the GPU is done with the slice written `frames` frames ago
+        fence = self.fences[self.frame]
+        if not fence is None:
+            while gl.glClientWaitSync(fence, gl.GL_SYNC_FLUSH_COMMANDS_BIT, 1000000000) == gl.GL_TIMEOUT_EXPIRED: pass
+            gl.glDeleteSync(fence)
+            self.fences[self.frame] = None
+
+        for streamBuffer, arena in zip(self.buffers, (scene.shapeHeaderData, scene.shapeIntData, scene.shapeFloatData)):
+            if len(arena) == 0: arena.takeDirtyRanges()
+            else: streamBuffer.upload(arena, self.frame)
+
+    def fence(self):
+        # Called once the frame's reads of the ring have been submitted
+        if not self.fences[self.frame] is None: gl.glDeleteSync(self.fences[self.frame])
+        self.fences[self.frame] = gl.glFenceSync(gl.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        self.frame = (self.frame + 1) % self.frames
+
+    def delete(self):
+        for fence in self.fences:
+            if not fence is None: gl.glDeleteSync(fence)
+        for streamBuffer in self.buffers: streamBuffer.delete()
+
+_stream = None
+
+def setStreaming(enabled: bool, frames=3):
+    global _stream
+    # Switch shape uploads between the persistently mapped ring and plain glBufferSubData
+    if not _stream is None:
+        _stream.delete()
+        _stream = None
+    _bufferSources.clear()  # Whichever path runs next starts from a full upload
+
+    if enabled:
+        log.info('Streaming shape data through %s mapped frames', frames)
+        _stream = _streamRing(frames)
+    else:
+        for bindPoint, storageBuffer in zip((1, 2, 3), (shapeHeaderStorageBuffer, shapeIntStorageBuffer, shapeFloatStorageBuffer)):
+            gl.glBindBufferBase(gl.GL_SHADER_STORAGE_BUFFER, bindPoint, storageBuffer)
+
+
+### Specialization ###
+# Opt-in. Once a scene's structure (its shape types and where their records start) has held for
+# `stableFrames` compiles, renderScene.glsl is rebuilt for it: only the SDFs of the types present,
+# the shape count baked into the loops, and up to `unrollLimit` shapes unrolled into straight-line
+# calls at fixed record offsets instead of the per-shape type switch. Transforms are still read
+# from the storage buffers, so moving shapes doesn't recompile; adding shapes falls back to the
+# generic program until the new structure settles. The most recent `maxPrograms` are kept. Scenes
+# with instance groups keep every shape type, for their prototypes, and aren't unrolled.
+def _sceneReplacements(headers=None, unroll=False):
+    # SPECIALIZATION and SCENE_SHAPES for renderScene.glsl, generic without `headers`
+    from raycekar import env    # env imports gl
+    if headers is None or _hasInstances(headers): shapeTypes = env.objectTypes
+    else: shapeTypes = [env.objectTypes[typeID] for typeID in np.unique(headers['type']).tolist()]
+    defines = ['#define HAS_{}'.format(shapeType._glslName.upper()) for shapeType in shapeTypes if hasattr(shapeType, '_glslName')]
+    steps = []
+    if not headers is None:
+        defines.append('#define SCENE_SHAPE_COUNT {}'.format(len(headers) + 1))
+        if unroll:
+            defines.append('#define SCENE_UNROLLED')
+            for id, (typeID, floatPtr) in enumerate(zip(headers['type'].tolist(), headers['floatPtr'].tolist()), 1):
+                steps.append('    SHAPE_STEP({}, sdf{}Record(rayPos, {}))'.format(id, env.objectTypes[typeID]._glslName, floatPtr))
+    return [('SPECIALIZATION', '\n'.join(defines)), ('SCENE_SHAPES', '\n'.join(steps))]
+
+def _hasInstances(headers):
+    from raycekar import env
+    return bool(np.any(headers['type'] == env.objectTypes.index(env.instances)))
+
+class _specializer():
+    def __init__(self, stableFrames: int, unrollLimit: int, maxPrograms: int):
+        self.stableFrames = stableFrames
+        self.unrollLimit = unrollLimit
+        self.maxPrograms = maxPrograms
+        self.programs = collections.OrderedDict()   # structure -> program
+        self.scene = None
+        self.shapeCount = None
+        self.headers = None
+        self.structure = None
+        self.stable = 0
+
+    def program(self, scene):
+        # The program for `scene`, or None while its structure is new
+        if not scene is self.scene or scene.shapeCount != self.shapeCount:
+            # Shapes are only ever appended, so structure can only change with the shape count
+            self.scene = scene
+            self.shapeCount = scene.shapeCount
+            self.headers = scene.shapeHeaderData.view()[1:].copy()
+            self.structure = (self.headers['type'].tobytes(), self.headers['floatPtr'].tobytes())
+            self.stable = 0
+        self.stable += 1
+        if self.stable < self.stableFrames: return None
+
+        program = self.programs.get(self.structure)
+        if program is None:
+            unroll = len(self.headers) <= self.unrollLimit and not _hasInstances(self.headers)
+            program = _createRenderProgram(
+                pathlib.Path(__file__).parent.joinpath('renderScene.glsl'),
+                replacements=[
+                    ('THREAD_GROUP_SIZE_X', _threadGroupSize.x),
+                    ('THREAD_GROUP_SIZE_Y', _threadGroupSize.y)
+                ] + _sceneReplacements(self.headers, unroll),
+                programName='renderScene.glsl ({} shapes{})'.format(len(self.headers), ', unrolled' if unroll else '')
+            )
+            self.programs[self.structure] = program
+            while len(self.programs) > self.maxPrograms:
+                gl.glDeleteProgram(self.programs.popitem(last=False)[1])
+        self.programs.move_to_end(self.structure)
+        return program
+
+    def delete(self):
+        for program in self.programs.values(): gl.glDeleteProgram(program)
+        self.programs.clear()
+
+_specialize = None
+
+def setSpecialization(enabled: bool, stableFrames=30, unrollLimit=64, maxPrograms=8):
+    global _specialize, _sceneProgram
+    if not _specialize is None:
+        _specialize.delete()
+        _specialize = None
+    _sceneProgram = sceneRenderProgram
+
+    if enabled:
+        log.info('Specializing the scene program after %s stable frames', stableFrames)
+        _specialize = _specializer(stableFrames, unrollLimit, maxPrograms)
+
+
+@_profiled('compileScene')
 def compileScene(scene):
-    # Compile scene/ui data
-    shapeData, lightData = scene.compileBufferData()
-    shapeTypeData, shapeIntData, shapeFloatData = shapeData
-    lightTypeData, lightFloatData = lightData
-
-    if shapeTypeData != b'':
-        gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, shapeTypeStorageBuffer)
-        gl.glBufferData(gl.GL_SHADER_STORAGE_BUFFER, len(shapeTypeData), shapeTypeData, gl.GL_DYNAMIC_DRAW)
-    if shapeIntData != b'':
-        gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, shapeIntStorageBuffer)
-        gl.glBufferData(gl.GL_SHADER_STORAGE_BUFFER, len(shapeIntData), shapeIntData, gl.GL_DYNAMIC_DRAW)
-    if shapeFloatData != b'':
-        gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, shapeFloatStorageBuffer)
-        gl.glBufferData(gl.GL_SHADER_STORAGE_BUFFER, len(shapeFloatData), shapeFloatData, gl.GL_DYNAMIC_DRAW)
-
-    if lightTypeData != b'':
-        gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, lightTypeStorageBuffer)
-        gl.glBufferData(gl.GL_SHADER_STORAGE_BUFFER, len(lightTypeData), lightTypeData, gl.GL_DYNAMIC_DRAW)
-    if lightFloatData != b'':
-        gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, lightFloatStorageBuffer)
-        gl.glBufferData(gl.GL_SHADER_STORAGE_BUFFER, len(lightFloatData), lightFloatData, gl.GL_DYNAMIC_DRAW)
+    global _shapeCount, _bvhNodeCount, _lightCount, _sceneProgram, _camera
+    # Upload scene data, only sending what changed since the last call
+    scene.update()
+    if _stream is None:
+        _uploadBuffer(shapeHeaderStorageBuffer, scene.shapeHeaderData)
+        _uploadBuffer(shapeIntStorageBuffer, scene.shapeIntData)
+        _uploadBuffer(shapeFloatStorageBuffer, scene.shapeFloatData)
+    else:
+        _stream.upload(scene)
+    _shapeCount = scene.shapeCount
+    _camera = scene.shapeFloatData.data[:8].copy() if scene.cameras else None
+    if not _specialize is None: _sceneProgram = _specialize.program(scene) or sceneRenderProgram
+
+    if scene.bvhActive: _uploadBuffer(bvhStorageBuffer, scene.bvh.nodes)
+    _bvhNodeCount = len(scene.bvh) if scene.bvhActive else 0
+
+    if len(mesh.grids) > _meshGridCount: _uploadMeshGrids()
+    _uploadBuffer(lightTypeStorageBuffer, scene.lightTypeData)
+    _uploadBuffer(lightFloatStorageBuffer, scene.lightFloatData)
+    _lightCount = len(scene.lights)
+
+    gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, 0)
+
 
+### Mesh grids ###
+# Every grid raycekar.mesh has registered goes into one R16F 3D texture, at its atlasOrigin, which
+# the scene program samples on texture unit 2. A grid is uploaded once, when the first scene after
+# it was registered is compiled; the texture is only reallocated, with every grid uploaded again,
+# when the atlas outgrows it. mesh.register keeps the atlas within mesh.atlasLimit, which only an
+# application that raises it past what the driver allows can break.
+_meshAtlasTexture = None
+_meshAtlasSize = (0, 0, 0)
+_meshGridCount = 0      # Grids uploaded so far
+
+def _uploadMeshGrids():
+    global _meshAtlasTexture, _meshAtlasSize, _meshGridCount
+    if _meshAtlasTexture is None:
+        _meshAtlasTexture = gl.glGenTextures(1)
+        gl.glBindTexture(gl.GL_TEXTURE_3D, _meshAtlasTexture)
+        gl.glTexParameteri(gl.GL_TEXTURE_3D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR)
+        gl.glTexParameteri(gl.GL_TEXTURE_3D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
+        for wrap in (gl.GL_TEXTURE_WRAP_S, gl.GL_TEXTURE_WRAP_T, gl.GL_TEXTURE_WRAP_R):
+            gl.glTexParameteri(gl.GL_TEXTURE_3D, wrap, gl.GL_CLAMP_TO_EDGE)
+    gl.glBindTexture(gl.GL_TEXTURE_3D, _meshAtlasTexture)
+
+    if tuple(mesh.atlasSize) != _meshAtlasSize:
+        sizeLimit = int(gl.glGetIntegerv(gl.GL_MAX_3D_TEXTURE_SIZE))
+        if max(mesh.atlasSize) > sizeLimit:
+            log.error('Mesh atlas (%sx%sx%s) is larger than GL_MAX_3D_TEXTURE_SIZE (%s), meshes will not be drawn', *mesh.atlasSize, sizeLimit)
+            _meshGridCount = len(mesh.grids)    # Once, not on every compile
+            return
+        _meshAtlasSize = tuple(mesh.atlasSize)
+        log.debug('Reallocating mesh atlas (%sx%sx%s)', *_meshAtlasSize)
+        gl.glTexImage3D(gl.GL_TEXTURE_3D, 0, gl.GL_R16F, *_meshAtlasSize, 0, gl.GL_RED, gl.GL_HALF_FLOAT, None)
+        _meshGridCount = 0
+
+    gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)     # Rows are an odd number of halves
+    for meshGrid in mesh.grids[_meshGridCount:]:
+        values = np.ascontiguousarray(meshGrid.values, np.float16)
+        gl.glTexSubImage3D(
+            gl.GL_TEXTURE_3D, 0, *(int(origin) for origin in meshGrid.atlasOrigin), *values.shape[::-1],
+            gl.GL_RED, gl.GL_HALF_FLOAT, values.ctypes.data_as(ctypes.c_void_p)
+        )
+    gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 4)
+    log.debug('Uploaded %s mesh grids', len(mesh.grids) - _meshGridCount)
+    _meshGridCount = len(mesh.grids)
+
+    gl.glActiveTexture(gl.GL_TEXTURE2)
+    gl.glBindTexture(gl.GL_TEXTURE_3D, _meshAtlasTexture)
+    gl.glActiveTexture(gl.GL_TEXTURE0)
+
+
+### UI ###
+# Widget records are uploaded like shape data, only the changed ranges. The tile lists (see
+# ui.layer) go into uiTileStorageBuffer, with the tiles to redraw this frame after them; when only
+# colors changed, just those are written. A different layer than last time clears the cached
+# layer texture and UI contacts and redraws all of its tiles. A layer's font atlas is uploaded
+# the first time it is drawn and kept for any later layer using it.
+_uiLayer = None
+_glyphAtlasTextures = {}    # font.atlas -> texture
+_glyphAtlasTexture = 0      # The current layer's
+_uiTiles = np.empty((0, 4), np.int32)   # Tiles with widgets, at the start of uiTileStorageBuffer
+_uiTileCount = 0
+_uiDirtyTileCount = 0   # Tiles to redraw, right after them
+_uiTileCapacity = 0     # Tiles uiTileStorageBuffer has room for
+
+def _uploadGlyphAtlas(fontAtlas):
+    texture = gl.glGenTextures(1)
+    gl.glBindTexture(gl.GL_TEXTURE_2D, texture)
+    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR)
+    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
+    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_EDGE)
+    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
+    height, width = fontAtlas.pixels.shape
+    gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)     # Rows are bytes
+    gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_R8, width, height, 0, gl.GL_RED, gl.GL_UNSIGNED_BYTE, np.ascontiguousarray(fontAtlas.pixels))
+    gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 4)
+    gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+    log.debug('Uploaded %sx%s glyph atlas', width, height)
+    return texture
+
+def compileUI(layer):
+    global _uiLayer, _uiTiles, _uiTileCount, _uiDirtyTileCount, _uiTileCapacity, _glyphAtlasTexture
+    # Upload the layer's widgets and queue the tiles they changed for paintUI
+    redraw = not layer is _uiLayer
+    if redraw:
+        gl.glClearTexImage(uiLayerTexture, 0, gl.GL_RGBA, gl.GL_FLOAT, None)
+        gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, uiContactStorageBuffer)
+        gl.glClearBufferData(gl.GL_SHADER_STORAGE_BUFFER, gl.GL_R32I, gl.GL_RED_INTEGER, gl.GL_INT, np.array([-1], np.int32))
+        _uiLayer = layer
+
+    if not layer.font is None and not layer.font in _glyphAtlasTextures:
+        _glyphAtlasTextures[layer.font] = _uploadGlyphAtlas(layer.font)
+    _glyphAtlasTexture = _glyphAtlasTextures.get(layer.font, 0)
+
+    tiles, tileWidgets, dirtyTiles = layer.compileTiles(_threadGroupSize, _viewportSize, redraw)
+    _uploadBuffer(widgetStorageBuffer, layer.widgetData)
+
+    if not tiles is None:
+        _uiTiles, _uiTileCount = tiles, len(tiles)
+        gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, uiTileWidgetStorageBuffer)
+        gl.glBufferData(gl.GL_SHADER_STORAGE_BUFFER, max(tileWidgets.nbytes, 4), tileWidgets if len(tileWidgets) else None, gl.GL_DYNAMIC_DRAW)
+    gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, uiTileStorageBuffer)
+    grown = _uiTileCount + len(dirtyTiles) > _uiTileCapacity
+    if grown:
+        _uiTileCapacity = 2 * (_uiTileCount + len(dirtyTiles))
+        gl.glBufferData(gl.GL_SHADER_STORAGE_BUFFER, _uiTileCapacity * 16, None, gl.GL_DYNAMIC_DRAW)
+    if (grown or not tiles is None) and _uiTileCount:
+        gl.glBufferSubData(gl.GL_SHADER_STORAGE_BUFFER, 0, _uiTiles.nbytes, _uiTiles)
+    if len(dirtyTiles): gl.glBufferSubData(gl.GL_SHADER_STORAGE_BUFFER, _uiTileCount * 16, dirtyTiles.nbytes, dirtyTiles)
+    _uiDirtyTileCount = len(dirtyTiles)
     gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, 0)
 
 
+### Adaptive resolution ###
+# Opt-in. The scene is rendered at `scale` times the viewport into the corner of a separate texture,
+# then upscaleScene.glsl fills the screen from it, blending in the last output reprojected through
+# the last camera (temporal upscaling) and writing full size contact IDs, so picking works as usual.
+# The scale follows the frame time, measured between paintScene calls, towards `targetFps`: pixel
+# count is what the march costs, so it moves by the square root of the time ratio, a few percent a
+# frame, in steps of `scaleStep` so the resolution doesn't change every frame.
+def _halton(index, base):
+    result, fraction = 0, 1
+    while index:
+        fraction /= base
+        result += fraction * (index % base)
+        index //= base
+    return result
+
+def _createTexture(size: vec2):
+    texture = gl.glGenTextures(1)
+    gl.glBindTexture(gl.GL_TEXTURE_2D, texture)
+    gl.glTexStorage2D(gl.GL_TEXTURE_2D, 1, gl.GL_RGBA32F, *size)
+    return texture
+
+class _adaptiveResolution():
+    jitterLength = 8        # Frames in the jitter sequence
+    frameWeight = 0.15      # Share of each new frame in the output where history is usable
+
+    def __init__(self, targetFps: float, minScale: float, maxScale: float, scaleStep: float):
+        self.targetTime = 1 / targetFps
+        self.minScale = minScale
+        self.maxScale = maxScale
+        self.scaleStep = scaleStep
+        self.scale = maxScale
+        self.wantedScale = maxScale     # Unquantized
+        self.frameTime = None
+        self.lastPaint = None
+        self.frame = 0
+        self.previousCamera = None
+        self.jitters = [(_halton(i + 1, 2) - 0.5, _halton(i + 1, 3) - 0.5) for i in range(self.jitterLength)]
+
+        self.program = _createRenderProgram(
+            pathlib.Path(__file__).parent.joinpath('upscaleScene.glsl'),
+            replacements=[
+                ('THREAD_GROUP_SIZE_X', _threadGroupSize.x),
+                ('THREAD_GROUP_SIZE_Y', _threadGroupSize.y)
+            ]
+        )
+        # Textures are viewport sized whatever the scale, so changing it costs nothing
+        self.frameTexture = _createTexture(_viewportSize)
+        self.sampleTexture = _createTexture(_viewportSize)
+        self.historyTextures = [_createTexture(_viewportSize) for i in range(2)]
+        self.historySampleTextures = [_createTexture(_viewportSize) for i in range(2)]
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+
+    @property
+    def renderSize(self):
+        return vec2(max(1, round(_viewportSize.x * self.scale)), max(1, round(_viewportSize.y * self.scale)))
+
+    def _updateScale(self):
+        now = time.perf_counter()
+        if not self.lastPaint is None:
+            frameTime = min(now - self.lastPaint, self.targetTime * 4)   # Don't let a stall throw it
+            self.frameTime = frameTime if self.frameTime is None else self.frameTime * 0.8 + frameTime * 0.2
+            wanted = self.wantedScale * min(max(math.sqrt(self.targetTime / self.frameTime), 0.95), 1.05)
+            self.wantedScale = min(max(wanted, self.minScale), self.maxScale)
+            if abs(self.wantedScale - self.scale) >= self.scaleStep or self.wantedScale in (self.minScale, self.maxScale):
+                self.scale = self.wantedScale
+        self.lastPaint = now
+
+    def paint(self):
+        # With the scene program in use and its uniforms set
+        self._updateScale()
+        renderSize = self.renderSize
+        jitter = self.jitters[self.frame % self.jitterLength]
+        gl.glUniform2i(2, *renderSize)
+        gl.glUniform2f(3, *jitter)
+        gl.glBindImageTexture(0, self.frameTexture, 0, gl.GL_FALSE, 0, gl.GL_WRITE_ONLY, gl.GL_RGBA32F)
+        gl.glBindImageTexture(1, self.sampleTexture, 0, gl.GL_FALSE, 0, gl.GL_WRITE_ONLY, gl.GL_RGBA32F)
+        _dispatchScene(renderSize, vec2(-(-renderSize.x // _threadGroupSize.x), -(-renderSize.y // _threadGroupSize.y)))
+        gl.glMemoryBarrier(gl.GL_SHADER_IMAGE_ACCESS_BARRIER_BIT | gl.GL_SHADER_STORAGE_BARRIER_BIT)
+
+        previous, current = self.frame % 2, (self.frame + 1) % 2
+        gl.glUseProgram(self.program)
+        gl.glUniform2i(0, *renderSize)
+        gl.glUniform2f(1, *jitter)
+        historyValid = not self.previousCamera is None and not _camera is None
+        if historyValid:
+            gl.glUniform3f(2, *self.previousCamera[0:3])
+            gl.glUniform4f(3, *self.previousCamera[4:8])
+            gl.glUniform1f(4, self.previousCamera[3])
+        gl.glUniform1i(5, historyValid)
+        gl.glUniform1f(6, self.frameWeight)
+        for unit, texture, access in (
+            (0, screenTexture, gl.GL_WRITE_ONLY),
+            (1, self.frameTexture, gl.GL_READ_ONLY),
+            (2, self.sampleTexture, gl.GL_READ_ONLY),
+            (3, self.historyTextures[previous], gl.GL_READ_ONLY),
+            (4, self.historySampleTextures[previous], gl.GL_READ_ONLY),
+            (5, self.historyTextures[current], gl.GL_WRITE_ONLY),
+            (6, self.historySampleTextures[current], gl.GL_WRITE_ONLY)
+        ):
+            gl.glBindImageTexture(unit, texture, 0, gl.GL_FALSE, 0, access, gl.GL_RGBA32F)
+        gl.glDispatchCompute(-(-_viewportSize.x // _threadGroupSize.x), -(-_viewportSize.y // _threadGroupSize.y), 1)
+
+        self.previousCamera = _camera
+        self.frame += 1
+
+    def delete(self):
+        gl.glDeleteProgram(self.program)
+        textures = [self.frameTexture, self.sampleTexture] + self.historyTextures + self.historySampleTextures
+        gl.glDeleteTextures(len(textures), textures)
+
+_adaptive = None
+
+def setAdaptiveResolution(enabled: bool, targetFps=60, minScale=0.25, maxScale=1.0, scaleStep=0.05):
+    global _adaptive
+    if not _adaptive is None:
+        _adaptive.delete()
+        _adaptive = None
+    gl.glBindImageTexture(0, screenTexture, 0, gl.GL_FALSE, 0, gl.GL_WRITE_ONLY, gl.GL_RGBA32F)
+
+    if enabled:
+        log.info('Adapting resolution to %s fps (scale %s to %s)', targetFps, minScale, maxScale)
+        _adaptive = _adaptiveResolution(targetFps, minScale, maxScale, scaleStep)
+
+def renderScale():
+    # Fraction of the viewport size the scene is rendered at
+    return 1.0 if _adaptive is None else _adaptive.scale
+
+
+### Cone marching ###
+# Opt-in. Neighbouring rays cross the same empty space, so before the scene is marched, one cone per
+# `tileSize` square tile is marched at low resolution in the same program (conePrePass), leaving the
+# distance every ray of the tile can skip in a small r32f texture. Each pixel then starts its march
+# from its tile's depth. The skipped distance is conservative for exact SDFs like the sphere and box
+# ones, so contacts don't change; it is capped at the same dstMax as the main march.
+class _coneMarching():
+    def __init__(self, tileSize: int):
+        self.tileSize = tileSize
+        self.tiles = vec2(-(-_viewportSize.x // tileSize), -(-_viewportSize.y // tileSize))
+        self.texture = gl.glGenTextures(1)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        gl.glTexStorage2D(gl.GL_TEXTURE_2D, 1, gl.GL_R32F, *self.tiles)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+
+    def prePass(self, resolution: vec2):
+        # With the scene program in use and its uniforms set
+        tiles = vec2(-(-resolution.x // self.tileSize), -(-resolution.y // self.tileSize))
+        gl.glBindImageTexture(2, self.texture, 0, gl.GL_FALSE, 0, gl.GL_READ_WRITE, gl.GL_R32F)
+        gl.glUniform1i(5, True)
+        gl.glDispatchCompute(-(-tiles.x // _threadGroupSize.x), -(-tiles.y // _threadGroupSize.y), 1)
+        gl.glMemoryBarrier(gl.GL_SHADER_IMAGE_ACCESS_BARRIER_BIT)
+        gl.glUniform1i(5, False)
+
+    def delete(self):
+        gl.glDeleteTextures(1, [self.texture])
+
+_cone = None
+
+def setConeMarching(enabled: bool, tileSize=8):
+    global _cone
+    if not _cone is None:
+        _cone.delete()
+        _cone = None
+
+    if enabled:
+        log.info('Cone marching %sx%s tiles', tileSize, tileSize)
+        _cone = _coneMarching(tileSize)
+
+
+### Step counting ###
+# Debug. The scene program adds the distance evaluations of every ray (and of every cone, with cone
+# marching, and every shadow ray, with lights) and the lights listed per tile to counters in storage
+# buffer 9, read and reset by `marchStats`. Every pixel does atomic adds on the same counters, so
+# leave it off when not measuring.
+_stepCounter = None
+
+def setStepCounting(enabled: bool):
+    global _stepCounter
+    if enabled and _stepCounter is None:
+        _stepCounter = _createStorageBuffer(9)
+        gl.glBufferData(gl.GL_SHADER_STORAGE_BUFFER, 32, np.zeros(8, np.uint32), gl.GL_DYNAMIC_READ)
+    elif not enabled and not _stepCounter is None:
+        gl.glDeleteBuffers(1, [_stepCounter])
+        _stepCounter = None
+
+def marchStats():
+    # Averages since the last call: {'rays', 'stepsPerRay', 'cones', 'stepsPerCone', 'stepsPerPixel',
+    # 'shadowRays', 'stepsPerShadowRay', 'lightsPerTile'}, stepsPerPixel counting the cones' share of
+    # their tiles but not shadows, lightsPerTile over tiles with contacts. Blocks until the GPU is done.
+    if _stepCounter is None: return None
+    counters = np.zeros(8, np.uint32)
+    gl.glMemoryBarrier(gl.GL_BUFFER_UPDATE_BARRIER_BIT)
+    gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, _stepCounter)
+    gl.glGetBufferSubData(gl.GL_SHADER_STORAGE_BUFFER, 0, counters.nbytes, counters.ctypes.data_as(ctypes.c_void_p))
+    gl.glBufferSubData(gl.GL_SHADER_STORAGE_BUFFER, 0, 32, np.zeros(8, np.uint32))
+    gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, 0)
+
+    steps, rays, coneSteps, cones, shadowSteps, shadowRays, tiles, tileLights = (int(counter) for counter in counters)
+    return {
+        'rays': rays,
+        'stepsPerRay': steps / rays if rays else 0.0,
+        'cones': cones,
+        'stepsPerCone': coneSteps / cones if cones else 0.0,
+        'stepsPerPixel': (steps + coneSteps) / rays if rays else 0.0,
+        'shadowRays': shadowRays,
+        'stepsPerShadowRay': shadowSteps / shadowRays if shadowRays else 0.0,
+        'lightsPerTile': tileLights / tiles if tiles else 0.0
+    }
+
+
+### Tile culling ###
+# Opt-in. Before the scene is marched, each work group of the scene program lists the shapes whose
+# bounding spheres reach into its tile of the screen (cullPrePass), and the main pass, with the same
+# groups, marches each pixel against its tile's list only. Tiles with nothing in them skip the
+# march. Tiles with more than `maxTileShapes` shapes fall back to the whole scene (the BVH, if there
+# is one), so the list buffer stays a fixed size.
+class _tileCulling():
+    def __init__(self, maxTileShapes: int):
+        self.maxTileShapes = maxTileShapes
+        tiles = -(-_viewportSize.x // _threadGroupSize.x) * -(-_viewportSize.y // _threadGroupSize.y)
+        self.listBuffer = _createStorageBuffer(10)
+        gl.glBufferData(gl.GL_SHADER_STORAGE_BUFFER, tiles * (maxTileShapes + 1) * 4, None, gl.GL_DYNAMIC_COPY)
+        self.statsBuffer = _createStorageBuffer(11)
+        gl.glBufferData(gl.GL_SHADER_STORAGE_BUFFER, 16, np.zeros(4, np.uint32), gl.GL_DYNAMIC_READ)
+        gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, 0)
+
+    def prePass(self, groups: vec2):
+        # With the scene program in use and its uniforms set
+        gl.glUniform1i(8, True)
+        gl.glDispatchCompute(*groups, 1)
+        gl.glMemoryBarrier(gl.GL_SHADER_STORAGE_BARRIER_BIT)
+        gl.glUniform1i(8, False)
+
+    def delete(self):
+        gl.glDeleteBuffers(2, [self.listBuffer, self.statsBuffer])
+
+_culling = None
+
+def setTileCulling(enabled: bool, maxTileShapes=64):
+    global _culling
+    if not _culling is None:
+        _culling.delete()
+        _culling = None
+
+    if enabled:
+        log.info('Culling shapes per tile (up to %s a tile)', maxTileShapes)
+        _culling = _tileCulling(maxTileShapes)
+
+def cullStats():
+    # Totals since the last call: {'tiles', 'shapesPerTile', 'emptyTiles', 'overflowTiles'}, with
+    # shapesPerTile counting overflowing tiles' shapes too. Blocks until the GPU is done.
+    if _culling is None: return None
+    counters = np.zeros(4, np.uint32)
+    gl.glMemoryBarrier(gl.GL_BUFFER_UPDATE_BARRIER_BIT)
+    gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, _culling.statsBuffer)
+    gl.glGetBufferSubData(gl.GL_SHADER_STORAGE_BUFFER, 0, counters.nbytes, counters.ctypes.data_as(ctypes.c_void_p))
+    gl.glBufferSubData(gl.GL_SHADER_STORAGE_BUFFER, 0, 16, np.zeros(4, np.uint32))
+    gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, 0)
+
+    tiles, shapes, emptyTiles, overflowTiles = (int(counter) for counter in counters)
+    return {
+        'tiles': tiles,
+        'shapesPerTile': shapes / tiles if tiles else 0.0,
+        'emptyTiles': emptyTiles,
+        'overflowTiles': overflowTiles
+    }
+
+
 ### Rendering ###
+def _dispatchScene(resolution: vec2, groups: vec2):
+    # Scene program in use, uniforms set; pre-passes first when they are on
+    if _cone is None: gl.glUniform1i(4, 0)
+    else:
+        gl.glUniform1i(4, _cone.tileSize)
+        _cone.prePass(resolution)
+    if _culling is None: gl.glUniform1i(7, 0)
+    else:
+        gl.glUniform1i(7, _culling.maxTileShapes)
+        _culling.prePass(groups)
+    gl.glDispatchCompute(*groups, 1)
+
+@_profiled('paintScene')
 def paintScene():
-    gl.glClear(gl.GL_COLOR_BUFFER_BIT)
+    if not _offscreen: gl.glClear(gl.GL_COLOR_BUFFER_BIT)
 
     # Dispatch render program
-    gl.glMemoryBarrier(gl.GL_ALL_BARRIER_BITS)
-    gl.glUseProgram(sceneRenderProgram)
-    gl.glDispatchCompute(_viewportSize.x // _threadGroupSize.x, _viewportSize.y // _threadGroupSize.y, 1)
+    # Buffer uploads are ordered by GL itself, so only earlier shader writes need a barrier
+    gl.glMemoryBarrier(gl.GL_SHADER_IMAGE_ACCESS_BARRIER_BIT | gl.GL_SHADER_STORAGE_BARRIER_BIT)
+    gl.glUseProgram(_sceneProgram)
+    gl.glUniform1i(0, _shapeCount)
+    gl.glUniform1i(1, _bvhNodeCount)
+    gl.glUniform1i(6, not _stepCounter is None)
+    gl.glUniform1i(9, _lightCount)
+    if _adaptive is None:
+        gl.glUniform2i(2, 0, 0)
+        gl.glUniform2f(3, 0, 0)
+        _dispatchScene(_viewportSize, vec2(_viewportSize.x // _threadGroupSize.x, _viewportSize.y // _threadGroupSize.y))
+    else:
+        _adaptive.paint()
+        gl.glBindImageTexture(0, screenTexture, 0, gl.GL_FALSE, 0, gl.GL_WRITE_ONLY, gl.GL_RGBA32F)
+    if not _stream is None: _stream.fence()
     
+@_profiled('paintUI')
 def paintUI():
-    # Dispatch render program
-    gl.glMemoryBarrier(gl.GL_ALL_BARRIER_BITS)
+    global _uiDirtyTileCount
+    # Redraw the tiles compileUI queued into the cached layer, then composite every tile with
+    # widgets over the screen. Nothing runs where there are no widgets.
+    gl.glMemoryBarrier(gl.GL_SHADER_IMAGE_ACCESS_BARRIER_BIT | gl.GL_SHADER_STORAGE_BARRIER_BIT)
     gl.glUseProgram(uiRenderProgram)
-    gl.glDispatchCompute(_viewportSize.x // _threadGroupSize.x, _viewportSize.y // _threadGroupSize.y, 1)
+    gl.glBindImageTexture(0, screenTexture, 0, gl.GL_FALSE, 0, gl.GL_READ_WRITE, gl.GL_RGBA32F)
+    gl.glBindImageTexture(1, uiLayerTexture, 0, gl.GL_FALSE, 0, gl.GL_READ_WRITE, gl.GL_RGBA32F)
+    if _uiDirtyTileCount:
+        gl.glActiveTexture(gl.GL_TEXTURE1)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, _glyphAtlasTexture)
+        gl.glActiveTexture(gl.GL_TEXTURE0)
+        gl.glUniform1i(0, True)
+        gl.glUniform1i(1, _uiTileCount)
+        gl.glDispatchCompute(_uiDirtyTileCount, 1, 1)
+        gl.glMemoryBarrier(gl.GL_SHADER_IMAGE_ACCESS_BARRIER_BIT)
+        _uiDirtyTileCount = 0
+    if _uiTileCount:
+        gl.glUniform1i(0, False)
+        gl.glUniform1i(1, 0)
+        gl.glDispatchCompute(_uiTileCount, 1, 1)
 
+def _readContacts(storageBuffer, target):
+    # Blocking full-frame read straight into `target`, no unpacking
+    gl.glMemoryBarrier(gl.GL_BUFFER_UPDATE_BARRIER_BIT)
+    gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, storageBuffer)
+    gl.glGetBufferSubData(gl.GL_SHADER_STORAGE_BUFFER, 0, target.nbytes, target.ctypes.data_as(ctypes.c_void_p))
+    gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, 0)
+
+@_profiled('getContactsScene')
 def getContactsScene():
     # Read data from sceneContactStorageBuffer
-    gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, sceneContactStorageBuffer)
-    contacts.scene = struct.unpack('i' * _viewportSize[0] * _viewportSize[1], gl.glGetBufferSubData(gl.GL_SHADER_STORAGE_BUFFER, 0, _viewportSize[0] * _viewportSize[1] * 4))
+    _readContacts(sceneContactStorageBuffer, contacts.scene)
 
+@_profiled('getContactsUI')
 def getContactsUI():
-    # Read data from  uiContactStorageBuffer
-    gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, uiContactStorageBuffer)
-    contacts.ui = struct.unpack('i' * _viewportSize[0] * _viewportSize[1], gl.glGetBufferSubData(gl.GL_SHADER_STORAGE_BUFFER, 0, _viewportSize[0] * _viewportSize[1] * 4))
+    # Read data from uiContactStorageBuffer
+    _readContacts(uiContactStorageBuffer, contacts.ui)
 
+
+### Picking ###
+# Queries copy just the requested pixels of a contact buffer into a small persistently mapped
+# staging buffer on the GPU timeline, so asking never waits. Staging buffers are pooled by size.
+_stagingMapFlags = gl.GL_MAP_READ_BIT | gl.GL_MAP_PERSISTENT_BIT | gl.GL_MAP_COHERENT_BIT
+_stagingPool = {}   # size in bytes -> [(buffer, mapped int32 array)]
+
+def _takeStaging(size: int):
+    if _stagingPool.get(size): return _stagingPool[size].pop()
+    buffer = gl.glGenBuffers(1)
+    gl.glBindBuffer(gl.GL_COPY_WRITE_BUFFER, buffer)
+    gl.glBufferStorage(gl.GL_COPY_WRITE_BUFFER, size, None, _stagingMapFlags)
+    address = gl.glMapBufferRange(gl.GL_COPY_WRITE_BUFFER, 0, size, _stagingMapFlags)
+    return buffer, np.ctypeslib.as_array((ctypes.c_int32 * (size // 4)).from_address(address))
+
+class contactQuery():
+    def __init__(self, storageBuffer, pos: vec2, dim: vec2):
+        # Clip to the viewport
+        x0, y0 = max(pos.x, 0), max(pos.y, 0)
+        x1, y1 = min(pos.x + dim.x, _viewportSize.x), min(pos.y + dim.y, _viewportSize.y)
+        self.pos = vec2(x0, y0)
+        self.dim = vec2(max(x1 - x0, 0), max(y1 - y0, 0))
+        self._result = None
+        self._staging = None
+        self._fence = None
+        if self.dim.x * self.dim.y == 0:
+            self._result = np.empty((self.dim.y, self.dim.x), np.int32)
+            return
+
+        # Rows of the rectangle are contiguous in the contact buffer, so one copy per row
+        self._staging = _takeStaging(self.dim.x * self.dim.y * 4)
+        gl.glMemoryBarrier(gl.GL_BUFFER_UPDATE_BARRIER_BIT)
+        gl.glBindBuffer(gl.GL_COPY_READ_BUFFER, storageBuffer)
+        gl.glBindBuffer(gl.GL_COPY_WRITE_BUFFER, self._staging[0])
+        if self.dim.x == _viewportSize.x:
+            gl.glCopyBufferSubData(gl.GL_COPY_READ_BUFFER, gl.GL_COPY_WRITE_BUFFER, y0 * _viewportSize.x * 4, 0, self.dim.x * self.dim.y * 4)
+        else:
+            for row in range(self.dim.y):
+                gl.glCopyBufferSubData(
+                    gl.GL_COPY_READ_BUFFER, gl.GL_COPY_WRITE_BUFFER,
+                    (x0 + (y0 + row) * _viewportSize.x) * 4, row * self.dim.x * 4, self.dim.x * 4
+                )
+        self._fence = gl.glFenceSync(gl.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+
+    def result(self, wait=False):
+        # (height, width) array of contact IDs, or None while the GPU hasn't caught up (or after cancel)
+        if self._result is None and not self._staging is None:
+            timeout = 1000000000 if wait else 0
+            while True:
+                status = gl.glClientWaitSync(self._fence, gl.GL_SYNC_FLUSH_COMMANDS_BIT, timeout)
+                if status != gl.GL_TIMEOUT_EXPIRED: break
+                if not wait: return None
+            gl.glDeleteSync(self._fence)
+
+            buffer, mapped = self._staging
+            self._result = mapped[:self.dim.x * self.dim.y].reshape(self.dim.y, self.dim.x).copy()
+            _stagingPool.setdefault(mapped.nbytes, []).append(self._staging)
+            self._staging = None
+        return self._result
+
+    def cancel(self):
+        # Hand the staging buffer back unread. Later copies into it come after this one on the GPU
+        # timeline, so there is nothing to wait for.
+        if self._staging is None: return
+        if not self._fence is None: gl.glDeleteSync(self._fence)
+        _stagingPool.setdefault(self._staging[1].nbytes, []).append(self._staging)
+        self._staging = None
+
+    def __del__(self):
+        # Queries dropped without their result; the context may already be gone at exit
+        try: self.cancel()
+        except Exception: pass
+
+@_profiled('queryContacts')
+def queryContacts(pos: vec2, dim=vec2(1, 1), source='scene'):
+    # Ask for the contact IDs in a rectangle from the last painted frame; poll the returned
+    # query's `result()` on a later frame. `source` is 'scene' or 'ui'.
+    return contactQuery(sceneContactStorageBuffer if source == 'scene' else uiContactStorageBuffer, pos, dim)
+
+@_profiled('blitBuffers')
 def blitBuffers():
     # Copy data to default framebuffer's backbuffer
+    if _offscreen: return
+    gl.glMemoryBarrier(gl.GL_FRAMEBUFFER_BARRIER_BIT)
     gl.glBlitFramebuffer(
         0, 0, *_viewportSize,
         0, 0, *_viewportSize,
         gl.GL_COLOR_BUFFER_BIT, gl.GL_LINEAR
     )
+
+
+### Readback ###
+# The screen texture is read into a ring of pixel buffer objects. glReadPixels into a PBO returns
+# right away; the copy happens on the GPU and is only waited for when the frame is taken, which
+# for pipelined renders is after the next frame has been submitted.
+class _pixelReadback():
+    def __init__(self, depth: int):
+        self.buffers = list(gl.glGenBuffers(depth))
+        self.size = None
+        self.pending = []   # (buffer, fence) in submission order
+
+    def queue(self):
+        size = _viewportSize.x * _viewportSize.y * 16
+        if size != self.size:
+            for buffer in self.buffers:
+                gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, buffer)
+                gl.glBufferData(gl.GL_PIXEL_PACK_BUFFER, size, None, gl.GL_STREAM_READ)
+            self.size = size
+        if len(self.pending) == len(self.buffers):
+            gl.glDeleteSync(self.pending.pop(0)[1])     # Nobody took the oldest frame
+
+        buffer = self.buffers[0]
+        self.buffers.append(self.buffers.pop(0))
+        gl.glMemoryBarrier(gl.GL_FRAMEBUFFER_BARRIER_BIT)
+        gl.glBindFramebuffer(gl.GL_READ_FRAMEBUFFER, framebuffer)
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, buffer)
+        gl.glReadPixels(0, 0, *_viewportSize, gl.GL_RGBA, gl.GL_FLOAT, ctypes.c_void_p(0))
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+        self.pending.append((buffer, gl.glFenceSync(gl.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)))
+
+    def take(self):
+        # Oldest queued frame as an (height, width, 4) float32 array, row 0 at the bottom
+        if not self.pending: return None
+        buffer, fence = self.pending.pop(0)
+        while gl.glClientWaitSync(fence, gl.GL_SYNC_FLUSH_COMMANDS_BIT, 1000000000) == gl.GL_TIMEOUT_EXPIRED: pass
+        gl.glDeleteSync(fence)
+
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, buffer)
+        address = gl.glMapBufferRange(gl.GL_PIXEL_PACK_BUFFER, 0, self.size, gl.GL_MAP_READ_BIT)
+        image = np.ctypeslib.as_array((ctypes.c_float * (self.size // 4)).from_address(address)).reshape(_viewportSize.y, _viewportSize.x, 4).copy()
+        gl.glUnmapBuffer(gl.GL_PIXEL_PACK_BUFFER)
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+        return image
+
+_readback = None
+
+def renderToArray(scene, pipelined=False):
+    global _readback
+    # Render `scene` and return the RGBA screen texture as a float32 array. With `pipelined`, the
+    # frame rendered by the previous call is returned instead (None the first time), so reading
+    # it back overlaps with this frame's rendering; `finishReadback` collects the last one.
+    if _readback is None: _readback = _pixelReadback(2)
+    compileScene(scene)
+    paintScene()
+    _readback.queue()
+    if pipelined: return _readback.take() if len(_readback.pending) > 1 else None
+    return _readback.take()
+
+def finishReadback():
+    return None if _readback is None else _readback.take()
@@ -0,0 +1,378 @@
+# Triangle meshes as shapes (see env.mesh). OBJ and PLY files are baked into signed distance grids
+# on the CPU, spread over a pool of processes, and cached on disk as .npy files that are memory
+# mapped when the mesh is loaded again, so reopening a level doesn't bake anything. A file is loaded
+# into one grid however many shapes use it, and gl uploads each grid once, into a 3D texture atlas
+# shared by every grid.
+
+import hashlib, json, logging, multiprocessing, os, pathlib
+import numpy as np
+
+from raycekar import util
+from raycekar.coord import *
+
+
+log = logging.getLogger('rk.mesh')
+
+_gridVersion = 1    # Bump when baking changes, so old cache entries are ignored
+brickSize = 8       # Grid points along each side of a brick, the unit of baking work
+atlasDepth = 1024   # Grid columns in the atlas are stacked up to this many points deep
+
+
+### Parsing ###
+def _readOBJ(data: bytes):
+    # Vertices and faces only, polygons split into fans
+    vertices, faces = [], []
+    for line in data.decode('utf-8', 'replace').splitlines():
+        fields = line.split()
+        if not fields: continue
+        if fields[0] == 'v': vertices.append([float(value) for value in fields[1:4]])
+        elif fields[0] == 'f':
+            # v, v/vt, v//vn or v/vt/vn, counted from 1 or from the end when negative
+            indices = [int(field.split('/')[0]) for field in fields[1:]]
+            indices = [index - 1 if index > 0 else len(vertices) + index for index in indices]
+            faces += [(indices[0], indices[i], indices[i + 1]) for i in range(1, len(indices) - 1)]
+    return np.array(vertices, np.float64).reshape(-1, 3), np.array(faces, np.int64).reshape(-1, 3)
+
+_plyTypes = {
+    'char': 'i1', 'int8': 'i1', 'uchar': 'u1', 'uint8': 'u1', 'short': 'i2', 'int16': 'i2',
+    'ushort': 'u2', 'uint16': 'u2', 'int': 'i4', 'int32': 'i4', 'uint': 'u4', 'uint32': 'u4',
+    'float': 'f4', 'float32': 'f4', 'double': 'f8', 'float64': 'f8'
+}
+
+def _readPLY(data: bytes):
+    # ASCII and binary PLY with a `vertex` element (x, y, z) and a `face` element of index lists
+    headerEnd = data.index(b'end_header') + len(b'end_header')
+    headerEnd = data.index(b'\n', headerEnd) + 1
+    elements = []   # (name, count, [(name, type, countType or None)])
+    fileFormat = None
+    for line in data[:headerEnd].decode('latin-1').splitlines():
+        fields = line.split()
+        if not fields: continue
+        if fields[0] == 'format': fileFormat = fields[1]
+        elif fields[0] == 'element': elements.append((fields[1], int(fields[2]), []))
+        elif fields[0] == 'property' and fields[1] == 'list': elements[-1][2].append((fields[4], _plyTypes[fields[3]], _plyTypes[fields[2]]))
+        elif fields[0] == 'property': elements[-1][2].append((fields[2], _plyTypes[fields[1]], None))
+
+    vertices = faces = None
+    if fileFormat == 'ascii':
+        tokens = data[headerEnd:].split()
+        position = 0
+        for name, count, properties in elements:
+            rows = []
+            for row in range(count):
+                values = {}
+                for propertyName, propertyType, countType in properties:
+                    if countType is None:
+                        values[propertyName] = float(tokens[position])
+                        position += 1
+                    else:
+                        length = int(tokens[position])
+                        values[propertyName] = [int(token) for token in tokens[position + 1:position + 1 + length]]
+                        position += 1 + length
+                rows.append(values)
+            if name == 'vertex': vertices = np.array([(row['x'], row['y'], row['z']) for row in rows], np.float64).reshape(-1, 3)
+            elif name == 'face': faces = [row.get('vertex_indices', row.get('vertex_index')) for row in rows]
+    else:
+        order = '<' if fileFormat == 'binary_little_endian' else '>'
+        position = headerEnd
+        for name, count, properties in elements:
+            if all(countType is None for propertyName, propertyType, countType in properties):
+                # Fixed size rows, read all at once
+                rowType = np.dtype([(propertyName, order + propertyType) for propertyName, propertyType, countType in properties])
+                rows = np.frombuffer(data, rowType, count, position)
+                position += rowType.itemsize * count
+                if name == 'vertex': vertices = np.stack([rows['x'], rows['y'], rows['z']], axis=1).astype(np.float64)
+                continue
+            # Rows with lists: all at once if they are just one list, the same length every row
+            # (triangles, usually), otherwise one by one
+            if len(properties) == 1:
+                propertyName, propertyType, countType = properties[0]
+                length = int(np.frombuffer(data, order + countType, 1, position)[0])
+                rowType = np.dtype([('length', order + countType), ('items', order + propertyType, length)])
+                if position + rowType.itemsize * count <= len(data):
+                    rows = np.frombuffer(data, rowType, count, position)
+                    if np.all(rows['length'] == length):
+                        position += rowType.itemsize * count
+                        if name == 'face': faces = rows['items'].astype(np.int64)
+                        continue
+            rowLists = []
+            for row in range(count):
+                for propertyName, propertyType, countType in properties:
+                    itemType = np.dtype(order + propertyType)
+                    if countType is None:
+                        position += itemType.itemsize
+                        continue
+                    countType = np.dtype(order + countType)
+                    length = int(np.frombuffer(data, countType, 1, position)[0])
+                    position += countType.itemsize
+                    if propertyName in ('vertex_indices', 'vertex_index'): rowLists.append(np.frombuffer(data, itemType, length, position).tolist())
+                    position += itemType.itemsize * length
+            if name == 'face': faces = rowLists
+
+    if vertices is None or faces is None: raise ValueError('PLY file has no vertex or face element')
+    if not isinstance(faces, np.ndarray):
+        faces = [(face[0], face[i], face[i + 1]) for face in faces for i in range(1, len(face) - 1)]
+    return vertices, np.array(faces, np.int64).reshape(-1, 3)
+
+def readTriangles(path):
+    # (n, 3, 3) triangle corners of the OBJ or PLY file at `path`
+    path = pathlib.Path(path)
+    readers = {'.obj': _readOBJ, '.ply': _readPLY}
+    if not path.suffix.lower() in readers: raise ValueError('Unsupported mesh format "{}"'.format(path.suffix))
+    vertices, faces = readers[path.suffix.lower()](path.read_bytes())
+    return vertices[faces]
+
+
+### Baking ###
+def _triangleDistances(points, triangles):
+    # Distance from points[i] to triangles[i] (n, 3, 3), by which region of the triangle is nearest
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    ab, ac = b - a, c - a
+    dot = lambda u, v: np.einsum('ij,ij->i', u, v)
+    ap, bp, cp = points - a, points - b, points - c
+    d1, d2 = dot(ab, ap), dot(ac, ap)
+    d3, d4 = dot(ab, bp), dot(ac, bp)
+    d5, d6 = dot(ab, cp), dot(ac, cp)
+    va, vb, vc = d3 * d6 - d5 * d4, d5 * d2 - d1 * d6, d1 * d4 - d3 * d2
+
+    # From the face to the corners, so the narrower regions win
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = 1 / (va + vb + vc)
+        nearest = a + ab * (vb * denominator)[:, None] + ac * (vc * denominator)[:, None]
+        regions = [
+            ((va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0), lambda: b + (c - b) * ((d4 - d3) / ((d4 - d3) + (d5 - d6)))[:, None]),
+            ((vb <= 0) & (d2 >= 0) & (d6 <= 0), lambda: a + ac * (d2 / (d2 - d6))[:, None]),
+            ((vc <= 0) & (d1 >= 0) & (d3 <= 0), lambda: a + ab * (d1 / (d1 - d3))[:, None]),
+            ((d6 >= 0) & (d5 <= d6), lambda: c),
+            ((d3 >= 0) & (d4 <= d3), lambda: b),
+            ((d1 <= 0) & (d2 <= 0), lambda: a)
+        ]
+        for inRegion, regionNearest in regions:
+            if inRegion.any(): nearest = np.where(inRegion[:, None], regionNearest(), nearest)
+    return np.sqrt(np.einsum('ij,ij->i', points - nearest, points - nearest))
+
+_bakeTriangles = None   # Set in each baking process
+
+def _initBaker(triangles):
+    global _bakeTriangles
+    _bakeTriangles = triangles
+
+def _bakeBricks(task):
+    # Unsigned distances of the points of some bricks. A brick only needs the triangles that could be
+    # nearest to any of its points: those no more than its diameter further from its centre than the
+    # nearest one.
+    lo, cellSize, size, bricks = task
+    triangles = _bakeTriangles
+    triangleCenters = triangles.mean(axis=1)
+    triangleRadii = np.linalg.norm(triangles - triangleCenters[:, None], axis=2).max(axis=1)
+    results = []
+    for brick in bricks:
+        first = brick * brickSize
+        last = np.minimum(first + brickSize, size)
+        axes = [lo[axis] + cellSize * np.arange(first[axis], last[axis]) for axis in range(3)]
+        z, y, x = np.meshgrid(axes[2], axes[1], axes[0], indexing='ij')
+        points = np.stack([x.ravel(), y.ravel(), z.ravel()], axis=1)
+
+        center = (points.min(axis=0) + points.max(axis=0)) / 2
+        radius = np.linalg.norm(points.max(axis=0) - center)
+        # Bounds from the triangles' bounding spheres first, so exact distances are only worked out
+        # for the triangles that might be nearest
+        centerDst = np.linalg.norm(triangleCenters - center, axis=1)
+        near = np.flatnonzero(centerDst - triangleRadii <= (centerDst + triangleRadii).min() + 2 * radius)
+        centerDst = _triangleDistances(np.broadcast_to(center, (len(near), 3)), triangles[near])
+        candidates = near[centerDst <= centerDst.min() + 2 * radius]
+
+        # Then the same for each point, in blocks of candidates: the far sides of the spheres bound
+        # its distance, and only triangles whose near sides are within that bound are measured
+        blocks = [candidates[block:block + max(1, 65536 // len(points))] for block in range(0, len(candidates), max(1, 65536 // len(points)))]
+        pointSquares = np.einsum('ij,ij->i', points, points)[:, None]
+        centerSquares = np.einsum('ij,ij->i', triangleCenters, triangleCenters)
+        sphereDst = lambda block: np.sqrt(np.maximum(pointSquares + centerSquares[block] - 2 * points @ triangleCenters[block].T, 0))
+        bound = np.full(len(points), np.inf)
+        for block in blocks: bound = np.minimum(bound, (sphereDst(block) + triangleRadii[block]).min(axis=1))
+        bound += cellSize * 1e-3    # Room for rounding
+        dst = np.full(len(points), np.inf)
+        for block in blocks:
+            pointIndex, blockIndex = np.nonzero(sphereDst(block) - triangleRadii[block] <= bound[:, None])
+            np.minimum.at(dst, pointIndex, _triangleDistances(points[pointIndex], triangles[block[blockIndex]]))
+        results.append((first, last, dst.reshape(last[2] - first[2], last[1] - first[1], last[0] - first[0])))
+    return results
+
+def _insideGrid(triangles, lo, cellSize, size):
+    # Inside test for every grid point, by the parity of the triangles crossed on the way to +x. The
+    # rows are nudged off the grid a little so they don't run exactly along edges.
+    nudge = cellSize * np.array([3.1e-4, 1.7e-4])
+    rowCoords = lambda axis, count: lo[axis] + cellSize * np.arange(count) + nudge[axis - 1]
+    ys, zs = rowCoords(1, size[1]), rowCoords(2, size[2])
+
+    # Pair each triangle with the rows inside its bounds in y and z
+    triLo = triangles[:, :, 1:].min(axis=1)
+    triHi = triangles[:, :, 1:].max(axis=1)
+    firsts = np.ceil((triLo - lo[1:] - nudge) / cellSize).astype(np.int64).clip(0, size[1:])
+    lasts = np.floor((triHi - lo[1:] - nudge) / cellSize).astype(np.int64).clip(-1, size[1:] - 1)
+    spans = np.maximum(lasts - firsts + 1, 0)
+    counts = spans[:, 0] * spans[:, 1]
+    owners = np.repeat(np.arange(len(triangles)), counts)
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    rowY = firsts[owners, 0] + within % np.maximum(spans[owners, 0], 1)
+    rowZ = firsts[owners, 1] + within // np.maximum(spans[owners, 0], 1)
+
+    # Where each row crosses its triangle, if it does, from barycentric coordinates in the yz plane
+    a, b, c = (triangles[owners, corner] for corner in range(3))
+    py, pz = ys[rowY], zs[rowZ]
+    v0y, v0z, v1y, v1z = b[:, 1] - a[:, 1], b[:, 2] - a[:, 2], c[:, 1] - a[:, 1], c[:, 2] - a[:, 2]
+    denominator = v0y * v1z - v1y * v0z
+    with np.errstate(divide='ignore', invalid='ignore'):
+        u = ((py - a[:, 1]) * v1z - v1y * (pz - a[:, 2])) / denominator
+        v = (v0y * (pz - a[:, 2]) - (py - a[:, 1]) * v0z) / denominator
+        crosses = (denominator != 0) & (u >= 0) & (v >= 0) & (u + v <= 1)
+    crossX = (a[:, 0] + u * (b[:, 0] - a[:, 0]) + v * (c[:, 0] - a[:, 0]))[crosses]
+
+    # Count the crossings past each point, summing from the end of each row. A crossing is past
+    # the points before the first one at or beyond it.
+    crossPoint = np.ceil((crossX - lo[0]) / cellSize).astype(np.int64).clip(0, size[0])
+    counts = np.zeros((size[2], size[1], size[0] + 1), np.int32)
+    np.add.at(counts, (rowZ[crosses], rowY[crosses], crossPoint), 1)
+    ahead = np.cumsum(counts[:, :, ::-1], axis=2)[:, :, ::-1][:, :, 1:]
+    return ahead % 2 == 1
+
+def bake(triangles, resolution=64, padding=3, processes=None):
+    # Signed distance grid of `triangles` (n, 3, 3), `resolution` points along its longest side,
+    # with `padding` points of room around the mesh. Meshes should be closed for the signs to be right.
+    triangles = np.asarray(triangles, np.float64)
+    meshLo, meshHi = triangles.reshape(-1, 3).min(axis=0), triangles.reshape(-1, 3).max(axis=0)
+    cellSize = max(float((meshHi - meshLo).max()), 1e-9) / (resolution - 1 - 2 * padding)
+    lo = meshLo - padding * cellSize
+    size = np.ceil((meshHi - meshLo) / cellSize).astype(np.int64) + 1 + 2 * padding
+
+    brickCounts = -(-size // brickSize)
+    bricks = np.stack(np.meshgrid(*(np.arange(count) for count in brickCounts), indexing='ij'), axis=-1).reshape(-1, 3)
+    processes = processes or os.cpu_count() or 1
+    tasks = [(lo, cellSize, size, part) for part in np.array_split(bricks, min(len(bricks), processes * 4)) if len(part)]
+    if processes > 1:
+        with multiprocessing.Pool(processes, _initBaker, (triangles,)) as pool: results = pool.map(_bakeBricks, tasks)
+    else:
+        _initBaker(triangles)
+        results = [_bakeBricks(task) for task in tasks]
+
+    values = np.empty((size[2], size[1], size[0]), np.float32)
+    for first, last, dst in (brick for result in results for brick in result):
+        values[first[2]:last[2], first[1]:last[1], first[0]:last[0]] = dst / cellSize
+    values[_insideGrid(triangles, lo, cellSize, size)] *= -1
+    return grid(values.astype(np.float16), vec3(*lo.tolist()), cellSize)
+
+
+### Grids ###
+class grid():
+    # Signed distances on a regular grid of points, `values` (z, y, x) in cells, the first point at
+    # `lo` and the others `cellSize` apart, in the mesh's own units. `id` and `atlasOrigin` (in
+    # points) are set when it is registered for drawing, see `register`.
+    def __init__(self, values, lo: vec3, cellSize: float):
+        self.values = values
+        self.lo = lo
+        self.cellSize = cellSize
+        self.id = None
+        self.atlasOrigin = None
+
+    @property
+    def size(self):
+        # Points along x, y and z
+        return vec3(*self.values.shape[::-1])
+
+    def sample(self, cells):
+        # Distances in cells at (n, 3) positions in cells from `lo`, like sdfMeshRecord: trilinear
+        # inside the grid, and outside it no more than the distance to it allows
+        size = np.array(self.values.shape[::-1])
+        clamped = np.clip(cells, 0, size - 1)
+        outside = np.linalg.norm(cells - clamped, axis=1)
+        first = np.minimum(np.floor(clamped).astype(np.int64), size - 2).clip(0)
+        fraction = clamped - first
+        inside = np.zeros(len(cells), np.float32)
+        for corner in range(8):
+            offset = np.array([corner & 1, (corner >> 1) & 1, (corner >> 2) & 1])
+            weight = np.prod(np.where(offset, fraction, 1 - fraction), axis=1)
+            index = np.minimum(first + offset, size - 1)
+            inside += weight * self.values[index[:, 2], index[:, 1], index[:, 0]].astype(np.float32)
+        return np.where(outside > 0, np.maximum(outside, inside - outside), inside)
+
+grids = []          # Registered grids, by id
+atlasSize = [0, 0, 0]   # Points along x, y and z the atlas needs to hold them
+atlasLimit = 2048   # Points the atlas may span along each axis, the least GL_MAX_3D_TEXTURE_SIZE allowed
+_column = [0, 0, 0]     # x, width and depth used of the atlas column being filled
+_row = [0, 0]           # y and height of the row of columns being filled
+
+def register(meshGrid: grid):
+    # Give a grid an id and a place in the atlas, once. Columns are filled along x, and a new row
+    # of them is started along y when the next one would run past atlasLimit.
+    if not meshGrid.id is None: return meshGrid
+    width, height, depth = (int(points) for points in meshGrid.size)
+    if max(width, height, depth) > atlasLimit:
+        raise ValueError('mesh grid of {}x{}x{} points does not fit in the atlas ({} points per side)'.format(width, height, depth, atlasLimit))
+    if _column[2] + depth > min(atlasDepth, atlasLimit) and _column[2] > 0:
+        _column[:] = [_column[0] + _column[1], 0, 0]
+    if _column[0] + width > atlasLimit and _column[0] > 0:
+        _row[:] = [_row[0] + _row[1], 0]
+        _column[:] = [0, 0, 0]
+    if _row[0] + height > atlasLimit:
+        raise ValueError('mesh atlas is full ({} grids, {} points per side)'.format(len(grids), atlasLimit))
+    meshGrid.atlasOrigin = vec3(_column[0], _row[0], _column[2])
+    _column[1] = max(_column[1], width)
+    _column[2] += depth
+    _row[1] = max(_row[1], height)
+    atlasSize[:] = [max(atlasSize[0], _column[0] + _column[1]), max(atlasSize[1], _row[0] + _row[1]), max(atlasSize[2], _column[2])]
+    meshGrid.id = len(grids)
+    grids.append(meshGrid)
+    return meshGrid
+
+
+### Cache ###
+cacheDirectory = util.cacheDirectory('RAYCEKAR_MESH_CACHE', 'meshes')
+_loaded = {}    # Cache key -> grid, so each mesh is read once per process
+
+def setCacheDirectory(directory):
+    # None bakes every mesh when it is loaded
+    global cacheDirectory
+    cacheDirectory = directory
+
+def _readGrid(path):
+    # The values stay on disk, memory mapped, until something reads them
+    info = json.loads(path.with_suffix('.json').read_text())
+    return grid(np.load(path, mmap_mode='r'), vec3(*info['lo']), info['cellSize'])
+
+def _writeGrid(path, meshGrid: grid):
+    # Values first, so a grid is only found once both files are complete
+    with util.atomicWrite(path) as valuesFile:
+        np.save(valuesFile, np.ascontiguousarray(meshGrid.values))
+    with util.atomicWrite(path.with_suffix('.json'), 'w') as infoFile:
+        json.dump({'lo': list(meshGrid.lo), 'cellSize': meshGrid.cellSize}, infoFile)
+
+def load(path, resolution=64, padding=3, processes=None):
+    # Registered grid of the OBJ or PLY file at `path`, from the cache if it was baked before; see
+    # `bake` for the arguments
+    meshData = pathlib.Path(path).read_bytes()
+    digest = hashlib.sha256(meshData)
+    digest.update(repr((_gridVersion, pathlib.Path(path).suffix.lower(), resolution, padding)).encode())
+    key = digest.hexdigest()
+    if key in _loaded: return _loaded[key]
+    cachePath = None if cacheDirectory is None else pathlib.Path(cacheDirectory).joinpath(key + '.npy')
+
+    meshGrid = None
+    if not cachePath is None:
+        try:
+            meshGrid = _readGrid(cachePath)
+            log.debug('Mapped grid for %s from cache', path)
+        except (OSError, ValueError, KeyError):
+            pass    # Not cached, or unreadable
+
+    if meshGrid is None:
+        triangles = readTriangles(path)
+        log.info('Baking %s (%s triangles, %s points along the longest side)', path, len(triangles), resolution)
+        meshGrid = bake(triangles, resolution, padding, processes)
+        if not cachePath is None:
+            try:
+                _writeGrid(cachePath, meshGrid)
+                meshGrid = _readGrid(cachePath)
+            except OSError as error: log.warning('Could not write mesh cache: %s', error)
+
+    _loaded[key] = register(meshGrid)
+    return meshGrid
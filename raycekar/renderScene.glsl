@@ -8,15 +8,87 @@
 layout(local_size_x = @{THREAD_GROUP_SIZE_X}, local_size_y = @{THREAD_GROUP_SIZE_Y}) in;
 layout(rgba32f, binding = 0) uniform image2D screen;
 
-layout(std430, binding = 1) buffer shapeTypeStorageBuffer   {int shapeTypes[];};
+// Where each shape's records start, so any shape can be read without walking the ones before it
+struct _shapeHeader {
+    int type;
+    int intPtr;
+    int floatPtr;
+    int floatCount;
+};
+layout(std430, binding = 1) buffer shapeHeaderStorageBuffer {_shapeHeader shapeHeaders[];};
 layout(std430, binding = 2) buffer shapeIntStorageBuffer    {int shapeInts[];};
 layout(std430, binding = 3) buffer shapeFloatStorageBuffer  {float shapeFloats[];};
 
-layout(std430, binding = 4) buffer lightTypStorageBuffer    {int lightTypes[];};
-layout(std430, binding = 5) buffer lightFloatStorageBuffer  { float lightFloats[];};
+// Light N's floats start at N * lightRecordSize, see env.light
+layout(std430, binding = 4) buffer lightTypeStorageBuffer   {int lightTypes[];};
+layout(std430, binding = 5) buffer lightFloatStorageBuffer  {float lightFloats[];};
 
 layout(std430, binding = 6) buffer shapeContactsBuffer      {int contacts[];};
 
+// Leaves have left = -shape ID, and right = the instance for instances of an instance group or -1
+struct _bvhNode {
+    vec3 lo;
+    int left;
+    vec3 hi;
+    int right;
+};
+layout(std430, binding = 7) buffer bvhStorageBuffer         {_bvhNode bvhNodes[];};
+
+// Storage buffers are allocated with room to grow, so the counts come in separately
+layout(location = 0) uniform int shapeCount;    // Entries in shapeHeaders, camera included
+layout(location = 1) uniform int bvhNodeCount;  // 0 to walk every shape instead
+
+// Adaptive resolution (see gl.setAdaptiveResolution) renders into the corner of `screen` at
+// renderSize, with the rays jittered by a sub-pixel offset, and writes each pixel's contact position
+// and ID to `samples` for upscaleScene.glsl. A renderSize of 0 renders the whole screen as usual.
+layout(location = 2) uniform ivec2 renderSize;
+layout(location = 3) uniform vec2 jitter;
+layout(rgba32f, binding = 1) uniform writeonly image2D samples;
+
+// Cone marching (see gl.setConeMarching). With conePrePass set, each invocation marches one cone
+// holding every ray of a coneTileSize square tile and stores how far they can all safely go in
+// coneDepths; the main pass then starts each ray from its tile's depth. A coneTileSize of 0 starts
+// every ray at the camera.
+layout(location = 4) uniform int coneTileSize;
+layout(location = 5) uniform bool conePrePass;
+layout(r32f, binding = 2) uniform image2D coneDepths;
+
+// Debug step counters (see gl.setStepCounting), added to when countSteps is set
+layout(location = 6) uniform bool countSteps;
+layout(std430, binding = 9) buffer marchStatsBuffer {
+    uint marchSteps;
+    uint marchRays;
+    uint coneSteps;
+    uint coneTiles;
+    uint shadowSteps;
+    uint shadowRays;
+    uint shadedTiles;
+    uint shadedTileLights;
+};
+
+// Tile culling (see gl.setTileCulling). With cullPrePass set, each work group lists the shapes
+// whose bounds reach into its tile's frustum, in ID order, in tileLists: entry tile * (maxTileShapes
+// + 1) holds the count, or -1 if there were more than maxTileShapes, followed by the IDs. The main
+// pass, dispatched with the same groups, marches only its tile's shapes. A maxTileShapes of 0 turns
+// it off. cullStats counts the tiles and shapes listed.
+layout(location = 7) uniform int maxTileShapes;
+layout(location = 8) uniform bool cullPrePass;
+layout(std430, binding = 10) buffer tileListBuffer {int tileLists[];};
+layout(std430, binding = 11) buffer cullStatsBuffer {
+    uint culledTiles;
+    uint tileShapes;
+    uint emptyTiles;
+    uint overflowTiles;
+};
+
+// Lighting. With lights in the scene, each work group lists the lights whose radius reaches the box
+// around its pixels' contacts, and its pixels are shaded against that list only, with soft shadows
+// marched toward each light. Without lights, shapes keep their flat colors.
+layout(location = 9) uniform int lightCount;
+
+// Signed distance grids of meshes, in cells, side by side (see raycekar.mesh)
+layout(binding = 2) uniform sampler3D meshAtlas;
+
 
 #define pi 3.1415926535897932384626
 
@@ -30,12 +102,46 @@ layout(std430, binding = 6) buffer shapeContactsBuffer      {int contacts[];};
 // Shape IDs
 # define idSphere 1
 # define idBox 2
+# define idMesh 4
+# define idInstances 5
+#define instanceRecordSize 8
+
+// Light IDs
+# define idPointLight 3
+#define lightRecordSize 12
+#define maxTileLights 64
+
+#define bvhStackSize 32
+
+const vec4 skyColor = vec4(0.5, 0, 0.5, 1);    // This purple color - distance limit exceeded
+
+// Limits of the march
+const float dstMax = 7;
+const int maxSteps = 200;
+const float thres = 0.01;
+const float focalLength = 0.1;      // Distance from focal point to lens
+
+// Lighting
+const float ambientLight = 0.15;
+const float shadowSharpness = 16;   // Higher gives harder shadow edges
+const int maxShadowSteps = 64;
+
+// Shape types this program handles (HAS_<TYPE>), and for programs specialized to one scene its
+// shape count (SCENE_SHAPE_COUNT) and whether its shapes are unrolled (SCENE_UNROLLED). Made by gl.
+@{SPECIALIZATION}
+
+#ifdef SCENE_SHAPE_COUNT
+#define SHAPE_COUNT SCENE_SHAPE_COUNT
+#else
+#define SHAPE_COUNT shapeCount
+#endif
 
 struct _contact {
     vec4 color;
     int id;
     vec3 pos;
     float dst;
+    int instance;   // Of an instance group, -1 for other shapes
 };
 
 
@@ -86,6 +192,13 @@ vec3 multiplyqv(quat q, vec3 v)
     return vec3(resultQuat.ni, resultQuat.nj, resultQuat.nk);
 }
 
+// multiplyqv for unit quaternions, without building the products
+vec3 rotateUnitqv(quat q, vec3 v)
+{
+    vec3 t = 2 * cross(q.yzw, v);
+    return v + q.n * t + cross(q.yzw, t);
+}
+
 
 //// SDFs ////
 float sdfSphere(vec3 ray, vec3 pos, float radius)
@@ -122,77 +235,345 @@ vec4 cfBox()
     return vec4(0.2, 0.2, 1, 1);
 }
 
-_contact resolvePixel(vec3 rayPos, vec3 rayDir)
+vec4 cfMesh()
 {
-    float dstScene;
-    float dstTotal = 0;
-    float dstMax = 7;
-    int maxSteps = 200;
-    float thres = 0.01;
-    vec4 color = vec4(0.2, 0.2, 0.7, 1);    // Kind of a sky blue - steps limit exceeded
-    int contactID = -1;
+    return vec4(0.8, 0.8, 0.8, 1);
+}
+
+//// Scene distance ////
+// SDFs of shapes as stored in shapeFloats from floatPtr on
+#ifdef HAS_SPHERE
+float sdfSphereRecord(vec3 rayPos, int floatPtr)
+{
+    return sdfSphere(
+        rayPos,
+        // pos
+        vec3(
+            shapeFloats[floatPtr],
+            shapeFloats[floatPtr + 1],
+            shapeFloats[floatPtr + 2]
+        ),
+        // radius
+        shapeFloats[floatPtr + 3]
+    );
+}
+#endif
 
-    for (int i=0; i < maxSteps; i++)
+#ifdef HAS_BOX
+float sdfBoxRecord(vec3 rayPos, int floatPtr)
+{
+    return sdfBox(
+        rayPos,
+        // pos
+        vec3(
+            shapeFloats[floatPtr],
+            shapeFloats[floatPtr + 1],
+            shapeFloats[floatPtr + 2]
+        ),
+        // rot
+        quat(
+            shapeFloats[floatPtr + 4],
+            shapeFloats[floatPtr + 5],
+            shapeFloats[floatPtr + 6],
+            shapeFloats[floatPtr + 7]
+        ),
+        // dimensions
+        vec3(
+            shapeFloats[floatPtr + 8],
+            shapeFloats[floatPtr + 9],
+            shapeFloats[floatPtr + 10]
+        )
+    );
+}
+#endif
+
+#ifdef HAS_MESH
+// Trilinear in the grid, and outside it no more than the distance to it allows
+float sdfMeshRecord(vec3 rayPos, int floatPtr)
+{
+    vec3 pos = vec3(shapeFloats[floatPtr], shapeFloats[floatPtr + 1], shapeFloats[floatPtr + 2]);
+    float scale = shapeFloats[floatPtr + 3];
+    quat rot = normalize(quat(shapeFloats[floatPtr + 4], shapeFloats[floatPtr + 5], shapeFloats[floatPtr + 6], shapeFloats[floatPtr + 7]));
+    vec3 gridLo = vec3(shapeFloats[floatPtr + 8], shapeFloats[floatPtr + 9], shapeFloats[floatPtr + 10]);
+    float cellSize = shapeFloats[floatPtr + 11];
+    vec3 gridSize = vec3(shapeFloats[floatPtr + 12], shapeFloats[floatPtr + 13], shapeFloats[floatPtr + 14]);
+    vec3 atlasOrigin = vec3(shapeFloats[floatPtr + 15], shapeFloats[floatPtr + 16], shapeFloats[floatPtr + 17]);
+
+    vec3 cell = (multiplyqv(conjugateq(rot), rayPos - pos) / scale - gridLo) / cellSize;
+    vec3 clamped = clamp(cell, vec3(0), gridSize - 1);
+    float outside = distance(cell, clamped);
+    float inside = texture(meshAtlas, (atlasOrigin + clamped + 0.5) / vec3(textureSize(meshAtlas, 0))).r;
+    if (outside > 0) inside = max(outside, inside - outside);    // The padding keeps the mesh inside the grid
+    return inside * cellSize * scale;
+}
+#endif
+
+float sdfShape(vec3 rayPos, int shapeType, int floatPtr, float dstMax)
+{
+    switch (shapeType)
     {
-        // Walk the buffers and render conditionally
-        int intPtr = 0;
-        int floatPtr = 8;
-        float dstScene = dstMax;
-        
-        for (int id = 1; id < shapeTypes.length(); id++)
+#ifdef HAS_SPHERE
+        case idSphere: return sdfSphereRecord(rayPos, floatPtr);
+#endif
+#ifdef HAS_BOX
+        case idBox: return sdfBoxRecord(rayPos, floatPtr);
+#endif
+#ifdef HAS_MESH
+        case idMesh: return sdfMeshRecord(rayPos, floatPtr);
+#endif
+        default: break;
+    }
+    return dstMax;
+}
+
+#ifdef HAS_INSTANCES
+// Instance groups (see env.instances). From intPtr, shapeInts holds the part count, instance count,
+// offset of the instance records and first contact number, then each part's type and offset;
+// offsets are from floatPtr. An instance record is its position, scale and inverse rotation.
+float sdfInstance(vec3 rayPos, _shapeHeader header, int instance)
+{
+    int instancePtr = header.floatPtr + shapeInts[header.intPtr + 2] + instance * instanceRecordSize;
+    vec3 pos = vec3(shapeFloats[instancePtr], shapeFloats[instancePtr + 1], shapeFloats[instancePtr + 2]);
+    float scale = shapeFloats[instancePtr + 3];
+    quat inverseRot = quat(shapeFloats[instancePtr + 4], shapeFloats[instancePtr + 5], shapeFloats[instancePtr + 6], shapeFloats[instancePtr + 7]);
+    vec3 rayRel = rotateUnitqv(inverseRot, rayPos - pos) / scale;
+
+    // The union of the prototype's parts
+    float dst = dstMax;
+    int partCount = shapeInts[header.intPtr];
+    for (int i = 0; i < partCount; i++)
+    {
+        int part = header.intPtr + 4 + 2 * i;
+        dst = min(dst, sdfShape(rayRel, shapeInts[part], header.floatPtr + shapeInts[part + 1], dstMax));
+    }
+    return dst * scale;
+}
+
+// Lowest instance of a group within thres, or the nearest if none is, like dstSceneLinear. The
+// BVH holds each instance as a leaf and breaks ties on (slot, instance), so it picks the same one.
+float sdfInstances(vec3 rayPos, _shapeHeader header, out int nearestInstance)
+{
+    float dst = dstMax;
+    nearestInstance = -1;
+    int count = shapeInts[header.intPtr + 1];
+    for (int i = 0; i < count; i++)
+    {
+        float dstInstance = sdfInstance(rayPos, header, i);
+        if (dstInstance < dst)
         {
-            switch (shapeTypes[id])
-            {
-                case idSphere:
-                    float dstSphere = sdfSphere(
-                        rayPos,
-                        // pos
-                        vec3(
-                            shapeFloats[floatPtr],
-                            shapeFloats[floatPtr + 1],
-                            shapeFloats[floatPtr + 2]
-                        ),
-                        // radius
-                        shapeFloats[floatPtr + 3]
-                    );
-                    floatPtr += 4;
-                    dstScene = min(dstScene, dstSphere);
-                    break;
-
-                case idBox:
-                    float dstBox = sdfBox(
-                        rayPos,
-                        // pos
-                        vec3(
-                            shapeFloats[floatPtr],
-                            shapeFloats[floatPtr + 1],
-                            shapeFloats[floatPtr + 2]
-                        ),
-                        // rot
-                        quat(
-                            shapeFloats[floatPtr + 4],
-                            shapeFloats[floatPtr + 5],
-                            shapeFloats[floatPtr + 6],
-                            shapeFloats[floatPtr + 7]
-                        ),
-                        // dimensions
-                        vec3(
-                            shapeFloats[floatPtr + 8],
-                            shapeFloats[floatPtr + 9],
-                            shapeFloats[floatPtr + 10]
-                        )
-                    );
-                    floatPtr += 12;
-                    dstScene = min(dstScene, dstBox);
-                    break;
-            }
+            dst = dstInstance;
+            nearestInstance = i;
+            if (dst <= thres) break;
+        }
+    }
+    return dst;
+}
+#endif
+
+// Distance to the shape in slot id, and for an instance group which of its instances is nearest
+float sdfSlot(vec3 rayPos, int id, out int instance)
+{
+    _shapeHeader header = shapeHeaders[id];
+    instance = -1;
+#ifdef HAS_INSTANCES
+    if (header.type == idInstances) return sdfInstances(rayPos, header, instance);
+#endif
+    return sdfShape(rayPos, header.type, header.floatPtr, dstMax);
+}
+
+// Distance to the shape in slot id, or to one of its instances if instance isn't -1
+float sdfContact(vec3 rayPos, int id, int instance)
+{
+    _shapeHeader header = shapeHeaders[id];
+#ifdef HAS_INSTANCES
+    if (instance >= 0) return sdfInstance(rayPos, header, instance);
+#endif
+    return sdfShape(rayPos, header.type, header.floatPtr, dstMax);
+}
+
+// Distance from rayPos to an AABB, 0 inside it. Never more than the SDF of anything inside.
+float dstAABB(vec3 rayPos, vec3 lo, vec3 hi)
+{
+    return length(max(max(lo - rayPos, rayPos - hi), vec3(0)));
+}
+
+// Bounding spheres (center, radius) of shapes as stored in shapeFloats from floatPtr on
+vec4 boundShape(int shapeType, int floatPtr)
+{
+    vec3 pos = vec3(shapeFloats[floatPtr], shapeFloats[floatPtr + 1], shapeFloats[floatPtr + 2]);
+    switch (shapeType)
+    {
+#ifdef HAS_SPHERE
+        case idSphere: return vec4(pos, shapeFloats[floatPtr + 3]);
+#endif
+#ifdef HAS_BOX
+        case idBox: return vec4(pos, 0.5 * length(vec3(shapeFloats[floatPtr + 8], shapeFloats[floatPtr + 9], shapeFloats[floatPtr + 10])));
+#endif
+#ifdef HAS_INSTANCES
+        case idInstances: return vec4(pos, shapeFloats[floatPtr + 3]);    // Kept by env
+#endif
+#ifdef HAS_MESH
+        case idMesh:
+        {
+            // Around the grid's box
+            float scale = shapeFloats[floatPtr + 3];
+            quat rot = normalize(quat(shapeFloats[floatPtr + 4], shapeFloats[floatPtr + 5], shapeFloats[floatPtr + 6], shapeFloats[floatPtr + 7]));
+            vec3 halfSize = (vec3(shapeFloats[floatPtr + 12], shapeFloats[floatPtr + 13], shapeFloats[floatPtr + 14]) - 1) * shapeFloats[floatPtr + 11] * 0.5;
+            vec3 center = vec3(shapeFloats[floatPtr + 8], shapeFloats[floatPtr + 9], shapeFloats[floatPtr + 10]) + halfSize;
+            return vec4(pos + multiplyqv(rot, center * scale), length(halfSize) * abs(scale));
+        }
+#endif
+        default: break;
+    }
+    return vec4(pos, 1e30);     // Unknown, so everywhere
+}
+
+// Check every shape and take the nearest, stopping early at a contact
+#define SHAPE_STEP(id, sdf) dstShape = sdf; if (dstShape < dstScene) {dstScene = dstShape; nearestID = id; if (dstScene <= thres) return dstScene;}
+
+float dstSceneLinear(vec3 rayPos, float dstMax, float thres, out int nearestID, out int nearestInstance)
+{
+    float dstScene = dstMax;
+    nearestID = -1;
+    nearestInstance = -1;
+
+#ifdef SCENE_UNROLLED
+    // SHAPE_STEP(id, sdf<Type>Record(rayPos, floatPtr)) for every shape in the scene
+    float dstShape;
+@{SCENE_SHAPES}
+#else
+    for (int id = 1; id < SHAPE_COUNT; id++)
+    {
+        int instance;
+        float dstShape = sdfSlot(rayPos, id, instance);
+        if (dstShape < dstScene)
+        {
+            dstScene = dstShape;
+            nearestID = id;
+            nearestInstance = instance;
+            if (dstScene <= thres) break;
+        }
+    }
+#endif
+    return dstScene;
+}
+
+// The same shape as dstSceneLinear through the BVH: the lowest (slot, instance) within thres if
+// there is one, otherwise the nearest. Until something is within thres, nodes further away than
+// the nearest shape so far are skipped; after that, nodes further away than thres.
+float dstSceneBVH(vec3 rayPos, float dstMax, out int nearestID, out int nearestInstance)
+{
+    int stack[bvhStackSize];
+    int stackTop = 0;
+    stack[stackTop++] = 0;
+    float dstScene = dstMax;
+    nearestID = -1;
+    nearestInstance = -1;
+    bool contact = false;
+
+    while (stackTop > 0)
+    {
+        _bvhNode node = bvhNodes[stack[--stackTop]];
+        float dstNode = dstAABB(rayPos, node.lo, node.hi);
+        if (contact ? dstNode > thres : dstNode >= dstScene) continue;
 
-            if (dstScene <= thres)
+        if (node.left < 0)
+        {
+            int id = -node.left;
+            int instance = node.right;
+            float dstShape = sdfContact(rayPos, id, instance);
+            bool lower = id < nearestID || (id == nearestID && instance < nearestInstance);
+            if (contact ? dstShape <= thres && lower : dstShape < dstScene)
             {
-                contactID = id;
-                break;
+                dstScene = dstShape;
+                nearestID = id;
+                nearestInstance = instance;
+                contact = dstScene <= thres;
             }
         }
+        else if (stackTop + 2 <= bvhStackSize)
+        {
+            // Push the nearer child last so it is visited first and tightens dstScene sooner
+            _bvhNode left = bvhNodes[node.left];
+            _bvhNode right = bvhNodes[node.right];
+            bool leftFirst = dstAABB(rayPos, left.lo, left.hi) <= dstAABB(rayPos, right.lo, right.hi);
+            stack[stackTop++] = leftFirst ? node.right : node.left;
+            stack[stackTop++] = leftFirst ? node.left : node.right;
+        }
+    }
+    return dstScene;
+}
+
+// Like dstSceneLinear, for the shapes of the tile list at tileList
+float dstSceneTile(vec3 rayPos, int tileList, out int nearestID, out int nearestInstance)
+{
+    float dstScene = dstMax;
+    nearestID = -1;
+    nearestInstance = -1;
+
+    int count = tileLists[tileList];
+    for (int i = 1; i <= count; i++)
+    {
+        int id = tileLists[tileList + i];
+        int instance;
+        float dstShape = sdfSlot(rayPos, id, instance);
+        if (dstShape < dstScene)
+        {
+            dstScene = dstShape;
+            nearestID = id;
+            nearestInstance = instance;
+            if (dstScene <= thres) break;
+        }
+    }
+    return dstScene;
+}
+
+// Distance to the nearest shape, of the tile list at tileList if it isn't -1, otherwise through
+// the BVH if there is one
+float dstSceneAt(vec3 rayPos, int tileList, out int nearestID, out int nearestInstance)
+{
+    if (tileList >= 0) return dstSceneTile(rayPos, tileList, nearestID, nearestInstance);
+    else if (bvhNodeCount > 0) return dstSceneBVH(rayPos, dstMax, nearestID, nearestInstance);
+    else return dstSceneLinear(rayPos, dstMax, thres, nearestID, nearestInstance);
+}
+
+// Direction of the camera ray through a point on the sensor, in pixels from its corner
+vec3 cameraRay(vec2 sensorPos, ivec2 resolution)
+{
+    quat cameraRot = quat(shapeFloats[4], shapeFloats[5], shapeFloats[6], shapeFloats[7]);
+    float fov = shapeFloats[3];     // Field of view (horizontal)
+
+    // pixelSize is calculated from fov, focalLength, and resolution.x
+    // sensorSize is calculated from pixelSize and resolution
+    float pixelSize = (2 * tan(fov * 0.5) * focalLength) / float(resolution.x);   // Size of a pixel in the environment
+    vec2 sensorSize = pixelSize * vec2(resolution);   // Size of the sensor in the environment
+
+    // rayDir is calculated as a position offset, *not* a quaternion
+    vec3 rayDir = normalize(
+        vec3(
+            (sensorPos.x * pixelSize) - (0.5 * sensorSize.x),
+            focalLength,
+            (sensorPos.y * pixelSize) - (0.5 * sensorSize.y)
+        )
+    );
+    return multiplyqv(cameraRot, rayDir);     // Rotate the ray by cameraRot
+}
+
+// March from dstStart along the ray against the shapes of tileList (see dstSceneAt); steps is set
+// to the number of distance evaluations
+_contact resolvePixel(vec3 rayPos, vec3 rayDir, float dstStart, int tileList, out int steps)
+{
+    float dstTotal = dstStart;
+    rayPos += rayDir * dstStart;
+    vec4 color = vec4(0.2, 0.2, 0.7, 1);    // Kind of a sky blue - steps limit exceeded
+    int contactID = -1;
+    int contactInstance = -1;
+
+    for (steps = 0; steps < maxSteps;)
+    {
+        int nearestID, nearestInstance;
+        float dstScene = dstSceneAt(rayPos, tileList, nearestID, nearestInstance);
+        steps++;
 
         dstTotal += dstScene;
         rayPos += rayDir * dstScene;
@@ -200,70 +581,378 @@ _contact resolvePixel(vec3 rayPos, vec3 rayDir)
 
         if (dstScene <= thres)
         {
+            contactID = nearestID;
+            contactInstance = nearestInstance;
             color = vec4(0, 0.8, 0, 1);     // Green - shape contact
             break;
         }
 
         if (dstTotal >= dstMax)
         {
-            color = vec4(0.5, 0, 0.5, 1);   // This purple color - distance limit exceeded
+            color = skyColor;
             break;
         }
     }
 
-    switch (shapeTypes[contactID])
+    if (contactID > 0)
     {
-        case idSphere: color = cfSphere();
-        case idBox: color = cfBox();
+        int colorType = shapeHeaders[contactID].type;
+#ifdef HAS_INSTANCES
+        // Instances take the color of their prototype's first part
+        if (colorType == idInstances) colorType = shapeInts[shapeHeaders[contactID].intPtr + 4];
+#endif
+        switch (colorType)
+        {
+#ifdef HAS_SPHERE
+            case idSphere: color = cfSphere(); break;
+#endif
+#ifdef HAS_BOX
+            case idBox: color = cfBox(); break;
+#endif
+#ifdef HAS_MESH
+            case idMesh: color = cfMesh(); break;
+#endif
+            default: break;
+        }
     }
-    
 
-    return _contact(color, contactID, rayPos, dstTotal);
+    return _contact(color, contactID, rayPos, dstTotal, contactInstance);
+}
+
+
+// Conservative start depth for a tile. Every ray of the tile is within `spread` times the distance
+// travelled of the cone's axis, so where the scene is dstScene away from the axis, all of them have
+// at least dstScene - spread * dstCone to go. The tile is grown by half a pixel for the jitter.
+void coneMarch(ivec2 resolution)
+{
+    ivec2 tile = ivec2(gl_GlobalInvocationID.xy);
+    if (any(greaterThanEqual(tile * coneTileSize, resolution))) return;
+
+    float dstCone = 0;
+    int steps = 0;
+    if (SHAPE_COUNT > 0 && shapeHeaders[0].type == 0)
+    {
+        vec3 cameraPos = vec3(shapeFloats[0], shapeFloats[1], shapeFloats[2]);
+        vec2 lo = vec2(tile * coneTileSize) - 0.5;
+        vec2 hi = vec2(min((tile + 1) * coneTileSize, resolution)) + 0.5;
+        vec3 axis = cameraRay((lo + hi) * 0.5, resolution);
+        // The corners are the furthest rays from the axis
+        float spread = max(
+            max(distance(cameraRay(lo, resolution), axis), distance(cameraRay(hi, resolution), axis)),
+            max(distance(cameraRay(vec2(lo.x, hi.y), resolution), axis), distance(cameraRay(vec2(hi.x, lo.y), resolution), axis))
+        );
+
+        while (steps < maxSteps && dstCone < dstMax)
+        {
+            int nearestID, nearestInstance;
+            float dstClear = dstSceneAt(cameraPos + axis * dstCone, -1, nearestID, nearestInstance) - spread * dstCone;
+            steps++;
+            if (dstClear <= thres) break;
+            dstCone += dstClear;
+        }
+    }
+
+    imageStore(coneDepths, tile, vec4(dstCone));
+    if (countSteps)
+    {
+        atomicAdd(coneSteps, uint(steps));
+        atomicAdd(coneTiles, 1u);
+    }
+}
+
+
+// Start of this work group's tile list
+int tileListStart()
+{
+    return int(gl_WorkGroupID.x + gl_WorkGroupID.y * gl_NumWorkGroups.x) * (maxTileShapes + 1);
+}
+
+// List the shapes whose bounding spheres reach into the frustum of this work group's tile. Each
+// invocation tests one shape of every batch and the first puts the batch's hits in order. Bounds
+// are grown by thres, so a ray only ever comes within thres of shapes on its tile's list, and the
+// tile by half a pixel for the jitter.
+shared bool tileHits[gl_WorkGroupSize.x * gl_WorkGroupSize.y];
+shared int tileCount;
+shared bool tileInstances;  // An instance group reaches into the tile, see cullTile
+
+void cullTile(ivec2 resolution)
+{
+    uint groupSize = gl_WorkGroupSize.x * gl_WorkGroupSize.y;
+    int tileList = tileListStart();
+    bool cameraDefined = SHAPE_COUNT > 0 && shapeHeaders[0].type == 0;
+
+    // Inward normals of the tile frustum's side planes, all through the camera
+    vec3 cameraPos = vec3(0);
+    vec3 planes[4];
+    if (cameraDefined)
+    {
+        cameraPos = vec3(shapeFloats[0], shapeFloats[1], shapeFloats[2]);
+        vec2 lo = vec2(gl_WorkGroupID.xy * gl_WorkGroupSize.xy) - 0.5;
+        vec2 hi = vec2((gl_WorkGroupID.xy + 1) * gl_WorkGroupSize.xy) + 0.5;
+        vec3 axis = cameraRay((lo + hi) * 0.5, resolution);
+        vec3 corners[4] = vec3[4](
+            cameraRay(lo, resolution), cameraRay(vec2(hi.x, lo.y), resolution),
+            cameraRay(hi, resolution), cameraRay(vec2(lo.x, hi.y), resolution)
+        );
+        for (int i = 0; i < 4; i++)
+        {
+            planes[i] = normalize(cross(corners[i], corners[(i + 1) % 4]));
+            if (dot(planes[i], axis) < 0) planes[i] = -planes[i];
+        }
+    }
+
+    if (gl_LocalInvocationIndex == 0)
+    {
+        tileCount = 0;
+        tileInstances = false;
+    }
+    barrier();
+    for (int first = 1; cameraDefined && first < SHAPE_COUNT; first += int(groupSize))
+    {
+        int id = first + int(gl_LocalInvocationIndex);
+        bool hit = id < SHAPE_COUNT;
+        if (hit)
+        {
+            vec4 bound = boundShape(shapeHeaders[id].type, shapeHeaders[id].floatPtr);
+            vec3 rel = bound.xyz - cameraPos;
+            float radius = bound.w + thres;
+            hit = length(rel) - radius < dstMax;
+            for (int i = 0; i < 4; i++) hit = hit && dot(planes[i], rel) > -radius;
+        }
+        tileHits[gl_LocalInvocationIndex] = hit;
+        barrier();
+
+        if (gl_LocalInvocationIndex == 0)
+        {
+            for (int i = 0; i < int(groupSize); i++)
+            {
+                if (!tileHits[i]) continue;
+                if (tileCount < maxTileShapes) tileLists[tileList + 1 + tileCount] = first + i;
+                tileCount++;
+#ifdef HAS_INSTANCES
+                tileInstances = tileInstances || shapeHeaders[first + i].type == idInstances;
+#endif
+            }
+        }
+        barrier();
+    }
+
+    // A tile with an instance group in it is marched through the BVH instead, which holds each
+    // instance, as if its list had overflowed
+    if (gl_LocalInvocationIndex == 0)
+    {
+        bool overflow = tileCount > maxTileShapes || (tileInstances && bvhNodeCount > 0);
+        tileLists[tileList] = overflow ? -1 : tileCount;
+        atomicAdd(culledTiles, 1u);
+        atomicAdd(tileShapes, uint(tileCount));
+        if (tileCount == 0) atomicAdd(emptyTiles, 1u);
+        if (overflow) atomicAdd(overflowTiles, 1u);
+    }
+}
+
+
+//// Lighting ////
+// Surface normal of a shape, or one of its instances, at rayPos, from four samples of its SDF
+vec3 shapeNormal(vec3 rayPos, int id, int instance)
+{
+    const vec2 offset = vec2(1, -1) * 0.0005;
+    return normalize(
+        offset.xyy * sdfContact(rayPos + offset.xyy, id, instance) +
+        offset.yyx * sdfContact(rayPos + offset.yyx, id, instance) +
+        offset.yxy * sdfContact(rayPos + offset.yxy, id, instance) +
+        offset.xxx * sdfContact(rayPos + offset.xxx, id, instance)
+    );
+}
+
+// Share of a light dstLight away along lightDir that reaches rayPos. Shapes the shadow ray passes
+// close to darken it too, by how close they come for how far it has gone, which softens the edges.
+float softShadow(vec3 rayPos, vec3 lightDir, float dstLight, inout int steps)
+{
+    float shade = 1;
+    float dstTotal = 0;
+    for (int i = 0; i < maxShadowSteps && dstTotal < dstLight; i++)
+    {
+        int nearestID, nearestInstance;
+        float dstScene = dstSceneAt(rayPos + lightDir * dstTotal, -1, nearestID, nearestInstance);
+        steps++;
+        if (dstScene <= thres) return 0;
+        if (dstTotal > 0) shade = min(shade, shadowSharpness * dstScene / dstTotal);
+        dstTotal += dstScene;
+    }
+    return clamp(shade, 0, 1);
+}
+
+shared int tileLights[maxTileLights];
+shared int tileLightCount;      // -1 if there were more than maxTileLights
+shared vec3 tileContacts[gl_WorkGroupSize.x * gl_WorkGroupSize.y];
+shared vec3 tileLo;
+shared vec3 tileHi;
+
+// List the lights reaching the box around the contacts of this work group, like cullTile. Every
+// invocation of the group has to call it, with `hit` set if its pixel has a contact at `pos`.
+void listTileLights(bool hit, vec3 pos)
+{
+    uint groupSize = gl_WorkGroupSize.x * gl_WorkGroupSize.y;
+    tileHits[gl_LocalInvocationIndex] = hit;
+    tileContacts[gl_LocalInvocationIndex] = pos;
+    barrier();
+    if (gl_LocalInvocationIndex == 0)
+    {
+        tileLo = vec3(1e30);
+        tileHi = vec3(-1e30);
+        for (int i = 0; i < int(groupSize); i++)
+        {
+            if (!tileHits[i]) continue;
+            tileLo = min(tileLo, tileContacts[i]);
+            tileHi = max(tileHi, tileContacts[i]);
+        }
+        tileLightCount = 0;
+    }
+    barrier();
+
+    bool empty = any(greaterThan(tileLo, tileHi));
+    for (int first = 0; !empty && first < lightCount; first += int(groupSize))
+    {
+        int id = first + int(gl_LocalInvocationIndex);
+        bool reaches = id < lightCount;
+        if (reaches)
+        {
+            int floatPtr = id * lightRecordSize;
+            vec3 lightPos = vec3(lightFloats[floatPtr], lightFloats[floatPtr + 1], lightFloats[floatPtr + 2]);
+            reaches = dstAABB(lightPos, tileLo, tileHi) < lightFloats[floatPtr + 3];
+        }
+        tileHits[gl_LocalInvocationIndex] = reaches;
+        barrier();
+
+        if (gl_LocalInvocationIndex == 0)
+        {
+            for (int i = 0; i < int(groupSize) && tileLightCount >= 0; i++)
+            {
+                if (!tileHits[i]) continue;
+                if (tileLightCount == maxTileLights) tileLightCount = -1;
+                else tileLights[tileLightCount++] = first + i;
+            }
+        }
+        barrier();
+    }
+
+    if (countSteps && gl_LocalInvocationIndex == 0 && !empty)
+    {
+        atomicAdd(shadedTiles, 1u);
+        atomicAdd(shadedTileLights, uint(tileLightCount < 0 ? lightCount : tileLightCount));
+    }
+}
+
+// Light reaching a contact at rayPos with the given normal, from the lights listed for this work
+// group, or all of them if there were too many to list
+vec3 shadeContact(vec3 rayPos, vec3 normal, inout int steps, inout int rays)
+{
+    vec3 light = vec3(ambientLight);
+    int count = tileLightCount < 0 ? lightCount : tileLightCount;
+    for (int i = 0; i < count; i++)
+    {
+        int id = tileLightCount < 0 ? i : tileLights[i];
+        if (lightTypes[id] != idPointLight) continue;
+        int floatPtr = id * lightRecordSize;
+        vec3 toLight = vec3(lightFloats[floatPtr], lightFloats[floatPtr + 1], lightFloats[floatPtr + 2]) - rayPos;
+        float radius = lightFloats[floatPtr + 3];
+        float dstLight = length(toLight);
+        if (dstLight >= radius) continue;
+        vec3 lightDir = toLight / dstLight;
+        float diffuse = dot(normal, lightDir);
+        if (diffuse <= 0) continue;
+
+        // Falls off with the square of the distance, scaled by falloff, and smoothly to 0 at the radius
+        vec3 color = vec3(lightFloats[floatPtr + 4], lightFloats[floatPtr + 5], lightFloats[floatPtr + 6]);
+        float intensity = lightFloats[floatPtr + 7];
+        float falloff = lightFloats[floatPtr + 8];
+        float window = 1 - (dstLight * dstLight) / (radius * radius);
+        float attenuation = intensity * window * window / (1 + falloff * dstLight * dstLight);
+
+        rays++;
+        light += color * diffuse * attenuation * softShadow(rayPos + normal * 2 * thres, lightDir, dstLight, steps);
+    }
+    return light;
 }
 
 
 void main()
 {
-    ivec2 resolution = imageSize(screen);
+    bool adaptive = renderSize.x > 0;
+    ivec2 resolution = adaptive ? renderSize : imageSize(screen);
+    if (conePrePass)
+    {
+        coneMarch(resolution);
+        return;
+    }
+    if (cullPrePass)
+    {
+        cullTile(resolution);
+        return;
+    }
     ivec2 pixel = ivec2(gl_GlobalInvocationID.xy);          // Location of the pixel
+    // Pixels off the screen still take part in lighting, which needs the whole work group
+    bool onScreen = all(lessThan(pixel, resolution));
     
     _contact contact;
+    contact.id = -1;
+    contact.instance = -1;
+    contact.pos = vec3(0);
     vec4 color;
     
-    if (shapeTypes[0] != 0) color = vec4(0.4, 0, 0, 1);     // Dark red - camera not defined
+    if (!onScreen) color = vec4(0);
+    else if (SHAPE_COUNT == 0 || shapeHeaders[0].type != 0) color = vec4(0.4, 0, 0, 1);     // Dark red - camera not defined
     else
     {
         vec3 cameraPos = vec3(shapeFloats[0], shapeFloats[1], shapeFloats[2]);
-        quat cameraRot = quat(shapeFloats[4], shapeFloats[5], shapeFloats[6], shapeFloats[7]);
-
-        vec3 focalPoint = cameraPos;    // Focal point of the camera
-        float focalLength = 0.1;        // Distance from focal point to lens
-        float fov = shapeFloats[3];     // Field of view (horizontal)
-
-        // pixelSize is calculated from fov, focalLength, and resolution.x
-        // sensorSize is calculated from pixelSize and resolution
-        float pixelSize = (2 * tan(fov * 0.5) * focalLength) / float(resolution.x);   // Size of a pixel in the environment
-        vec2 sensorSize = pixelSize * vec2(resolution);   // Size of the sensor in the environment
-
-        // rayPos is calculated to be at the center of each pixel
-        vec3 rayPos = focalPoint;
-        // rayDir is calculated as a position offset, *not* a quaternion
-        vec3 rayDir = normalize(
-            vec3(
-                ((0.5 + float(pixel.x)) * pixelSize) - (0.5 * sensorSize.x),
-                focalLength,
-                ((0.5 + float(pixel.y)) * pixelSize) - (0.5 * sensorSize.y)
-            )
-        );
-        rayDir = multiplyqv(cameraRot, rayDir);     // Rotate the ray by cameraRot
 
-
-        contact = resolvePixel(rayPos, rayDir);
+        // Rays go from the focal point through the center of each pixel
+        vec3 rayPos = cameraPos;
+        vec3 rayDir = cameraRay(vec2(0.5 + jitter.x + float(pixel.x), 0.5 + jitter.y + float(pixel.y)), resolution);
+        float dstStart = coneTileSize > 0 ? imageLoad(coneDepths, pixel / coneTileSize).x : 0;
+        int tileList = maxTileShapes > 0 && tileLists[tileListStart()] >= 0 ? tileListStart() : -1;
+
+        int steps = 0;
+        // Nothing reaches into the tile, so there is nothing to march against
+        if (tileList >= 0 && tileLists[tileList] == 0) contact = _contact(skyColor, -1, rayPos + rayDir * dstMax, dstMax, -1);
+        else contact = resolvePixel(rayPos, rayDir, dstStart, tileList, steps);
+        if (countSteps)
+        {
+            atomicAdd(marchSteps, uint(steps));
+            atomicAdd(marchRays, 1u);
+        }
         color = contact.color;
 
     }
 
-    // Final drawing of pixel and data export
+    if (lightCount > 0)
+    {
+        listTileLights(contact.id > 0, contact.pos);
+        if (contact.id > 0)
+        {
+            // Shade on the surface itself, wherever within thres of it the march stopped
+            vec3 normal = shapeNormal(contact.pos, contact.id, contact.instance);
+            vec3 surfacePos = contact.pos - normal * sdfContact(contact.pos, contact.id, contact.instance);
+            int steps = 0;
+            int rays = 0;
+            vec3 light = shadeContact(surfacePos, normal, steps, rays);
+            color = vec4(color.xyz * light, color.w);
+            if (countSteps)
+            {
+                atomicAdd(shadowSteps, uint(steps));
+                atomicAdd(shadowRays, uint(rays));
+            }
+        }
+    }
+    if (!onScreen) return;
+
+    // Final drawing of pixel and data export. Instances are numbered through the scene from -2 down,
+    // see env.scene.instanceAt.
+    int contactID = contact.id;
+#ifdef HAS_INSTANCES
+    if (contact.instance >= 0) contactID = -2 - (shapeInts[shapeHeaders[contact.id].intPtr + 3] + contact.instance);
+#endif
     imageStore(screen, pixel, color);
-    contacts[pixel.x + (pixel.y * resolution.x)] = contact.id;
+    if (adaptive) imageStore(samples, pixel, vec4(contact.pos, float(contactID)));
+    else contacts[pixel.x + (pixel.y * resolution.x)] = contactID;
 }
\ No newline at end of file
@@ -1,55 +1,85 @@
+// Compute shader `renderUI.glsl`
+// This shader is a component of the RayceKar project and is intended to work with its rendering system
+// https://github.com/AwesomeCronk/RayceKar
+
 #version 440 core
-// Compute shader `renderScene.glsl`
+
+
+// One work group per screen tile, taken from uiTiles starting at firstTile. With drawPass set, the
+// widgets listed for each tile are drawn into uiLayer, which keeps them between frames, and their
+// IDs into the contacts; otherwise uiLayer is composited over the screen.
 layout(local_size_x = @{THREAD_GROUP_SIZE_X}, local_size_y = @{THREAD_GROUP_SIZE_Y}) in;
 layout(rgba32f, binding = 0) uniform image2D screen;
-layout(std430, binding = 1) buffer typeStorageBuffer {int widgetTypes[];};
-layout(std430, binding = 2) buffer intStorageBuffer {int widgetInts[];};
-layout(std430, binding = 3) buffer floatStorageBuffer {float widgetFloats[];};
+layout(rgba32f, binding = 1) uniform image2D uiLayer;     // Premultiplied alpha
+layout(binding = 1) uniform sampler2D glyphAtlas;           // Signed distance fields, see font.py
+
+// Matches ui.widgetType; lo and hi are on screen, hi exclusive
+struct _widget {
+    ivec2 lo;
+    ivec2 hi;
+    vec4 color;
+    vec4 atlas;     // Glyphs: texel offset xy, texels per pixel, spread
+    int type;
+    int id;
+    ivec2 pad;
+};
+layout(std430, binding = 8) buffer uiContactsBuffer         {int contacts[];};
+layout(std430, binding = 12) buffer widgetStorageBuffer     {_widget widgets[];};
+layout(std430, binding = 13) buffer uiTileStorageBuffer     {ivec4 uiTiles[];};    // x, y, start, count
+layout(std430, binding = 14) buffer uiTileWidgetBuffer      {int tileWidgets[];};
+
+layout(location = 0) uniform bool drawPass;
+layout(location = 1) uniform int firstTile;
 
-vec4 blend(vec4 a, vec4 b)
+
+// Premultiplied `top` over `bottom`
+vec4 over(vec4 top, vec4 bottom)
 {
-    return vec4(((a.xyz * a.w) + (b.xyz * b.w)), a.w + b.w);
+    return top + bottom * (1 - top.w);
 }
 
-vec4 clampColor(vec4 raw)
+// Coverage of a pixel by a glyph, from its distance to the outline in pixels
+float glyphCoverage(_widget glyph, ivec2 pixel)
 {
-    if (raw.w > 1) return vec4(raw.xyz / raw.w, 1);
-    else return raw;
+    vec2 texel = glyph.atlas.xy + (vec2(pixel) + 0.5) * glyph.atlas.z;
+    float field = texture(glyphAtlas, texel / vec2(textureSize(glyphAtlas, 0))).r;
+    float dst = (field - 0.5) * 2 * glyph.atlas.w / glyph.atlas.z;
+    return clamp(dst + 0.5, 0, 1);
 }
 
 void main()
 {
     ivec2 resolution = imageSize(screen);
-    ivec2 pixel = ivec2(gl_GlobalInvocationID.xy);  // Location of the pixel
-    vec4 color = vec4(0, 0, 0, 0);                  // Transparent - no widget
+    ivec4 tile = uiTiles[firstTile + int(gl_WorkGroupID.x)];
+    ivec2 pixel = tile.xy * ivec2(gl_WorkGroupSize.xy) + ivec2(gl_LocalInvocationID.xy);   // Location of the pixel
+    if (any(greaterThanEqual(pixel, resolution))) return;
 
-    int intPtr = 0;
-    int floatPtr = 0;
-    for (int i = 0; i < widgetTypes.length(); i++)
+    if (drawPass)
     {
-        ivec2 widgetPos = ivec2(widgetInts[intPtr], widgetInts[intPtr + 1]);
-        ivec2 widgetDim = ivec2(widgetInts[intPtr + 2], widgetInts[intPtr + 3]);
-        if (all(greaterThan(pixel, widgetPos)) && all(lessThan(pixel, widgetPos + widgetDim)))
+        vec4 color = vec4(0, 0, 0, 0);      // Transparent - no widget
+        int contactID = -1;
+        for (int i = tile.z; i < tile.z + tile.w; i++)
         {
-            color = vec4(
-                widgetFloats[floatPtr],
-                widgetFloats[floatPtr + 1],
-                widgetFloats[floatPtr + 2],
-                widgetFloats[floatPtr + 3]
-            );
-            
+            _widget widget = widgets[tileWidgets[i]];
+            if (all(greaterThanEqual(pixel, widget.lo)) && all(lessThan(pixel, widget.hi)))
+            {
+                float alpha = widget.color.w;
+                if (widget.type == 2)
+                {
+                    alpha *= glyphCoverage(widget, pixel);
+                    if (alpha <= 0) continue;
+                }
+                color = over(vec4(widget.color.xyz * alpha, alpha), color);
+                contactID = widget.id;
+            }
         }
-        intPtr += 4;
+        imageStore(uiLayer, pixel, color);
+        contacts[pixel.x + (pixel.y * resolution.x)] = contactID;
     }
-
-    color = clampColor(color);
-    if (color.w == 1)
+    else
     {
-        imageStore(screen, pixel, color);
+        vec4 color = imageLoad(uiLayer, pixel);
+        if (color.w >= 1) imageStore(screen, pixel, vec4(color.xyz, 1));
+        else if (color.w > 0) imageStore(screen, pixel, over(color, imageLoad(screen, pixel)));
     }
-    else if (color.w > 0)
-    {
-        vec4 original = imageLoad(screen, pixel);
-        imageStore(screen, pixel, clampColor(blend(original, color)));
-    }
-}
\ No newline at end of file
+}
@@ -1,24 +1,25 @@
-import contextlib, logging, glfw, sys, struct
+import contextlib, logging, glfw, math, os, sys
 from dataclasses import dataclass
+import numpy as np
 
 from raycekar import events
-from raycekar.util import loggingHandler
 from raycekar.coord import *
+from raycekar.env import _arena
 
 log = logging.getLogger('rk.ui')
-log.addHandler(loggingHandler)
-log.setLevel(logging.DEBUG)
 
 @dataclass
 class _flags:
     initialized = False
     shouldClose = False
+    headless = False
 
 flags = _flags()
 
 viewportSize = vec2(400, 400)
 needGLVersion = (4, 4)
 window = None
+_eglPlatformSurfaceless = 0x31DD   # EGL_PLATFORM_SURFACELESS_MESA
 
 
 ### Keyboard input ###
@@ -149,6 +150,10 @@ class _keys:
         'LAST':             348
     }
 
+    # keyCode -> keyName, built once. Where codes repeat (LAST) the first name wins.
+    _names = {code: name for name, code in reversed(_map.items())}
+    _bound = {}     # keyCode -> event set by `setEvent`
+
     # keys.keyName -> keyCode: int
     def __getattr__(self, name: str):
         return self._map[name]
@@ -156,32 +161,30 @@ class _keys:
     # keys[keyCode: int] -> keyName: str
     # keys[keyName: str] -> keyCode: int
     def __getitem__(self, index):
-        if isinstance(index, int): return list(self._map.keys())[list(self._map.values()).index(index)]
+        if isinstance(index, int): return self._names[index]
         elif isinstance(index, str): return self._map[index]
 
     def _callback(self, window, keyCode, scanCode, action, modBits):
         # actionNames = {glfw.PRESS: 'press', glfw.REPEAT: 'repeat', glfw.RELEASE: 'release'}
-        # log.debug('keyCallback for "{}" ({})'.format(self[keyCode], actionNames[action]))
-        eventName = 'key_{}'.format(self[keyCode])
-        event = events.getEventByName(eventName)
-        if not event is None:
-            event.fire(args=(action,))
+        # log.debug('keyCallback for "%s" (%s)', self[keyCode], actionNames[action])
+        events.dispatch('key', keyCode, (action,), coalesce=action == glfw.REPEAT)
 
     def setEvent(self, keyCode, function):
-        eventName = 'key_{}'.format(self[keyCode])
-        event = events.getEventByName(eventName)
-        if function is None:
-            if not event is None: event.deactivate()
-
-        else:
-            if event is None:
-                event = events.event(eventName, function)
-            event.activate()
+        # Binds `function` to the key, replacing what the last call bound. More subscribers can be
+        # added with `events.event(name, function, 'key', keyCode).activate()`.
+        if isinstance(keyCode, str): keyCode = self._map[keyCode]
+        bound = self._bound.pop(keyCode, None)
+        if not bound is None: bound.deactivate()
+        if not function is None:
+            bound = events.event('key_{}'.format(self._names[keyCode]), function, 'key', keyCode)
+            bound.activate()
+            self._bound[keyCode] = bound
 
     def pressed(self, keyCode):
         return glfw.get_key(window, keyCode) == glfw.PRESS
 
 keys = _keys()
+events.deviceCodes['key'] = _keys._map
 
 
 ### Mouse input ###
@@ -194,18 +197,22 @@ class _mouse:
     pos = vec2(0, 0)
     mode = 'normal'
 
+    _names = {code: name for name, code in _buttons.items()}
+    _bound = {}     # buttonCode -> event set by `setEvent`
+
     def __getattr__(self, name: str):
         return self._buttons[name]
 
     def __getitem__(self, index):
-        if isinstance(index, int): return list(self._buttons.keys())[list(self._buttons.values()).index(index)]
+        if isinstance(index, int): return self._names[index]
         elif isinstance(index, str): return self._buttons[index]
 
     def _callback(self, window, button, action, modBits):
-        eventName = 'mouse_{}'.format(self[button])
-        event = events.getEventByName(eventName)
-        if not event is None:
-            event.fire(args=(action,))
+        events.dispatch('mouse', button, (action,))
+
+    def _moveCallback(self, window, x, y):
+        # Fires ('cursor', 0) with the position flipped like `pos`
+        events.dispatch('cursor', 0, (vec2(int(x), viewportSize[1] - int(y)),), coalesce=True)
 
     def setMode(self, mode: str):
         if mode == 'normal':
@@ -221,51 +228,356 @@ class _mouse:
     def getMode(self): return self.mode
 
     def setEvent(self, buttonCode, function):
-        eventName = 'mouse_{}'.format(self[buttonCode])
-        event = events.getEventByName(eventName)
-        if function is None:
-            if not event is None: event.deactivate()
-
-        else:
-            if event is None:
-                event = events.event(eventName, function)
-            event.activate()
+        if isinstance(buttonCode, str): buttonCode = self._buttons[buttonCode]
+        bound = self._bound.pop(buttonCode, None)
+        if not bound is None: bound.deactivate()
+        if not function is None:
+            bound = events.event('mouse_{}'.format(self._names[buttonCode]), function, 'mouse', buttonCode)
+            bound.activate()
+            self._bound[buttonCode] = bound
+
+    def setMoveEvent(self, function):
+        # `function(pos: vec2)` on cursor movement, replacing what the last call bound
+        bound = self._bound.pop('move', None)
+        if not bound is None: bound.deactivate()
+        if not function is None:
+            bound = events.event('mouse_MOVE', function, 'cursor', 0)
+            bound.activate()
+            self._bound['move'] = bound
 
     def pressed(self, buttonCode):
         return glfw.get_mouse_button(window, buttonCode) == glfw.PRESS
 
 mouse = _mouse()
+events.deviceCodes['mouse'] = _mouse._buttons
 
 
 ### UI functions ###
+# Widgets live in a retained tree under a `layer`. Each widget has a fixed size record in the
+# layer's arena, rewritten when it changes, and gl.compileUI uploads only the changed records. The
+# layer also keeps, for every screen tile (one work group of renderUI.glsl) that widgets reach into,
+# the list of those widgets in draw order, rebuilt only when widgets move, resize, or are added or
+# removed. Only the tiles under changed widgets are redrawn into a cached layer texture, and only
+# tiles with widgets are composited over the scene, so UI cost follows widget area. Text widgets
+# also own a run of glyph records right after each other, rewritten when the text changes.
+
+# Matches `_widget` in renderUI.glsl. For glyphs, `atlas` maps screen pixels to atlas texels
+# (offset x, offset y, texels per pixel) and holds the atlas spread.
+widgetType = np.dtype([
+    ('lo', np.int32, 2), ('hi', np.int32, 2), ('color', np.float32, 4), ('atlas', np.float32, 4),
+    ('type', np.int32), ('id', np.int32), ('pad', np.int32, 2)
+])
+
 class widget:
+    # `pos` is relative to the parent widget, or the screen for top level widgets. Children draw
+    # over their parent and earlier siblings.
     typeID = 0
+    _layer = None
+    _slot = None
+    _run = None     # (start, capacity) of the glyph records in the layer, if any
+
     def __init__(self, pos: vec2, dim: vec2, color: vec4):
-        self.pos = pos
-        self.dim = dim
-        self.color = color
+        self.parent = None
+        self.children = []
+        self._pos = pos
+        self._dim = dim
+        self._color = color
+
+    @property
+    def pos(self): return self._pos
+
+    @pos.setter
+    def pos(self, value: vec2):
+        self._pos = value
+        if not self._layer is None: self._layer._write(self, geometry=True)
+
+    @property
+    def dim(self): return self._dim
+
+    @dim.setter
+    def dim(self, value: vec2):
+        self._dim = value
+        if not self._layer is None: self._layer._write(self, geometry=True)
+
+    @property
+    def color(self): return self._color
+
+    @color.setter
+    def color(self, value: vec4):
+        self._color = value
+        if not self._layer is None: self._layer._write(self, geometry=False)
+
+    @property
+    def screenPos(self):
+        if self.parent is None: return vec2(*self._pos)
+        return self.parent.screenPos + self._pos
 
     def move(self, newPos: vec2):
         self.pos = newPos
 
+    def resize(self, newDim: vec2):
+        self.dim = newDim
+
+    def setColor(self, newColor: vec4):
+        self.color = newColor
+
+    def add(self, child):
+        assert child.parent is None and child._layer is None
+        if not self._layer is None: self._layer._checkFont(child)
+        child.parent = self
+        self.children.append(child)
+        if not self._layer is None: self._layer._attach(child)
+        return child
+
+    def remove(self, child):
+        if not self._layer is None: self._layer._detach(child)
+        self.children.remove(child)
+        child.parent = None
+
+    def _subtree(self):
+        yield self
+        for child in self.children: yield from child._subtree()
+
     def compileBufferData(self):
-        typeData = struct.pack(
-            'i', self.typeID
-        )
-        intData = struct.pack(
-            'iiii',
-            *self.pos,
-            *self.dim
-        )
-        floatData = struct.pack(
-            'ffff',
-            *self.color
-        )
-        return typeData, intData, floatData
+        # Record for widgetType, on screen
+        lo = self.screenPos
+        return (tuple(lo), tuple(lo + self._dim), tuple(self._color), (0, 0, 0, 0), self.typeID, self._slot, (0, 0))
+
+    def _glyphRecords(self):
+        # widgetType records drawn right after the widget, None for widgets without any
+        return None
+
+class text(widget):
+    # A string drawn from a font.atlas, `size` pixels to the em (the atlas' size by default). `pos`
+    # is the lower left corner of the text box, which is sized to the string; `color` is the text
+    # color. The box itself is transparent but still picks as the widget. Every text widget in a
+    # layer has to use the same atlas.
+    typeID = 1
+    glyphTypeID = 2
+
+    def __init__(self, pos: vec2, string: str, fontAtlas, size=None, color=vec4(1, 1, 1, 1)):
+        self.font = fontAtlas
+        self._size = fontAtlas.size if size is None else size
+        self._string = string
+        super().__init__(pos, vec2(0, 0), color)
+        self._layoutText()
+
+    @property
+    def string(self): return self._string
+
+    @string.setter
+    def string(self, value: str):
+        if value == self._string: return
+        self._string = value
+        self._layoutText()
+        if not self._layer is None: self._layer._write(self, geometry=True)
+
+    def setString(self, newString: str):
+        self.string = newString
+
+    def _layoutText(self):
+        self._cells, self._corners, self._sizes, (width, height) = self.font.layout(self._string, self._size)
+        self._dim = vec2(math.ceil(width), math.ceil(height))
+
+    def compileBufferData(self):
+        lo = self.screenPos
+        return (tuple(lo), tuple(lo + self._dim), (0, 0, 0, 0), (0, 0, 0, 0), self.typeID, self._slot, (0, 0))
+
+    def _glyphRecords(self):
+        # Quads are placed from the top of the box, to the exact pixel; their records cover the
+        # whole pixels they touch
+        records = np.zeros(len(self._cells), widgetType)
+        corners = self._corners + np.array(tuple(self.screenPos + vec2(0, self._dim.y)), np.float32)
+        texelsPerPixel = self.font.size / self._size
+        records['lo'] = np.floor(corners)
+        records['hi'] = np.ceil(corners + self._sizes)
+        records['color'] = tuple(self._color)
+        records['atlas'][:, 0:2] = self._cells[:, 0:2] - corners * texelsPerPixel
+        records['atlas'][:, 2] = texelsPerPixel
+        records['atlas'][:, 3] = self.font.spread
+        records['type'] = self.glyphTypeID
+        records['id'] = self._slot
+        return records
+
+class layer:
+    # Root of a widget tree; draw it with gl.compileUI and gl.paintUI. UI contact IDs are the
+    # widgets' slots in the layer, see `widgetAt`.
+    def __init__(self):
+        self.widgets = []
+        self.widgetData = _arena(widgetType)
+        self._slots = []            # Slot -> widget, None when free
+        self._freeSlots = []
+        self._dirtyRects = []       # (lo, hi) screen rects to redraw, where widgets were and are
+        self._tilesStale = True
+        self._tileLayout = None     # (tileSize, viewportSize) the tiles were made for
+        self._tileKeys = np.empty(0, np.int64)
+        self._tiles = np.empty((0, 4), np.int32)
+        self.font = None            # Atlas of the text widgets
+
+    def add(self, newWidget: widget):
+        assert newWidget.parent is None and newWidget._layer is None
+        self._checkFont(newWidget)
+        self.widgets.append(newWidget)
+        self._attach(newWidget)
+        return newWidget
+
+    def remove(self, oldWidget: widget):
+        if not oldWidget.parent is None: return oldWidget.parent.remove(oldWidget)
+        self._detach(oldWidget)
+        self.widgets.remove(oldWidget)
+
+    def widgetAt(self, id: int):
+        # The widget of a UI contact ID, None for -1
+        return self._slots[id] if 0 <= id < len(self._slots) else None
+
+    def _checkFont(self, root: widget):
+        # Before anything is attached, so a refused widget leaves the layer as it was
+        fonts = {attached.font for attached in root._subtree() if isinstance(attached, text)}
+        assert len(fonts | {self.font} - {None}) <= 1, 'text in a layer must share one font atlas'
+
+    def _attach(self, root: widget):
+        for attached in root._subtree():
+            if self._freeSlots: slot = self._freeSlots.pop()
+            else:
+                slot = self.widgetData.allocate(1)
+                self._slots.append(None)
+            self._slots[slot] = attached
+            attached._layer = self
+            attached._slot = slot
+            if isinstance(attached, text): self.font = attached.font
+            self._write(attached, geometry=False)
+        self._tilesStale = True
+
+    def _clearSlots(self, start: int, stop: int):
+        data = self.widgetData.data
+        self._dirtyRects.append((data['lo'][start:stop].copy(), data['hi'][start:stop].copy()))
+        data[start:stop] = np.zeros((), widgetType)
+        self.widgetData.markDirty(start, stop)
+
+    def _detach(self, root: widget):
+        for detached in root._subtree():
+            slots = [detached._slot]
+            if not detached._run is None:
+                start, capacity = detached._run
+                slots += range(start, start + capacity)
+                self._clearSlots(start, start + capacity)
+                detached._run = None
+            self._clearSlots(detached._slot, detached._slot + 1)
+            for slot in slots: self._slots[slot] = None
+            self._freeSlots += slots
+            detached._layer = None
+            detached._slot = None
+        self._tilesStale = True
+
+    def _write(self, changed: widget, geometry: bool):
+        # Moving or resizing a widget moves its children too
+        for written in (changed._subtree() if geometry else (changed,)):
+            data = self.widgetData.data
+            self._dirtyRects.append((data['lo'][written._slot].copy(), data['hi'][written._slot].copy()))
+            data[written._slot] = written.compileBufferData()
+            self._dirtyRects.append((data['lo'][written._slot].copy(), data['hi'][written._slot].copy()))
+            self.widgetData.markDirty(written._slot, written._slot + 1)
+            records = written._glyphRecords()
+            if not records is None: self._writeRun(written, records)
+        if geometry: self._tilesStale = True
+
+    def _writeRun(self, owner: widget, records):
+        # Glyph records go in a run of slots kept for the widget, only as much of it as they or the
+        # last records used. Runs that get too small move to the end of the arena, twice as big.
+        if owner._run is None or owner._run[1] < len(records):
+            if not owner._run is None:
+                start, capacity = owner._run
+                self._clearSlots(start, start + capacity)
+                self._freeSlots += range(start, start + capacity)
+                for slot in range(start, start + capacity): self._slots[slot] = None
+            capacity = max(8, 1 << (len(records) - 1).bit_length())
+            start = self.widgetData.allocate(capacity)
+            self._slots += [None] * (start + capacity - len(self._slots))
+            self._slots[start:start + capacity] = [owner] * capacity
+            owner._run = (start, capacity)
+            owner._glyphCount = 0
+            self._tilesStale = True
+
+        start = owner._run[0]
+        stop = start + max(len(records), owner._glyphCount)
+        data = self.widgetData.data
+        self._dirtyRects.append((data['lo'][start:stop].copy(), data['hi'][start:stop].copy()))
+        data[start:stop] = np.zeros((), widgetType)
+        data[start:start + len(records)] = records
+        self._dirtyRects.append((records['lo'], records['hi']))
+        self.widgetData.markDirty(start, stop)
+        owner._glyphCount = len(records)
+
+    def _drawOrder(self):
+        slots = []
+        for root in self.widgets:
+            for drawn in root._subtree():
+                slots.append(drawn._slot)
+                if not drawn._run is None: slots += range(drawn._run[0], drawn._run[0] + drawn._glyphCount)
+        return np.array(slots, np.intp)
+
+    def compileTiles(self, tileSize: vec2, viewportSize: vec2, redraw=False):
+        # Returns (tiles, tileWidgets, dirtyTiles) for renderUI.glsl. tiles are (x, y, start, count)
+        # rows of the tiles widgets reach into, in tile order, each with the widgets from `start`
+        # in tileWidgets; tiles and tileWidgets are None when unchanged since the last call.
+        # dirtyTiles are the tiles to redraw (all of them with `redraw`), in the same layout, count
+        # 0 for tiles that no longer have widgets.
+        tilesX = -(-viewportSize.x // tileSize.x)
+        tiles = tileWidgets = None
+        if self._tilesStale or self._tileLayout != (tuple(tileSize), tuple(viewportSize)):
+            order = self._drawOrder()
+            records = self.widgetData.data[order]
+            keys, owners = _coveredTiles(records['lo'], records['hi'], tileSize, viewportSize)
+            sort = np.argsort(keys, kind='stable')    # Stable, so each tile keeps the draw order
+            self._tileKeys, starts, counts = np.unique(keys[sort], return_index=True, return_counts=True)
+            self._tiles = np.stack([self._tileKeys % tilesX, self._tileKeys // tilesX, starts, counts], axis=1).astype(np.int32)
+            self._tilesStale = False
+            self._tileLayout = (tuple(tileSize), tuple(viewportSize))
+            tiles, tileWidgets = self._tiles, order[owners[sort]].astype(np.int32)
+
+        if redraw: dirtyTiles = self._tiles
+        elif self._dirtyRects:
+            los, his = (np.concatenate([np.reshape(corner, (-1, 2)) for corner in corners]) for corners in zip(*self._dirtyRects))
+            keys = np.unique(_coveredTiles(los, his, tileSize, viewportSize)[0])
+            found = np.minimum(np.searchsorted(self._tileKeys, keys), max(len(self._tileKeys) - 1, 0))
+            occupied = self._tileKeys[found] == keys if len(self._tileKeys) else np.zeros(len(keys), bool)
+            dirtyTiles = np.stack([keys % tilesX, keys // tilesX, np.zeros_like(keys), np.zeros_like(keys)], axis=1).astype(np.int32)
+            dirtyTiles[occupied] = self._tiles[found[occupied]]
+        else: dirtyTiles = np.empty((0, 4), np.int32)
+        self._dirtyRects = []
+        return tiles, tileWidgets, dirtyTiles
+
+def _coveredTiles(los, his, tileSize: vec2, viewportSize: vec2):
+    # Tile keys (x + tilesX * y) under each on-screen (lo, hi) rect, and the index of the rect each came from
+    los = np.clip(los, 0, tuple(viewportSize))
+    his = np.clip(his, 0, tuple(viewportSize))
+    tileSize = np.array(tuple(tileSize))
+    firsts = los // tileSize
+    spans = np.where(np.all(his > los, axis=1)[:, None], (his - 1) // tileSize - firsts + 1, 0)
+    counts = spans[:, 0] * spans[:, 1]
+    owners = np.repeat(np.arange(len(los)), counts)
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    xs = firsts[owners, 0] + within % np.maximum(spans[owners, 0], 1)
+    ys = firsts[owners, 1] + within // np.maximum(spans[owners, 0], 1)
+    return ys.astype(np.int64) * -(-viewportSize.x // tileSize[0]) + xs, owners
 
 
 ### GLFW management ###
-def initialize():
+def initialize(headless=None):
+    # Headless mode skips GLFW entirely and `createWindow` makes a surfaceless EGL context instead,
+    # so rendering works without a display (e.g. Mesa llvmpipe on a build machine). It defaults to
+    # the RAYCEKAR_HEADLESS environment variable, which also has to be set before raycekar is
+    # imported so PyOpenGL loads its EGL platform.
+    if headless is None: headless = bool(os.environ.get('RAYCEKAR_HEADLESS'))
+    flags.headless = headless
+    if headless:
+        log.info('Initializing headless EGL')
+        if os.environ.get('PYOPENGL_PLATFORM') != 'egl':
+            log.error('Headless mode needs RAYCEKAR_HEADLESS=1 set before importing raycekar')
+            sys.exit(1)
+        flags.initialized = True
+        return
+
     log.info('Initializing GLFW')
     flags.initialized = glfw.init()
     if not flags.initialized:
@@ -273,17 +585,60 @@ def initialize():
         sys.exit(1)
 
 @contextlib.contextmanager
-def createWindow(title, size):
+def _createHeadlessContext(size):
+    global viewportSize
+    from OpenGL import EGL
+    display = None
+    try:
+        viewportSize = size
+        log.info('Requiring OpenGL %s.%s core or higher', *needGLVersion)
+        try:
+            display = EGL.eglGetPlatformDisplayEXT(_eglPlatformSurfaceless, EGL.EGL_DEFAULT_DISPLAY, None)
+            major, minor = EGL.EGLint(), EGL.EGLint()
+            EGL.eglInitialize(display, major, minor)
+            EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+
+            config = EGL.EGLConfig()
+            configCount = EGL.EGLint()
+            configAttribs = (EGL.EGLint * 3)(EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT, EGL.EGL_NONE)
+            EGL.eglChooseConfig(display, configAttribs, config, 1, configCount)
+            contextAttribs = (EGL.EGLint * 7)(
+                EGL.EGL_CONTEXT_MAJOR_VERSION, needGLVersion[0],
+                EGL.EGL_CONTEXT_MINOR_VERSION, needGLVersion[1],
+                EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK, EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT,
+                EGL.EGL_NONE
+            )
+            context = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT, contextAttribs)
+            EGL.eglMakeCurrent(display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, context)
+        except Exception as error:
+            log.error('Failed to create headless EGL context: %s', error)
+            sys.exit(1)
+
+        yield
+
+    finally:
+        log.info('Terminating EGL')
+        if not display is None:
+            EGL.eglMakeCurrent(display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+            EGL.eglTerminate(display)
+
+@contextlib.contextmanager
+def createWindow(title, size, visible=True):
     global window, viewportSize
+    if flags.headless:
+        with _createHeadlessContext(size): yield
+        return
+
     try:
         viewportSize = size
-        log.info('Requiring OpenGL {}.{} core or higher'.format(*needGLVersion))
+        log.info('Requiring OpenGL %s.%s core or higher', *needGLVersion)
         glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, needGLVersion[0])
         glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, needGLVersion[1])
         glfw.window_hint(glfw.OPENGL_FORWARD_COMPAT, True)
         glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
         glfw.window_hint(glfw.DOUBLEBUFFER, False)
         glfw.window_hint(glfw.RESIZABLE, False)
+        glfw.window_hint(glfw.VISIBLE, visible)
         
         window = glfw.create_window(*viewportSize, title, None, None)
         if not window: log.error('Failed to open GLFW window'); sys.exit(1)
@@ -291,6 +646,7 @@ def createWindow(title, size):
         
         glfw.set_key_callback(window, keys._callback)
         glfw.set_mouse_button_callback(window, mouse._callback)
+        glfw.set_cursor_pos_callback(window, mouse._moveCallback)
         
         yield
 
@@ -299,9 +655,12 @@ def createWindow(title, size):
         glfw.terminate()
 
 def closeWindow():
-    glfw.set_window_should_close(window, True)
+    if flags.headless: flags.shouldClose = True
+    else: glfw.set_window_should_close(window, True)
 
 def updateWindow():
+    if flags.headless: return     # No window or input to service
+
     flags.shouldClose = glfw.window_should_close(window)
     rawMousePos = glfw.get_cursor_pos(window)
     mouse.pos = vec2(int(rawMousePos[0]), viewportSize[1] - int(rawMousePos[1]))   # GLFW puts <0, 0> at upper left; OpenGl, mathematics, and basic sense put it at lower left
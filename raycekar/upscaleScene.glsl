@@ -0,0 +1,114 @@
+// Compute shader `upscaleScene.glsl`
+// This shader is a component of the RayceKar project and is intended to work with its rendering system
+// https://github.com/AwesomeCronk/RayceKar
+
+#version 440 core
+
+
+// Temporal upscaling for adaptive resolution. Each screen pixel takes the nearest sample of the low
+// resolution frame and blends it with the last output, reprojected through the last frame's camera.
+// History is only used where the shape it saw is still nearby and hasn't moved, and is clamped to
+// the colors around the sample so moving shapes don't smear. The jitter moves the samples around from
+// frame to frame, so still images build up to full resolution.
+layout(local_size_x = @{THREAD_GROUP_SIZE_X}, local_size_y = @{THREAD_GROUP_SIZE_Y}) in;
+layout(rgba32f, binding = 0) uniform writeonly image2D screen;
+layout(rgba32f, binding = 1) uniform readonly image2D frame;            // Low resolution colors, in the corner
+layout(rgba32f, binding = 2) uniform readonly image2D samples;          // Their contact positions and IDs
+layout(rgba32f, binding = 3) uniform readonly image2D history;          // Last output
+layout(rgba32f, binding = 4) uniform readonly image2D historySamples;   // Contact positions and IDs behind it
+layout(rgba32f, binding = 5) uniform writeonly image2D nextHistory;
+layout(rgba32f, binding = 6) uniform writeonly image2D nextHistorySamples;
+
+layout(std430, binding = 6) buffer shapeContactsBuffer {int contacts[];};
+
+layout(location = 0) uniform ivec2 renderSize;
+layout(location = 1) uniform vec2 jitter;
+layout(location = 2) uniform vec3 previousCameraPos;
+layout(location = 3) uniform vec4 previousCameraRot;
+layout(location = 4) uniform float previousFov;
+layout(location = 5) uniform bool historyValid;
+layout(location = 6) uniform float frameWeight;     // Share of the new sample in each output pixel
+
+// Aliasing to make quaternions easier to figure out
+#define quat vec4
+#define n  x
+#define ni y
+#define nj z
+#define nk w
+
+#define positionTolerance 0.02  // Of the distance from the camera
+
+
+// Rotate v by the inverse of the unit quaternion q
+vec3 unrotate(quat q, vec3 v)
+{
+    vec3 u = -vec3(q.ni, q.nj, q.nk);
+    return v + 2 * cross(u, cross(u, v) + q.n * v);
+}
+
+// Where a world position was on the screen last frame, in pixels, matching the rays of renderScene.glsl
+vec2 previousPixel(vec3 pos, ivec2 resolution)
+{
+    vec3 rel = unrotate(normalize(previousCameraRot), pos - previousCameraPos);
+    if (rel.y <= 0) return vec2(-1);
+    float pixelsPerUnit = float(resolution.x) / (2 * tan(previousFov * 0.5));
+    return vec2(rel.x, rel.z) / rel.y * pixelsPerUnit + 0.5 * vec2(resolution);
+}
+
+vec4 bilinearHistory(vec2 pos, ivec2 resolution)
+{
+    vec2 corner = pos - 0.5;
+    ivec2 base = ivec2(floor(corner));
+    vec2 t = corner - vec2(base);
+    ivec2 hi = resolution - 1;
+    vec4 bottom = mix(imageLoad(history, clamp(base, ivec2(0), hi)), imageLoad(history, clamp(base + ivec2(1, 0), ivec2(0), hi)), t.x);
+    vec4 top = mix(imageLoad(history, clamp(base + ivec2(0, 1), ivec2(0), hi)), imageLoad(history, clamp(base + ivec2(1, 1), ivec2(0), hi)), t.x);
+    return mix(bottom, top, t.y);
+}
+
+
+void main()
+{
+    ivec2 resolution = imageSize(screen);
+    ivec2 pixel = ivec2(gl_GlobalInvocationID.xy);
+    if (any(greaterThanEqual(pixel, resolution))) return;
+
+    // Nearest low resolution sample; sample k sits at k + 0.5 + jitter
+    vec2 lowPos = (vec2(pixel) + 0.5) * vec2(renderSize) / vec2(resolution);
+    ivec2 lowPixel = clamp(ivec2(floor(lowPos - jitter)), ivec2(0), renderSize - 1);
+    vec4 current = imageLoad(frame, lowPixel);
+    vec4 sampled = imageLoad(samples, lowPixel);
+
+    vec4 color = current;
+    if (historyValid)
+    {
+        vec2 previous = previousPixel(sampled.xyz, resolution);
+        if (all(greaterThanEqual(previous, vec2(0))) && all(lessThan(previous, vec2(resolution))))
+        {
+            // History is usable if what it saw is still around this pixel (edges flip between
+            // shapes as the jitter moves) and, if it is the same shape, hasn't moved
+            vec4 seen = imageLoad(historySamples, ivec2(previous));
+            float tolerance = positionTolerance * length(sampled.xyz - previousCameraPos) + 0.001;
+            bool moved = seen.w == sampled.w && distance(seen.xyz, sampled.xyz) > tolerance;
+
+            // Clamp to the neighbourhood of the sample to reject what has changed since
+            vec4 lo = current;
+            vec4 hi = current;
+            bool seenNearby = false;
+            for (int y = -1; y <= 1; y++) for (int x = -1; x <= 1; x++)
+            {
+                ivec2 neighbour = clamp(lowPixel + ivec2(x, y), ivec2(0), renderSize - 1);
+                vec4 neighbourColor = imageLoad(frame, neighbour);
+                lo = min(lo, neighbourColor);
+                hi = max(hi, neighbourColor);
+                seenNearby = seenNearby || imageLoad(samples, neighbour).w == seen.w;
+            }
+            if (seenNearby && !moved) color = mix(clamp(bilinearHistory(previous, resolution), lo, hi), current, frameWeight);
+        }
+    }
+
+    imageStore(screen, pixel, color);
+    imageStore(nextHistory, pixel, color);
+    imageStore(nextHistorySamples, pixel, sampled);
+    contacts[pixel.x + (pixel.y * resolution.x)] = int(sampled.w);
+}
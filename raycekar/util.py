@@ -1,6 +1,82 @@
-import logging
+import atexit, contextlib, copy, logging, os, pathlib, queue, tempfile
+from logging import handlers
 
 loggingHandler = logging.StreamHandler()
 loggingHandler.setLevel(logging.DEBUG)
 loggingFormatter = logging.Formatter('%(name)-9s %(levelname)-8s %(message)s')
 loggingHandler.setFormatter(loggingFormatter)
+
+
+### Disk caches ###
+def cacheDirectory(variable: str, name: str):
+    # The environment variable `variable` names the directory, or turns the cache off when set
+    # empty. Otherwise it is raycekar/`name` in the user's cache directory.
+    if variable in os.environ: return os.environ[variable] or None
+    cacheHome = os.environ.get('XDG_CACHE_HOME') or pathlib.Path.home().joinpath('.cache')
+    return pathlib.Path(cacheHome).joinpath('raycekar', name)
+
+@contextlib.contextmanager
+def atomicWrite(path, mode='wb'):
+    # Gives a temporary file next to `path`, renamed into place once the block ends so readers
+    # never see half a file. If anything fails the temporary file is removed.
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tempFile = tempfile.NamedTemporaryFile(mode, dir=path.parent, suffix='.tmp', delete=False)
+    try:
+        with tempFile: yield tempFile
+        os.replace(tempFile.name, path)
+    except BaseException:
+        try: os.unlink(tempFile.name)
+        except OSError: pass
+        raise
+
+
+### Logging ###
+# The rk.* module loggers have no level or handler of their own and inherit both from `rk`, so the
+# level is set here for all of them. RAYCEKAR_LOG_LEVEL (a name like WARNING, or a number) sets it
+# at import and RAYCEKAR_LOG_QUEUE=1 starts with `setLogQueued(True)`. Hot paths log with %-style
+# arguments or behind isEnabledFor, so messages below the level cost next to nothing.
+rkLogger = logging.getLogger('rk')
+rkLogger.addHandler(loggingHandler)
+_logListener = None
+
+class _deferredQueueHandler(handlers.QueueHandler):
+    # Merges the arguments into the message before queueing, since callers (event args, for one)
+    # may change them after the call. Only the handler's formatting and output run on the listener.
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+def setLogLevel(level):
+    # `level` is a logging level or its name
+    rkLogger.setLevel(level.upper() if isinstance(level, str) else level)
+
+def setLogQueued(enabled: bool):
+    # Hand records to a background thread for formatting and output, so the render thread
+    # never blocks on stderr
+    global _logListener
+    if enabled and _logListener is None:
+        records = queue.SimpleQueue()
+        _logListener = handlers.QueueListener(records, loggingHandler, respect_handler_level=True)
+        rkLogger.removeHandler(loggingHandler)
+        rkLogger.addHandler(_deferredQueueHandler(records))
+        _logListener.start()
+    elif not enabled and not _logListener is None:
+        for handler in [handler for handler in rkLogger.handlers if isinstance(handler, handlers.QueueHandler)]:
+            rkLogger.removeHandler(handler)
+        rkLogger.addHandler(loggingHandler)
+        _logListener.stop()     # Flushes what is queued
+        _logListener = None
+
+def _configureLogging():
+    level = os.environ.get('RAYCEKAR_LOG_LEVEL', 'DEBUG')
+    try: setLogLevel(int(level) if level.isdigit() else level)
+    except ValueError:
+        setLogLevel(logging.DEBUG)
+        rkLogger.warning('Unknown RAYCEKAR_LOG_LEVEL "%s", logging at DEBUG', level)
+    if not os.environ.get('RAYCEKAR_LOG_QUEUE', '').strip().lower() in ('', '0', 'false', 'no', 'off'): setLogQueued(True)
+    atexit.register(setLogQueued, False)
+
+_configureLogging()